@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'utils.middleware.ServerTimingMiddleware',  # first, to time the whole request.
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,6 +73,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'clickoh.wsgi.application'
+ASGI_APPLICATION = 'clickoh.asgi.application'
 
 
 # Database
@@ -109,6 +111,17 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# LocMemCache is per process, point it to Redis or Memcached to share the cached values between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
 
@@ -137,5 +150,19 @@ REST_FRAMEWORK = {
     'DATETIME_FORMAT': "%Y-%m-%d %H:%M:%S",
 }
 
-DOLAR_SI_URL = 'https://www.dolarsi.com'
+DOLAR_SI_URL = os.environ.get('DOLAR_SI_URL', 'https://www.dolarsi.com')  # or the dolarsi_stub command's URL.
+DOLAR_SI_CACHE_ALIAS = 'default'
+DOLAR_SI_CACHE_TTL = 60 * 5  # seconds a rate is fresh.
+DOLAR_SI_CACHE_STALE_TTL = 60 * 60  # seconds a stale rate is served while it is refreshed.
+PRODUCT_CACHE_ALIAS = 'default'
+PRODUCT_CACHE_TTL = 60 * 5  # seconds a product response is cached, if no product changes before.
+REQUEST_QUERY_BUDGET = 20  # queries per request, the ones over it are logged as warnings.
+REQUEST_LATENCY_BUDGET_MS = 500  # milliseconds per request, the ones over it are logged as warnings.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {'utils.middleware': {'handlers': ['console'], 'level': 'INFO'}},  # a JSON line per request.
+}
 DISABLE_COLLECTSTATIC = True
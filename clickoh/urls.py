@@ -22,4 +22,5 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('product/', include('products.urls')),
     path('order/', include('orders.urls')),
+    path('health/', include('utils.urls')),
 ]
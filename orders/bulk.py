@@ -0,0 +1,118 @@
+from django.db import IntegrityError, transaction
+from products.models import InsufficientStock, Product
+from rest_framework.serializers import ValidationError
+
+from orders.models import DailyProductSales, Order, OrderDetail
+from orders.serializers import OrderIngestSerializer
+
+
+class OrderBulkIngestor:
+    """
+    Validates a batch of orders with nested order_details using a few set-based queries and writes the valid ones
+    with bulk_create inside one transaction, which also reserves their stock. In strict mode nothing is written if
+    any order is invalid.
+    """
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, items, strict=False):
+        self.items = items
+        self.strict = strict
+        self.errors = []  # {"index": ..., "id": ..., "errors": ...} of each rejected order.
+        self.valid_orders = []
+        self.prices = {}
+        self.requested = {}  # quantity of each product requested by the valid orders.
+
+    def run(self):
+        if not isinstance(self.items, list):
+            raise ValidationError("Se esperaba una lista de ordenes.")
+        self._validate()
+        if self.strict and self.errors:
+            return {"created": 0, "created_ids": [], "errors": self.errors}
+        self._write()
+        return {
+            "created": len(self.valid_orders),
+            "created_ids": [order_data["id"] for order_data in self.valid_orders],
+            "errors": self.errors,
+        }
+
+    def _add_error(self, index, item, errors):
+        order_id = item.get("id") if isinstance(item, dict) else None
+        self.errors.append({"index": index, "id": order_id, "errors": errors})
+
+    def _validate(self):
+        shaped = []  # (index, validated_data) of the orders with a valid shape.
+        for index, item in enumerate(self.items):
+            serializer = OrderIngestSerializer(data=item)
+            if serializer.is_valid():
+                shaped.append((index, serializer.validated_data))
+            else:
+                self._add_error(index, item, serializer.errors)
+        order_ids = [order_data["id"] for index, order_data in shaped]
+        existing_order_ids = set(Order.objects.filter(id__in=order_ids).values_list("id", flat=True))
+        product_ids = {
+            detail["product_id"] for index, order_data in shaped for detail in order_data.get("order_details", [])
+        }
+        products = Product.objects.only("id", "name", "price", "stock").in_bulk(product_ids)
+        self.prices = {product_id: product.price for product_id, product in products.items()}
+        seen_order_ids = set()
+        for index, order_data in shaped:
+            order_id = order_data["id"]
+            if order_id in existing_order_ids or order_id in seen_order_ids:
+                self._add_error(index, order_data, {"id": [f"Ya existe una orden con el id {order_id}."]})
+                continue
+            errors = self._validate_order_details(order_data.get("order_details", []), products)
+            if errors:
+                self._add_error(index, order_data, {"order_details": errors})
+                continue
+            for detail in order_data.get("order_details", []):
+                product_id = detail["product_id"]
+                self.requested[product_id] = self.requested.get(product_id, 0) + detail["quantity"]
+            seen_order_ids.add(order_id)
+            self.valid_orders.append(order_data)
+        self.errors.sort(key=lambda error: error["index"])
+
+    def _validate_order_details(self, order_details, products):
+        errors = []
+        for detail in order_details:
+            product = products.get(detail["product_id"])
+            if product is None:
+                errors.append(f"No existe el producto {detail['product_id']}.")
+                continue
+            stock = product.stock - self.requested.get(product.id, 0)  # requested by the previous valid orders.
+            if stock < detail["quantity"]:
+                errors.append(f"No se puede pedir {detail['quantity']} de {product.name}, pues solo quedan {stock}.")
+        return errors
+
+    def _write(self):
+        orders = []
+        order_details = []
+        for order_data in self.valid_orders:
+            details = order_data.get("order_details", [])
+            order_kwargs = {
+                "id": order_data["id"],
+                "total": sum(self.prices[detail["product_id"]] * detail["quantity"] for detail in details),
+                "items_count": sum(detail["quantity"] for detail in details),
+            }
+            if "date" in order_data:
+                order_kwargs["date"] = order_data["date"]
+            orders.append(Order(**order_kwargs))
+            for detail in details:
+                order_details.append(
+                    OrderDetail(order_id=order_data["id"], product_id=detail["product_id"], quantity=detail["quantity"])
+                )
+        try:
+            with transaction.atomic():
+                Product.objects.reserve_stock(self.requested)
+                Order.objects.bulk_create(orders, batch_size=self.BATCH_SIZE)
+                OrderDetail.objects.bulk_create(order_details, batch_size=self.BATCH_SIZE)
+                DailyProductSales.objects.apply_detail_changes(
+                    [(detail.order_id, detail.product_id, detail.quantity, 1) for detail in order_details],
+                    {order.id: order.date for order in orders},
+                )
+        except IntegrityError:  # another request created some of these orders after they were validated.
+            raise ValidationError("Algunas ordenes fueron creadas por otro pedido, reintente la importacion.")
+        except InsufficientStock as exception:  # another request reserved the stock after it was validated.
+            raise ValidationError(
+                f"No queda stock suficiente del producto {exception.product_id}, reintente la importacion."
+            )
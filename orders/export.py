@@ -0,0 +1,107 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+from io import StringIO
+
+from django.utils.dateparse import parse_date
+from rest_framework.fields import DateTimeField
+from rest_framework.serializers import ValidationError
+
+from orders.models import Order, OrderDetail
+
+ORDER_FIELDS = ("id", "date", "created", "updated", "total", "items_count")
+CSV_HEADER = ("id", "date", "created", "updated", "total_pesos", "items_count", "detail_id", "product", "quantity")
+EXPORT_FORMATS = ("ndjson", "csv")
+DEFAULT_CHUNK_SIZE = 2000
+
+datetime_field = DateTimeField()  # formats like the API, with REST_FRAMEWORK's DATETIME_FORMAT.
+
+
+def parse_export_filters(params):
+    """
+    Parses the date_from, date_to and updated_since filters of the export, raising ValidationError. A date_to
+    without time includes its whole day.
+    """
+    filters = {}
+    lookups = {"date_from": "date__gte", "date_to": "date__lte", "updated_since": "updated__gte"}
+    for param, lookup in lookups.items():
+        value = params.get(param)
+        if not value:
+            continue
+        day = parse_day(value) if param == "date_to" else None
+        if day is not None:  # before the next day's midnight, so the date index is still range scanned.
+            filters["date__lt"] = datetime_field.enforce_timezone(datetime.combine(day + timedelta(days=1), time()))
+            continue
+        try:
+            filters[lookup] = datetime_field.to_internal_value(value)
+        except ValidationError as error:
+            raise ValidationError({param: error.detail})
+    return filters
+
+
+def parse_day(value):
+    """The date of a date-only value, like 2021-01-31, or None."""
+    try:
+        return parse_date(value)
+    except ValueError:  # an invalid date, rejected by the datetime parsing.
+        return None
+
+
+def iter_orders(filters, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields each order as a dict with its details. Orders are read through a server-side cursor and the details of
+    each chunk of orders with one query, so memory stays constant no matter how many orders are exported.
+    """
+    orders = Order.objects.filter(**filters).order_by("date", "id").values(*ORDER_FIELDS)
+    chunk = []
+    for order in orders.iterator(chunk_size=chunk_size):
+        chunk.append(order)
+        if len(chunk) == chunk_size:
+            yield from _with_details(chunk)
+            chunk = []
+    if chunk:
+        yield from _with_details(chunk)
+
+
+def _with_details(orders):
+    order_details = {order["id"]: [] for order in orders}
+    details = OrderDetail.objects.filter(order_id__in=order_details).order_by("id")
+    for detail in details.values("id", "order_id", "product_id", "quantity"):
+        order_details[detail["order_id"]].append(
+            {"id": detail["id"], "product": detail["product_id"], "quantity": detail["quantity"]}
+        )
+    for order in orders:
+        yield {
+            "id": order["id"],
+            "date": datetime_field.to_representation(order["date"]),
+            "created": datetime_field.to_representation(order["created"]) if order["created"] else None,
+            "updated": datetime_field.to_representation(order["updated"]),
+            "total_pesos": order["total"],
+            "items_count": order["items_count"],
+            "order_details": order_details[order["id"]],
+        }
+
+
+def iter_ndjson(orders):
+    for order in orders:
+        yield json.dumps(order) + "\n"
+
+
+def iter_csv(orders):
+    """One row per detail, repeating the order's columns; orders without details get a row with empty details."""
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for order in orders:
+        order_columns = [order[name] for name in CSV_HEADER[:6]]
+        for detail in order["order_details"] or [{"id": "", "product": "", "quantity": ""}]:
+            writer.writerow(order_columns + [detail["id"], detail["product"], detail["quantity"]])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()  # the header, when there aren't orders.
+
+
+def iter_export(export_format, filters, chunk_size=DEFAULT_CHUNK_SIZE):
+    orders = iter_orders(filters, chunk_size=chunk_size)
+    return iter_csv(orders) if export_format == "csv" else iter_ndjson(orders)
@@ -0,0 +1,132 @@
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from random import choice, randint, sample
+from threading import local
+from time import perf_counter
+from uuid import uuid4
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from products.models import Product
+from rest_framework.settings import api_settings
+
+from orders.models import Order, OrderDetail
+
+QUERIES_REGEX = re.compile(r'db;desc="(\d+) queries"')  # of the Server-Timing header.
+SAMPLE_SIZE = 1000  # ids read for the retrieve, create and patch requests.
+MAX_PAGE = 10
+
+
+def percentile(sorted_values, percent):
+    """Nearest rank percentile of sorted values."""
+    return sorted_values[max(0, ceil(percent / 100 * len(sorted_values)) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drives the list, retrieve, create and patch endpoints of a running server (run it with the generate_data "
+        "rows, and DOLAR_SI_URL pointing to the dolarsi_stub command) with concurrent requests, and reports the "
+        "p50/p95/p99 latency, throughput and queries per request (from Server-Timing) of each one as JSON, to compare "
+        "across commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--requests", type=int, default=200, help="Per scenario.")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--scenarios", help="Comma separated, all of them by default.")
+        parser.add_argument("--label", default="", help="Like the commit, to tell the reports apart.")
+        parser.add_argument("--output", help="File to write the JSON report, stdout by default.")
+
+    def handle(self, *args, **options):
+        self.base_url = options["base_url"].rstrip("/")
+        self.sessions = local()
+        self.product_ids = list(Product.objects.filter(stock__gte=100).values_list("id", flat=True)[:SAMPLE_SIZE])
+        self.order_ids = list(Order.objects.values_list("id", flat=True)[:SAMPLE_SIZE])
+        self.order_detail_ids = list(OrderDetail.objects.values_list("id", flat=True)[:SAMPLE_SIZE])
+        if not (self.product_ids and self.order_ids and self.order_detail_ids):
+            raise CommandError("There aren't products with stock, orders and details, run generate_data first.")
+        self.product_pages = self.get_pages(Product.objects.count())
+        self.order_pages = self.get_pages(Order.objects.count())
+        scenarios = self.get_scenarios()
+        names = options["scenarios"].split(",") if options["scenarios"] else list(scenarios)
+        unknown = set(names) - set(scenarios)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}. Use {', '.join(scenarios)}.")
+        report = {
+            "label": options["label"],
+            "base_url": self.base_url,
+            "concurrency": options["concurrency"],
+            "requests": options["requests"],
+            "scenarios": {
+                name: self.run_scenario(scenarios[name], options["requests"], options["concurrency"]) for name in names
+            },
+        }
+        content = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                output.write(content)
+        else:
+            self.stdout.write(content)
+
+    def get_scenarios(self):
+        """Functions returning the (method, path, JSON body) of a request of each scenario."""
+        return {
+            "products-list": lambda: ("get", f"/product/?page={randint(1, self.product_pages)}", None),
+            "products-retrieve": lambda: ("get", f"/product/{choice(self.product_ids)}/", None),
+            "orders-list": lambda: ("get", f"/order/orders/?page={randint(1, self.order_pages)}", None),
+            "orders-retrieve": lambda: ("get", f"/order/orders/{choice(self.order_ids)}/", None),
+            "orders-create": self.get_create_request,
+            "order-details-patch": lambda: (
+                "patch",
+                f"/order/order-details/{choice(self.order_detail_ids)}/",
+                {"quantity": randint(1, 3)},
+            ),
+        }
+
+    def get_pages(self, count):
+        """The pages of the lists requested, the first ones up to MAX_PAGE."""
+        return max(1, min(MAX_PAGE, ceil(count / api_settings.PAGE_SIZE)))
+
+    def get_create_request(self):
+        product_ids = sample(self.product_ids, min(randint(1, 3), len(self.product_ids)))
+        order_details = [{"product_id": product_id, "quantity": 1} for product_id in product_ids]
+        return "post", "/order/orders/", {"id": f"bench-{uuid4().hex[:14]}", "order_details": order_details}
+
+    def run_scenario(self, get_request, count, concurrency):
+        started = perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(lambda x: self.send(*get_request()), range(count)))
+        seconds = perf_counter() - started
+        latencies = sorted(latency for latency, status, queries in results)
+        queries = [queries for latency, status, queries in results if queries is not None]
+        return {
+            "requests": count,
+            "errors": sum(1 for latency, status, queries in results if status >= 400),
+            "seconds": round(seconds, 3),
+            "throughput_rps": round(count / seconds, 1) if seconds else None,
+            "latency_ms": {
+                name: round(percentile(latencies, percent) * 1000, 1) if latencies else None
+                for name, percent in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+            },
+            "queries_per_request": {
+                "mean": round(sum(queries) / len(queries), 1) if queries else None,
+                "max": max(queries) if queries else None,
+            },
+        }
+
+    def send(self, method, path, data):
+        """Returns the (seconds, status code, queries) of the request, status 599 if it couldn't be sent."""
+        session = getattr(self.sessions, "session", None)
+        if session is None:
+            session = self.sessions.session = requests.Session()
+        started = perf_counter()
+        try:
+            response = session.request(method, f"{self.base_url}{path}", json=data, timeout=30)
+        except requests.exceptions.RequestException:
+            return perf_counter() - started, 599, None
+        seconds = perf_counter() - started
+        match = QUERIES_REGEX.search(response.headers.get("Server-Timing", ""))
+        return seconds, response.status_code, int(match.group(1)) if match else None
@@ -0,0 +1,74 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+from products.models import Product
+from products.serializers import (PRODUCT_FIELDS, ProductSerializer,
+                                  represent_products)
+from rest_framework.renderers import JSONRenderer
+
+from orders.models import ExchangeRate, Order, OrderDetail
+from orders.requester import DOLAR_BLUE, DolarSiRequester
+from orders.serializers import ORDER_FIELDS, OrderSerializer, represent_orders
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the rows per second of the list serializers against the .values() read path of the list "
+        "endpoints, reading and rendering the first --rows products and orders, and checks their JSON is the same."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=5, help="Runs of each path, the best one is reported.")
+        parser.add_argument(
+            "--buy-value", type=float, help="Dolar blue buy value if there are no stored rates, DolarSi's by default."
+        )
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        buy_value = options["buy_value"]
+        if buy_value is None and not ExchangeRate.objects.filter(name=DOLAR_BLUE, buy__isnull=False).exists():
+            buy_value = DolarSiRequester().get_dolar_blue_buy_value()  # only used without stored rates.
+        products = Product.objects.order_by("id")[:rows]
+        orders = Order.objects.with_dolar_blue_buy_value().order_by("id")[:rows]  # like the list, for both paths.
+        order_details = Prefetch("order_details", OrderDetail.objects.order_by("id"))
+        paths = {
+            "products": (
+                lambda: ProductSerializer(list(products), many=True).data,
+                lambda: represent_products(products.values(*PRODUCT_FIELDS)),
+            ),
+            "orders": (
+                lambda: OrderSerializer(
+                    list(orders.prefetch_related(order_details)),
+                    many=True,
+                    context={"dolar_blue_buy_value": buy_value},
+                ).data,
+                lambda: represent_orders(list(orders.values(*ORDER_FIELDS, "dolar_blue_buy_value")), buy_value),
+            ),
+        }
+        renderer = JSONRenderer()
+        for name, (serializer_path, values_path) in paths.items():
+            serializer_json, serializer_seconds = self._run(renderer, serializer_path, options["repeat"])
+            values_json, values_seconds = self._run(renderer, values_path, options["repeat"])
+            if serializer_json != values_json:
+                raise CommandError(f"The {name} JSON of both paths is different.")
+            count = len(products) if name == "products" else len(orders)
+            self.stdout.write(
+                f"{name}: {count} rows, serializer {self._rate(count, serializer_seconds)} rows/s, "
+                f"values {self._rate(count, values_seconds)} rows/s, "
+                f"{serializer_seconds / values_seconds if values_seconds else 0:.1f}x faster"
+            )
+
+    def _run(self, renderer, path, repeat):
+        """Returns the rendered JSON and the best seconds of `repeat` runs of the path, querying and rendering."""
+        best_seconds = None
+        for x in range(repeat):
+            started = perf_counter()
+            content = renderer.render(path())
+            seconds = perf_counter() - started
+            best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+        return content, best_seconds
+
+    def _rate(self, count, seconds):
+        return round(count / seconds) if seconds else count
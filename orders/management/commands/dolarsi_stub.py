@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from orders.stub import make_stub_server
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves a local stand-in for DolarSi's main values, with configurable latency and failure rate, for "
+        "benchmarks. Run the API with DOLAR_SI_URL=http://<host>:<port>."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument("--latency-ms", type=float, default=50)
+        parser.add_argument("--jitter-ms", type=float, default=0, help="Latency varies up to this, both ways.")
+        parser.add_argument("--failure-rate", type=float, default=0, help="Fraction of 503 responses, 0 to 1.")
+        parser.add_argument("--blue-buy", type=float, default=182.0)
+        parser.add_argument("--blue-sell", type=float, default=185.0)
+        parser.add_argument("--verbose", action="store_true", help="Log every request.")
+
+    def handle(self, *args, **options):
+        server = make_stub_server(
+            host=options["host"],
+            port=options["port"],
+            latency=options["latency_ms"] / 1000,
+            jitter=options["jitter_ms"] / 1000,
+            failure_rate=options["failure_rate"],
+            blue_buy=options["blue_buy"],
+            blue_sell=options["blue_sell"],
+            verbose=options["verbose"],
+        )
+        host, port = server.server_address[:2]
+        self.stdout.write(f"DolarSi stub listening on http://{host}:{port}, run the API with that DOLAR_SI_URL.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
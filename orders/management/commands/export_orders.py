@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.serializers import ValidationError
+
+from orders.export import (DEFAULT_CHUNK_SIZE, EXPORT_FORMATS, iter_export,
+                           parse_export_filters)
+
+
+class Command(BaseCommand):
+    help = "Streams the orders with their details and totals as NDJSON or CSV, with constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson", dest="export_format")
+        parser.add_argument("--output", help="File to write, stdout by default.")
+        parser.add_argument("--date-from", dest="date_from")
+        parser.add_argument("--date-to", dest="date_to")
+        parser.add_argument("--updated-since", dest="updated_since")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_export_filters(options)
+        except ValidationError as error:
+            raise CommandError(error.detail)
+        chunks = iter_export(options["export_format"], filters, chunk_size=options["chunk_size"])
+        if not options["output"]:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+        with open(options["output"], "w", newline="") as output:
+            for chunk in chunks:
+                output.write(chunk)
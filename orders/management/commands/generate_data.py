@@ -0,0 +1,129 @@
+import csv
+from datetime import timedelta
+from io import StringIO
+from random import Random
+from time import monotonic
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.timezone import now
+from products.cache import invalidate_products
+from products.models import Product
+
+from orders.models import DailyProductSales, Order, OrderDetail
+
+NAME_WORDS = (
+    "Mate", "Yerba", "Termo", "Bombilla", "Alfajor", "Dulce", "Leche", "Cafe", "Te", "Galletitas", "Vino", "Tinto",
+    "Blanco", "Queso", "Pan", "Aceite", "Harina", "Arroz", "Fideos", "Salsa", "Tomate", "Jabon", "Shampoo", "Papel",
+)
+
+
+def parse_distribution(value):
+    """Parses "details:weight" pairs, like "1:30,2:70", into (details counts, weights)."""
+    try:
+        pairs = [pair.split(":") for pair in value.split(",")]
+        counts, weights = zip(*((int(count), float(weight)) for count, weight in pairs))
+    except ValueError:
+        raise CommandError(f"Invalid --details distribution: {value}, use details:weight pairs like 1:30,2:70.")
+    if min(counts) < 1 or min(weights) < 0 or not sum(weights):
+        raise CommandError("The --details counts must be positive and some weight must be.")
+    return counts, weights
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates products, orders and order details with batched bulk inserts (COPY on PostgreSQL), for benchmarks "
+        "at realistic volume, then rebuilds the daily sales rollup. The details per order follow the --details "
+        "distribution. Stock isn't reserved by the generated orders."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=10000, help="0 uses the existing products.")
+        parser.add_argument("--orders", type=int, default=100000)
+        parser.add_argument(
+            "--details", default="1:30,2:30,3:20,5:15,20:5", help="Details per order and their weights, like 1:30,2:70."
+        )
+        parser.add_argument("--days", type=int, default=365, help="The orders' dates spread over the last days.")
+        parser.add_argument("--prefix", default="gen", help="Of the generated ids, which must be unused.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, help="For the same data on every run.")
+
+    def handle(self, *args, **options):
+        counts, weights = parse_distribution(options["details"])
+        prefix = options["prefix"]
+        if len(f"{prefix}-{max(options['products'], options['orders'])}") > 20:
+            raise CommandError("The generated ids would be longer than 20 characters, use a shorter --prefix.")
+        ids_prefix = f"{prefix}-"
+        for model in (Product, Order):
+            if model.objects.filter(id__startswith=ids_prefix).exists():
+                raise CommandError(f"There are ids starting with {ids_prefix} already, use another --prefix.")
+        self.random = Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        started = monotonic()
+        if options["products"]:
+            products = self.generate_products(ids_prefix, options["products"])
+        else:
+            products = list(Product.objects.values_list("id", "price"))
+        if not products and options["orders"]:
+            raise CommandError("There aren't products for the orders.")
+        details_count = self.generate_orders(ids_prefix, options["orders"], products, counts, weights, options["days"])
+        DailyProductSales.objects.rebuild()
+        invalidate_products()
+        seconds = monotonic() - started
+        rows = options["products"] + options["orders"] + details_count
+        self.stdout.write(
+            f"Generated {options['products']} products, {options['orders']} orders and {details_count} details in "
+            f"{seconds:.1f} seconds, {round(rows / seconds) if seconds else rows} rows/s."
+        )
+
+    def generate_products(self, ids_prefix, count):
+        """Inserts the products, returns their (id, price)."""
+        products = []
+        timestamp = now()
+        for start in range(0, count, self.batch_size):
+            rows = []
+            for number in range(start, min(start + self.batch_size, count)):
+                name = f"{self.random.choice(NAME_WORDS)} {self.random.choice(NAME_WORDS)} {number}"
+                price = round(self.random.uniform(100, 5000), 2)
+                rows.append((f"{ids_prefix}{number}", name, price, self.random.randint(0, 1000), timestamp, timestamp))
+                products.append((rows[-1][0], price))
+            with transaction.atomic():
+                self.insert(Product, ("id", "name", "price", "stock", "created", "updated"), rows)
+        return products
+
+    def generate_orders(self, ids_prefix, count, products, counts, weights, days):
+        """Inserts the orders with their details and totals, returns the number of details."""
+        details_count = 0
+        timestamp = now()
+        for start in range(0, count, self.batch_size):
+            orders = []
+            order_details = []
+            for number in range(start, min(start + self.batch_size, count)):
+                order_id = f"{ids_prefix}{number}"
+                details = self.random.choices(counts, weights)[0]
+                total = items_count = 0
+                for index in self.random.sample(range(len(products)), min(details, len(products))):
+                    product_id, price = products[index]
+                    quantity = self.random.randint(1, 5)
+                    total += price * quantity
+                    items_count += quantity
+                    order_details.append((order_id, product_id, quantity, timestamp, timestamp))
+                date = timestamp - timedelta(seconds=self.random.uniform(0, days * 24 * 60 * 60))
+                orders.append((order_id, date, total, items_count, timestamp, timestamp))
+            with transaction.atomic():
+                self.insert(Order, ("id", "date", "total", "items_count", "created", "updated"), orders)
+                self.insert(OrderDetail, ("order_id", "product_id", "quantity", "created", "updated"), order_details)
+            details_count += len(order_details)
+        return details_count
+
+    def insert(self, model, fields, rows):
+        """Inserts the rows, tuples of the fields' values, with COPY on PostgreSQL and bulk_create elsewhere."""
+        if connection.vendor != "postgresql":
+            model.objects.bulk_create([model(**dict(zip(fields, row))) for row in rows])
+            return
+        buffer = StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        copy = f"COPY {model._meta.db_table} ({', '.join(fields)}) FROM STDIN WITH (FORMAT csv)"
+        with connection.cursor() as cursor:
+            cursor.copy_expert(copy, buffer)
@@ -0,0 +1,34 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from orders.models import ExchangeRate
+from orders.requester import main_values_cache, parse_main_values
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetches DolarSi's main values and stores the quotes that changed in the exchange rates table, also "
+        "refreshing the shared rate cache. Run it periodically, or with --interval as a worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, help="Seconds between refreshes, to keep running as a worker.")
+
+    def handle(self, *args, **options):
+        interval = options["interval"]
+        while True:
+            try:
+                self.refresh()
+            except Exception as exception:
+                if not interval:
+                    raise
+                self.stderr.write(f"Refresh failed, retrying in {interval} seconds: {exception}")
+            if not interval:
+                return
+            sleep(interval)
+
+    def refresh(self):
+        quotes = parse_main_values(main_values_cache.refresh())
+        stored = ExchangeRate.objects.store_quotes(quotes)
+        self.stdout.write(f"Fetched {len(quotes)} quotes, stored {len(stored)} changed rates.")
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = "Verifies the stored total and items count of the orders against their details, and repairs the drift."
+
+    TOLERANCE = 0.005  # stored totals are floats accumulated by increments.
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="Only report the drifted orders.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        checked = drifted = 0
+        last_id = None
+        while True:
+            orders = Order.objects.order_by("id").only("id", "total", "items_count")
+            if last_id is not None:
+                orders = orders.filter(id__gt=last_id)
+            orders = list(orders.with_totals()[:batch_size])
+            if not orders:
+                break
+            last_id = orders[-1].id
+            checked += len(orders)
+            drifted_ids = [
+                order.id
+                for order in orders
+                if abs(order.total - order.annotated_total) > self.TOLERANCE
+                or order.items_count != order.annotated_items_count
+            ]
+            drifted += len(drifted_ids)
+            if drifted_ids and not options["dry_run"]:
+                # recomputed inside the UPDATE, so increments made since the check aren't overwritten by stale values.
+                Order.objects.filter(id__in=drifted_ids).recompute_totals()
+        action = "found" if options["dry_run"] else "repaired"
+        self.stdout.write(f"Checked {checked} orders, {action} {drifted} with drifted totals.")
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from rest_framework.fields import DateTimeField
+from rest_framework.serializers import ValidationError
+
+from orders.models import DailyProductSales
+
+
+class Command(BaseCommand):
+    help = (
+        "Catches the daily sales rollup up with the orders, details and products updated since --since (by default "
+        "since the last rollup update), rebuilding their days. --rebuild recomputes every day, also after orders "
+        "deleted without their signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="Datetime, like 2021-01-31 or 2021-01-31 12:00.")
+        parser.add_argument("--rebuild", action="store_true", help="Recompute every day.")
+
+    def handle(self, *args, **options):
+        since = self._get_since(options["since"])
+        if options["rebuild"] or since is None:
+            created = DailyProductSales.objects.rebuild()
+            self.stdout.write(f"Rebuilt every day, {created} rows.")
+            return
+        days = DailyProductSales.objects.catch_up(since)
+        self.stdout.write(f"Rebuilt {len(days)} days updated since {since.isoformat()}.")
+
+    def _get_since(self, value):
+        if value is None:
+            return DailyProductSales.objects.aggregate(last_updated=Max("updated"))["last_updated"]
+        try:
+            return DateTimeField().to_internal_value(value)
+        except ValidationError as error:
+            raise CommandError({"since": error.detail})
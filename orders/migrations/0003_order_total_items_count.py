@@ -0,0 +1,39 @@
+# Generated by Django 3.2.8 on 2026-10-18 08:51
+
+from django.db import migrations, models
+from django.db.models import F, FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    OrderDetail = apps.get_model('orders', 'OrderDetail')
+    details = OrderDetail.objects.filter(order_id=OuterRef('pk')).values('order_id')
+    totals = details.annotate(total=Sum(F('product__price') * F('quantity'))).values('total')
+    items_counts = details.annotate(items_count=Sum('quantity')).values('items_count')
+    Order.objects.update(
+        total=Coalesce(Subquery(totals, output_field=FloatField()), Value(0.0)),
+        items_count=Coalesce(Subquery(items_counts), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+        ('orders', '0002_alter_order_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
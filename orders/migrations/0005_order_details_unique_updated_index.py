@@ -0,0 +1,43 @@
+# Generated by Django 3.2.8 on 2026-10-18 08:59
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicated_details(apps, schema_editor):
+    """Merges the details repeating a product of their order into the first one, so the constraint can be added."""
+    OrderDetail = apps.get_model('orders', 'OrderDetail')
+    duplicates = (
+        OrderDetail.objects.values('order_id', 'product_id')
+        .annotate(count=Count('id'), first_id=Min('id'), quantity=Sum('quantity'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        details = OrderDetail.objects.filter(order_id=duplicate['order_id'], product_id=duplicate['product_id'])
+        details.exclude(id=duplicate['first_id']).delete()
+        details.filter(id=duplicate['first_id']).update(quantity=duplicate['quantity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_order_orders_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicated_details, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='orderdetail',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddConstraint(
+            model_name='orderdetail',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='order_details_order_product_uniq'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.8 on 2026-10-18 09:11
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_order_details_unique_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, null=True)),
+                ('updated', models.DateTimeField(auto_now=True, db_index=True)),
+                ('name', models.CharField(max_length=50)),
+                ('buy', models.FloatField(null=True)),
+                ('sell', models.FloatField(null=True)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'exchange_rates',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='exchangerate',
+            constraint=models.UniqueConstraint(fields=('name', 'date'), name='exchange_rates_name_date_uniq'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.8 on 2026-10-18 09:15
+
+from django.db import migrations, models
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def rollup_daily_sales(apps, schema_editor):
+    """Fills the rollup from the existing details, like DailyProductSales.objects.rebuild()."""
+    OrderDetail = apps.get_model('orders', 'OrderDetail')
+    DailyProductSales = apps.get_model('orders', 'DailyProductSales')
+    rows = (
+        OrderDetail.objects.annotate(day=TruncDate('order__date'))
+        .values('day', 'product_id')
+        .annotate(
+            revenue=Sum(F('product__price') * F('quantity'), output_field=FloatField()),
+            units=Sum('quantity'),
+            orders_count=Count('id'),
+        )
+        .order_by()
+    )
+    DailyProductSales.objects.bulk_create((DailyProductSales(**row) for row in rows.iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_alter_product_updated'),
+        ('orders', '0006_exchangerate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, null=True)),
+                ('updated', models.DateTimeField(auto_now=True, db_index=True)),
+                ('day', models.DateField()),
+                ('revenue', models.FloatField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('orders_count', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='products.product')),
+            ],
+            options={
+                'db_table': 'daily_product_sales',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyproductsales',
+            constraint=models.UniqueConstraint(fields=('day', 'product'), name='daily_product_sales_day_product_uniq'),
+        ),
+        migrations.RunPython(rollup_daily_sales, migrations.RunPython.noop),
+    ]
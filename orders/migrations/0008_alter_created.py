@@ -0,0 +1,41 @@
+# Generated by Django 3.2.8 on 2026-10-18 10:05
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_created(apps, schema_editor):
+    """Sets the missing created of every model's rows to their updated, so the column can be NOT NULL."""
+    for model_name in ('Order', 'OrderDetail', 'ExchangeRate', 'DailyProductSales'):
+        apps.get_model('orders', model_name).objects.filter(created__isnull=True).update(created=F('updated'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_daily_product_sales'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_created, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='dailyproductsales',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='exchangerate',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='orderdetail',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+    ]
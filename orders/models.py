@@ -2,46 +2,392 @@ from datetime import datetime
 
 from django.conf import settings
 from django.core.validators import MinValueValidator
-from django.db.models import (CASCADE, CharField, DateTimeField, F, ForeignKey,
-                              IntegerField, Sum)
+from django.db import connections, transaction
+from django.db.models import (CASCADE, Case, CharField, Count, DateField,
+                              DateTimeField, F, FloatField, ForeignKey, Index,
+                              IntegerField, OuterRef, PositiveIntegerField,
+                              QuerySet, Subquery, Sum, UniqueConstraint, Value,
+                              When)
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils.timezone import is_naive, localdate, make_aware, now
+from products.models import Product
 from utils.models import TimeStampModel
 
-from orders.requester import DolarSiRequester
+from orders.requester import DOLAR_BLUE, DolarSiRequester
+
+
+class ExchangeRateQuerySet(QuerySet):
+    def store_quotes(self, quotes, date=None):
+        """
+        Stores the (name, buy value, sell value) quotes that changed since the last rate stored of their name, so
+        the table keeps when each rate came into effect. Returns the stored rates.
+        """
+        names = {name for name, buy, sell in quotes}
+        last_dates = self.filter(name=OuterRef("name")).order_by("-date").values("date")[:1]
+        last_rates = self.filter(name__in=names, date=Subquery(last_dates))
+        last_quotes = {rate.name: (rate.buy, rate.sell) for rate in last_rates}
+        date = date or now()
+        rates = [
+            ExchangeRate(name=name, buy=buy, sell=sell, date=date)
+            for name, buy, sell in quotes
+            if last_quotes.get(name) != (buy, sell)
+        ]
+        return self.bulk_create(rates, ignore_conflicts=True)
+
+    def buy_values_at(self, date_expression, name=DOLAR_BLUE):
+        """
+        Subquery of the buy value in effect at the date, the last one stored at or before it, or the first one for
+        older dates. Both are lookups of the exchange_rates_name_date_uniq index.
+        """
+        rates = self.filter(name=name, buy__isnull=False)
+        at_date = rates.filter(date__lte=date_expression).order_by("-date").values("buy")[:1]
+        first = rates.order_by("date").values("buy")[:1]
+        return Coalesce(Subquery(at_date), Subquery(first))
+
+    def buy_value_at(self, date, name=DOLAR_BLUE):
+        """The buy value in effect at the date, like buy_values_at, or None if there aren't rates of the quote."""
+        rates = self.filter(name=name, buy__isnull=False)
+        buy_value = rates.filter(date__lte=date).order_by("-date").values_list("buy", flat=True).first()
+        if buy_value is None:
+            buy_value = rates.order_by("date").values_list("buy", flat=True).first()
+        return buy_value
+
+
+class ExchangeRate(TimeStampModel):
+    """A quote of DolarSi's main values, stored by the refresh_exchange_rates command."""
+
+    name = CharField(max_length=50)
+    buy = FloatField(null=True)  # null when it doesn't quote.
+    sell = FloatField(null=True)
+    date = DateTimeField(default=now)  # when it was fetched.
+
+    objects = ExchangeRateQuerySet.as_manager()
+
+    class Meta:
+        db_table = "exchange_rates"
+        constraints = [UniqueConstraint(fields=["name", "date"], name="exchange_rates_name_date_uniq")]
+
+    def __str__(self):
+        return f"name={self.name}, buy={self.buy}, sell={self.sell}, date={self.date.strftime('%Y-%m-%d %H:%M:%S')}"
+
+
+class OrderQuerySet(QuerySet):
+    """
+    Order.total and Order.items_count are maintained incrementally in the same transaction that changes the details.
+    Totals follow the current price of the products, so a price change reprices the orders that contain it.
+    """
+
+    def with_totals(self):
+        """Annotates each order's total price and items count computed from its details, to verify the stored ones."""
+        return self.annotate(
+            annotated_total=Coalesce(
+                Sum(F("order_details__product__price") * F("order_details__quantity")), Value(0.0)
+            ),
+            annotated_items_count=Coalesce(Sum("order_details__quantity"), Value(0)),
+        )
+
+    def with_dolar_blue_buy_value(self):
+        """Annotates the dolar blue's buy value in effect at each order's date, used by get_total_usd."""
+        return self.annotate(dolar_blue_buy_value=ExchangeRate.objects.buy_values_at(OuterRef("date")))
+
+    def recompute_totals(self):
+        """Sets the stored totals from the details, with a single UPDATE."""
+        details = OrderDetail.objects.filter(order_id=OuterRef("pk")).values("order_id")
+        totals = details.annotate(total=Sum(F("product__price") * F("quantity"))).values("total")
+        items_counts = details.annotate(items_count=Sum("quantity")).values("items_count")
+        return self.update(
+            total=Coalesce(Subquery(totals, output_field=FloatField()), Value(0.0)),
+            items_count=Coalesce(Subquery(items_counts), Value(0)),
+            updated=now(),
+        )
+
+    def increment_totals(self, deltas):
+        """Adds the (total, items count) delta of each order id, with a single UPDATE."""
+        deltas = {order_id: delta for order_id, delta in deltas.items() if delta != (0, 0)}
+        if not deltas:
+            return
+        total_whens = [When(pk=order_id, then=Value(float(total))) for order_id, (total, items) in deltas.items()]
+        items_whens = [When(pk=order_id, then=Value(items)) for order_id, (total, items) in deltas.items()]
+        self.filter(pk__in=deltas).update(
+            total=F("total") + Case(*total_whens, default=Value(0.0), output_field=FloatField()),
+            items_count=F("items_count") + Case(*items_whens, default=Value(0), output_field=IntegerField()),
+            updated=now(),
+        )
+
+    def apply_detail_changes(self, changes):
+        """Updates the totals with the (order id, product id, quantity delta) of the changed details."""
+        prices = dict(Product.objects.filter(pk__in={change[1] for change in changes}).values_list("id", "price"))
+        deltas = {}
+        for order_id, product_id, quantity in changes:
+            total, items = deltas.get(order_id, (0, 0))
+            deltas[order_id] = (total + prices.get(product_id, 0) * quantity, items + quantity)
+        self.increment_totals(deltas)
+
+    def reprice_product(self, product_id, price_delta):
+        """Updates the totals of the orders that contain the product, after its price changed by price_delta."""
+        quantities = (
+            OrderDetail.objects.filter(order_id=OuterRef("pk"), product_id=product_id)
+            .values("order_id")
+            .annotate(quantity=Sum("quantity"))
+            .values("quantity")
+        )
+        self.filter(order_details__product_id=product_id).update(
+            total=F("total") + Subquery(quantities, output_field=FloatField()) * Value(float(price_delta)),
+            updated=now(),
+        )
 
 
 class Order(TimeStampModel):
     id = CharField(max_length=20, primary_key=True)
     date = DateTimeField(default=datetime.now)
+    # denormalized from the order details, see OrderQuerySet.
+    total = FloatField(default=0)
+    items_count = PositiveIntegerField(default=0)
+
+    objects = OrderQuerySet.as_manager()
 
     class Meta:
         db_table = "orders"
+        indexes = [Index(fields=["date", "id"], name="orders_date_id_idx")]  # keyset pagination.
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Keeps the loaded date, to move the sales of its details to another day when it changes."""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_date = instance.__dict__.get("date")
+        return instance
 
     def __str__(self):
         return f"id={self.id}, date={self.date.strftime('%Y-%m-%d %H:%M:%S')}"
 
     def get_total(self):
-        """Calculates the order's total price."""
-        order_details = self.order_details.aggregate(total=Sum(F("product__price") * F("quantity")))
-        return order_details["total"]
-
-    def get_total_usd(self):
-        """Get dolar_values, find dolar blue's buy value and return total in dolars"""
-        dolar_values = DolarSiRequester().get_main_values()
-        for dolar_value in dolar_values:
-            stand = dolar_value["casa"]
-            if stand["nombre"] == "Dolar Blue":
-                break
-        buy_value = float(stand["compra"].replace(",", "."))  # quizas Decimal
+        """The order's total price, stored when its details change."""
+        return self.total
+
+    def get_total_usd(self, buy_value=None):
+        """Return total in dolars, with dolar blue's buy value in effect at the order's date if it isn't given."""
+        if buy_value is None:
+            buy_value = self.get_dolar_blue_buy_value()
         return round(self.get_total() / buy_value, 2)
 
+    def get_dolar_blue_buy_value(self, live_buy_value=None):
+        """
+        The dolar blue's buy value in effect at the order's date, annotated by with_dolar_blue_buy_value or looked up.
+        Without stored rates, the live one: live_buy_value if it is given, or from the shared rate cache.
+        """
+        if hasattr(self, "dolar_blue_buy_value"):
+            buy_value = self.dolar_blue_buy_value
+        else:
+            buy_value = ExchangeRate.objects.buy_value_at(self.date)
+        if buy_value is None:
+            buy_value = live_buy_value if live_buy_value is not None else DolarSiRequester().get_dolar_blue_buy_value()
+        return buy_value
+
+
+class OrderDetailQuerySet(QuerySet):
+    def release_and_delete(self):
+        """
+        Deletes the details with a single DELETE, without the post_delete of each one (see release_order_detail):
+        their stock is released and they are subtracted from the totals and sales rollup all at once. Returns the ids
+        of the deleted details.
+        """
+        with transaction.atomic(using=self.db, savepoint=False):
+            order_details = list(self.select_for_update().values_list("pk", "order_id", "product_id", "quantity"))
+            if not order_details:
+                return []
+            quantities = {}
+            for pk, order_id, product_id, quantity in order_details:
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+            changes = [(order_id, product_id, -quantity, -1) for pk, order_id, product_id, quantity in order_details]
+            Product.objects.release_stock(quantities)
+            Order.objects.apply_detail_changes([change[:3] for change in changes])
+            DailyProductSales.objects.apply_detail_changes(changes)
+            ids = [order_detail[0] for order_detail in order_details]
+            self.model.objects.filter(pk__in=ids)._raw_delete(self.db)
+        return ids
+
 
 class OrderDetail(TimeStampModel):
     order = ForeignKey(Order, on_delete=CASCADE, related_name="order_details")
     product = ForeignKey("products.Product", on_delete=CASCADE, related_name="order_details")
     quantity = IntegerField(validators=[MinValueValidator(1)])
 
+    objects = OrderDetailQuerySet.as_manager()
+
     class Meta:
         db_table = "order_details"
+        # a product once per order. Its index also serves the lookups by order; the product FK has its own index.
+        constraints = [UniqueConstraint(fields=["order", "product"], name="order_details_order_product_uniq")]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Keeps the loaded values, to know how much to subtract from the totals when it is updated."""
+        instance = super().from_db(db, field_names, values)
+        instance.set_loaded_values()
+        return instance
+
+    def set_loaded_values(self):
+        self._loaded_values = {name: self.__dict__.get(name) for name in ("order_id", "product_id", "quantity")}
 
     def __str__(self):
         return f"order={self.order.id}, product={self.product.id}, quantity={self.quantity}"
+
+
+def get_sales_day(date):
+    """The day of an order's date in the current timezone, like TruncDate does in the database."""
+    date = Order._meta.get_field("date").to_python(date)
+    return localdate(make_aware(date) if is_naive(date) else date)
+
+
+class DailyProductSalesQuerySet(QuerySet):
+    """
+    The rollup is kept up to date in the same transaction that changes the details (see orders.signals), like the
+    order totals, and its revenue follows the current price of the products too. The rollup_daily_sales command
+    rebuilds the days changed by other means.
+    """
+
+    def apply_changes(self, changes):
+        """
+        Adds the (day, product id, units delta, orders delta) changes to their rows, at the current price of the
+        products. A single INSERT ... ON CONFLICT DO UPDATE, so concurrent changes of a row add up.
+        """
+        totals = {}
+        for day, product_id, units, orders_count in changes:
+            total_units, total_orders_count = totals.get((day, product_id), (0, 0))
+            totals[(day, product_id)] = (total_units + units, total_orders_count + orders_count)
+        totals = {key: total for key, total in totals.items() if total != (0, 0)}
+        if not totals:
+            return
+        product_ids = {product_id for day, product_id in totals}
+        prices = dict(Product.objects.filter(pk__in=product_ids).values_list("id", "price"))
+        connection = connections[self.db]
+        day_field = self.model._meta.get_field("day")
+        timestamp = self.model._meta.get_field("updated").get_db_prep_value(now(), connection)
+        rows = [
+            (
+                day_field.get_db_prep_value(day, connection),
+                product_id,
+                prices.get(product_id, 0) * units,
+                units,
+                orders_count,
+                timestamp,
+                timestamp,
+            )
+            for (day, product_id), (units, orders_count) in totals.items()
+        ]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {table} (day, product_id, revenue, units, orders_count, created, updated) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s) ON CONFLICT (day, product_id) DO UPDATE SET "
+                f"revenue = {table}.revenue + EXCLUDED.revenue, units = {table}.units + EXCLUDED.units, "
+                f"orders_count = {table}.orders_count + EXCLUDED.orders_count, updated = EXCLUDED.updated",
+                rows,
+            )
+        if any(orders_count < 0 for units, orders_count in totals.values()):
+            days = {day for day, product_id in totals}
+            self.filter(day__in=days, product_id__in=product_ids, orders_count__lte=0).delete()
+
+    def apply_detail_changes(self, changes, order_dates=None):
+        """
+        Adds the (order id, product id, quantity delta, details delta) changes of order details to the rows of their
+        orders' days. order_dates ({order id: date}) saves looking up the dates of those orders.
+        """
+        order_dates = dict(order_dates or {})
+        missing_ids = {order_id for order_id, product_id, quantity, count in changes} - set(order_dates)
+        if missing_ids:
+            order_dates.update(Order.objects.filter(pk__in=missing_ids).values_list("id", "date"))
+        self.apply_changes(
+            [
+                (get_sales_day(order_dates[order_id]), product_id, quantity, count)
+                for order_id, product_id, quantity, count in changes
+                if order_id in order_dates  # deleted orders are rebuilt by the command.
+            ]
+        )
+
+    def reprice_product(self, product_id, price_delta):
+        """Updates the revenue of the product's rows, after its price changed by price_delta."""
+        return self.filter(product_id=product_id).update(
+            revenue=F("revenue") + F("units") * Value(float(price_delta)), updated=now()
+        )
+
+    def rebuild(self, days=None):
+        """
+        Recomputes the rows of the days (of every day if None) from the order details, with a DELETE and an
+        INSERT ... SELECT of the aggregates in one transaction. Returns the number of rows.
+        """
+        details = OrderDetail.objects.all()
+        rollups = self.all()
+        if days is not None:
+            details = details.filter(order__date__date__in=days)
+            rollups = rollups.filter(day__in=days)
+        rows = (
+            details.annotate(day=TruncDate("order__date"))
+            .values("day", "product_id")
+            .annotate(
+                revenue=Sum(F("product__price") * F("quantity"), output_field=FloatField()),
+                units=Sum("quantity"),
+                orders_count=Count("id"),
+            )
+            .order_by()
+        )
+        sql, params = rows.query.sql_with_params()
+        connection = connections[self.db]
+        timestamp = self.model._meta.get_field("updated").get_db_prep_value(now(), connection)
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            rollups.delete()
+            cursor.execute(
+                f"INSERT INTO {table} (day, product_id, revenue, units, orders_count, created, updated) "
+                "SELECT aggregated.day, aggregated.product_id, aggregated.revenue, aggregated.units, "
+                f"aggregated.orders_count, %s, %s FROM ({sql}) AS aggregated",
+                (timestamp, timestamp, *params),
+            )
+            return cursor.rowcount
+
+    def catch_up(self, since):
+        """
+        Rebuilds the days of the orders and details updated since the date, and reprices the rows of the products
+        updated since it. Returns the rebuilt days. Uses the updated indexes.
+        """
+        orders = Order.objects.filter(updated__gte=since).annotate(day=TruncDate("date"))
+        details = OrderDetail.objects.filter(updated__gte=since).annotate(day=TruncDate("order__date"))
+        days = set()
+        for queryset in (orders, details):
+            days.update(queryset.order_by().values_list("day", flat=True).distinct())
+        prices = Product.objects.filter(pk=OuterRef("product_id")).values("price")
+        with transaction.atomic(using=self.db):
+            self.filter(product__updated__gte=since).update(
+                revenue=F("units") * Subquery(prices, output_field=FloatField()), updated=now()
+            )
+            if days:
+                self.rebuild(sorted(days))
+        return sorted(days)
+
+    def top_sellers(self, limit=10, order_by="revenue"):
+        """The products with the most revenue (or units, or orders) in the rows, with their totals."""
+        return (
+            self.values("product_id", "product__name")
+            .annotate(revenue=Sum("revenue"), units=Sum("units"), orders_count=Sum("orders_count"))
+            .order_by(f"-{order_by}", "product_id")[:limit]
+        )
+
+
+class DailyProductSales(TimeStampModel):
+    """Revenue, units and orders of a product in a day, rolled up from the order details."""
+
+    day = DateField()
+    product = ForeignKey("products.Product", on_delete=CASCADE, related_name="daily_sales")
+    revenue = FloatField(default=0)
+    units = IntegerField(default=0)
+    orders_count = IntegerField(default=0)  # the orders with the product, a detail each.
+
+    objects = DailyProductSalesQuerySet.as_manager()
+
+    class Meta:
+        db_table = "daily_product_sales"
+        # the upserts' conflict target, its index also serves the range queries by day.
+        constraints = [UniqueConstraint(fields=["day", "product"], name="daily_product_sales_day_product_uniq")]
+
+    def __str__(self):
+        return f"day={self.day}, product={self.product_id}, revenue={self.revenue}, units={self.units}"
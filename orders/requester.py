@@ -1,10 +1,73 @@
 from django.conf import settings
-from utils.requester import BaseRequester
+from utils.cache import SharedCachedValue
+from utils.requester import AsyncBaseRequester, BaseRequester
+
+MAIN_VALUES_ENDPOINT = "/api/api.php?type=valoresprincipales"
+DOLAR_BLUE = "Dolar Blue"
+
+
+def find_dolar_blue_buy_value(dolar_values):
+    """Find dolar blue's buy value in DolarSi's main values."""
+    for dolar_value in dolar_values:
+        stand = dolar_value["casa"]
+        if stand["nombre"] == DOLAR_BLUE:
+            break
+    return float(stand["compra"].replace(",", "."))  # quizas Decimal
+
+
+def parse_quote(value):
+    """A DolarSi quote, like "1.025,50", as a float. None when it doesn't quote, like "No Cotiza" or "0"."""
+    try:
+        quote = float(str(value).replace(".", "").replace(",", "."))
+    except ValueError:
+        return None
+    return quote if quote > 0 else None
+
+
+def parse_main_values(dolar_values):
+    """The (name, buy value, sell value) of every quote of DolarSi's main values."""
+    quotes = []
+    for dolar_value in dolar_values:
+        stand = dolar_value.get("casa", {})
+        if stand.get("nombre"):
+            quotes.append((stand["nombre"], parse_quote(stand.get("compra")), parse_quote(stand.get("venta"))))
+    return quotes
 
 
 class DolarSiRequester(BaseRequester):
     BASE_URL = settings.DOLAR_SI_URL
+    FALLBACK_TO_LAST_GOOD = True
 
     def get_main_values(self):
-        endpoint = "/api/api.php?type=valoresprincipales"
-        return self._get_response_data(method="get", endpoint=endpoint)
+        return self._get_response_data(method="get", endpoint=MAIN_VALUES_ENDPOINT)
+
+    def get_cached_main_values(self):
+        """Same as get_main_values, but served from the shared exchange rate cache."""
+        return main_values_cache.get()
+
+    def get_dolar_blue_buy_value(self):
+        return find_dolar_blue_buy_value(self.get_cached_main_values())
+
+
+class AsyncDolarSiRequester(AsyncBaseRequester):
+    BASE_URL = settings.DOLAR_SI_URL
+    FALLBACK_TO_LAST_GOOD = True
+
+    async def get_main_values(self):
+        return await self._get_response_data(method="get", endpoint=MAIN_VALUES_ENDPOINT)
+
+    async def get_cached_main_values(self):
+        return await main_values_cache.aget()
+
+    async def get_dolar_blue_buy_value(self):
+        return find_dolar_blue_buy_value(await self.get_cached_main_values())
+
+
+main_values_cache = SharedCachedValue(
+    key="dolar_si:main_values",
+    loader=lambda: DolarSiRequester().get_main_values(),  # looked up on each call, so it can be mocked.
+    async_loader=lambda: AsyncDolarSiRequester().get_main_values(),
+    ttl=settings.DOLAR_SI_CACHE_TTL,
+    stale_ttl=settings.DOLAR_SI_CACHE_STALE_TTL,
+    cache_alias=settings.DOLAR_SI_CACHE_ALIAS,
+)
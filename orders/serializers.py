@@ -1,14 +1,160 @@
-from rest_framework.fields import SerializerMethodField
-from rest_framework.serializers import (FloatField, ModelSerializer,
-                                        ValidationError)
+from django.db import IntegrityError, transaction
+from django.utils.timezone import now
+from products.models import InsufficientStock, Product
+from rest_framework.fields import SerializerMethodField, empty
+from rest_framework.serializers import (CharField, ChoiceField, DateField,
+                                        DateTimeField, FloatField,
+                                        IntegerField, ListField,
+                                        ListSerializer, ModelSerializer,
+                                        Serializer, ValidationError)
+from rest_framework.settings import api_settings
+from utils.fields import (PrefetchedPrimaryKeyRelatedField,
+                          get_datetime_formatter)
+from utils.serializers import (SparseFieldsSerializerMixin,
+                               UpdateFieldsSerializerMixin)
 
-from orders.models import Order, OrderDetail
+from orders.models import DailyProductSales, Order, OrderDetail
+
+
+def insufficient_stock_error(exception):
+    """Maps a failed stock reservation to the same error that validate raises."""
+    product = Product.objects.only("name", "stock").get(pk=exception.product_id)
+    message = f"No se puede pedir {exception.quantity} de {product.name}, pues solo quedan {product.stock}."
+    return ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]})
+
+
+def duplicated_detail_error(order_id, product_id):
+    """Maps a violation of order_details_order_product_uniq to the same error that validate_order raises."""
+    message = f"Ya existe otro detalle con el producto {product_id} para la orden {order_id}."
+    return ValidationError({"order": [message]})
+
+
+def is_id(value):
+    """Whether the value is an order detail id, an integer that isn't a bool."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class OrderDetailListSerializer(ListSerializer):
+    """
+    Resolves the orders and products of all the details with one in_bulk query each, and the products already in
+    those orders with one more, so validating many details costs the same queries no matter how many they are. Its
+    create and update write them all with one bulk query, see save_changes.
+
+    To update, the instance is the details to update (with their product and order) and each item of the data has the
+    id of its detail and the fields to change.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            if self.instance is not None:
+                self.validate_ids(data)
+            self.prefetch(data)
+        return super().to_internal_value(data)
+
+    def validate_ids(self, data):
+        """Pairs each item with its detail in instances_by_id, and rejects the unknown or repeated ids."""
+        self.instances_by_id = {order_detail.pk: order_detail for order_detail in self.instance}
+        errors = []
+        seen_ids = set()
+        for item in data:
+            pk = item.get("id") if isinstance(item, dict) else None
+            if not is_id(pk) or pk not in self.instances_by_id:
+                errors.append({"id": [f'Invalid pk "{pk}" - object does not exist.']})
+            elif pk in seen_ids:
+                errors.append({"id": [f"El detalle {pk} esta repetido."]})
+            else:
+                errors.append({})
+                seen_ids.add(pk)
+        if any(errors):
+            raise ValidationError(errors)
+
+    def prefetch(self, data):
+        def get_ids(name):
+            ids = (item.get(name) for item in data if isinstance(item, dict))
+            return {value for value in ids if isinstance(value, (str, int)) and not isinstance(value, bool)}
+
+        orders = Order.objects.in_bulk(get_ids("order_id"))
+        self.prefetched_instances = {Order: orders, Product: Product.objects.in_bulk(get_ids("product_id"))}
+        self.existing_product_ids = {order_id: set() for order_id in orders}
+        details = OrderDetail.objects.filter(order_id__in=orders).values_list("order_id", "product_id")
+        if self.instance is not None:  # their products may change, the updated items are checked instead.
+            details = details.exclude(pk__in=self.instances_by_id)
+        for order_id, product_id in details:
+            self.existing_product_ids[order_id].add(product_id)
+        self.product_ids = {}  # of the items going to each order.
+        for item in data:
+            if not isinstance(item, dict):
+                continue
+            instance = getattr(self, "instances_by_id", {}).get(item.get("id"))
+            order_id = item.get("order_id") or getattr(instance, "order_id", None)
+            product_id = item.get("product_id") or getattr(instance, "product_id", None)
+            if all(isinstance(value, (str, int)) for value in (order_id, product_id)):  # the others are invalid.
+                self.product_ids.setdefault(order_id, []).append(product_id)
+
+    def create(self, validated_data):
+        order_details = [OrderDetail(**attrs) for attrs in validated_data]
+        changes = [
+            (order_detail.order, order_detail.product, order_detail.quantity, 1) for order_detail in order_details
+        ]
+        self.save_changes(changes, lambda: OrderDetail.objects.bulk_create(order_details))
+        return order_details
+
+    def update(self, instance, validated_data):
+        order_details = [self.instances_by_id[item["id"]] for item in self.initial_data]
+        fields = {"updated"}  # bulk_update doesn't set auto_now fields.
+        changes = []
+        timestamp = now()
+        for order_detail, attrs in zip(order_details, validated_data):
+            changes.append((order_detail.order, order_detail.product, -order_detail.quantity, -1))
+            for name, value in attrs.items():
+                setattr(order_detail, name, value)
+            order_detail.updated = timestamp
+            fields.update(attrs)
+            changes.append((order_detail.order, order_detail.product, order_detail.quantity, 1))
+        self.save_changes(changes, lambda: OrderDetail.objects.bulk_update(order_details, fields))
+        for order_detail in order_details:
+            order_detail.set_loaded_values()
+        return order_details
+
+    def save_changes(self, changes, write):
+        """
+        Writes the details with write() in one transaction that also applies their (order, product, quantity delta,
+        details delta) changes to the stock, the orders' totals and the sales rollup, without their post_save.
+        """
+        quantities = {}
+        deltas = {}  # (total, items count) of each order id.
+        for order, product, quantity, count in changes:
+            quantities[product.pk] = quantities.get(product.pk, 0) + quantity
+            total, items_count = deltas.get(order.pk, (0, 0))
+            deltas[order.pk] = (total + product.price * quantity, items_count + quantity)
+        try:
+            with transaction.atomic():
+                Product.objects.reserve_stock(quantities)
+                write()
+                Order.objects.increment_totals(deltas)
+                DailyProductSales.objects.apply_detail_changes(
+                    [(order.pk, product.pk, quantity, count) for order, product, quantity, count in changes],
+                    {order.pk: order.date for order, product, quantity, count in changes},
+                )
+        except InsufficientStock as exception:  # other details of the list, or other requests, took the stock.
+            raise insufficient_stock_error(exception)
+        except IntegrityError:  # another detail with one of the products was added to its order meanwhile.
+            raise ValidationError({"order": ["Ya existe otro detalle con alguno de los productos para su orden."]})
 
 
 class OrderDetailSerializer(ModelSerializer):
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField  # resolved by OrderDetailListSerializer with many.
+
     class Meta:
         model = OrderDetail
         fields = "__all__"
+        list_serializer_class = OrderDetailListSerializer
+
+    def run_validation(self, data=empty):
+        instances_by_id = getattr(self.parent, "instances_by_id", None)
+        if instances_by_id is not None:  # many details updated at once, each item is validated with its own.
+            self.instance = instances_by_id[data["id"]]
+        return super().run_validation(data)
 
     def validate(self, attrs):
         product = attrs.get("product")
@@ -20,31 +166,75 @@ class OrderDetailSerializer(ModelSerializer):
         if not quantity:
             quantity = self.instance.quantity
         stock = product.stock
+        if self.instance is not None and self.instance.product_id == product.pk:
+            stock += self.instance.quantity  # already reserved by this detail.
         if stock < quantity:
             raise ValidationError(f"No se puede pedir {quantity} de {product.name}, pues solo quedan {stock}.")
         return super().validate(attrs)
 
+    def create(self, validated_data):
+        """Reserves the product's stock in the same transaction that creates the detail."""
+        try:
+            with transaction.atomic():
+                Product.objects.reserve_stock({validated_data["product"].pk: validated_data["quantity"]})
+                return super().create(validated_data)
+        except InsufficientStock as exception:
+            raise insufficient_stock_error(exception)
+        except IntegrityError:  # another detail with the product was created after the validation.
+            raise duplicated_detail_error(validated_data["order"].pk, validated_data["product"].pk)
+
+    def update(self, instance, validated_data):
+        """Reserves the increased quantity, or releases the decreased one, of the detail's products."""
+        product = validated_data.get("product", instance.product)
+        quantity = validated_data.get("quantity", instance.quantity)
+        quantities = {instance.product_id: -instance.quantity}
+        quantities[product.pk] = quantities.get(product.pk, 0) + quantity
+        try:
+            with transaction.atomic():
+                Product.objects.reserve_stock(quantities)
+                return super().update(instance, validated_data)
+        except InsufficientStock as exception:
+            raise insufficient_stock_error(exception)
+        except IntegrityError:  # the order already has another detail with the product.
+            raise duplicated_detail_error(validated_data.get("order", instance.order).pk, product.pk)
+
     def validate_order(self, order):
-        product_ids = order.order_details.all().values_list("product_id", flat=True)
+        """
+        Checks that the product(s) aren't in the order yet with one query, or none when OrderDetailListSerializer
+        prefetched them. The order_details_order_product_uniq constraint catches the details created after this check.
+        """
         if isinstance(self.initial_data, list):  # to many = True
-            initial_product_ids = []
-            for dictionary in self.initial_data:
-                initial_product_ids.append(dictionary.get("product_id"))
-            initial_product_ids = set(initial_product_ids)
-            if len(initial_product_ids) != len(self.initial_data):  # if products are repeated.
-                raise ValidationError(f"No puede duplicar productos en la misma orden.")
-            for initial_product_id in initial_product_ids:
-                if initial_product_id in product_ids:
-                    raise ValidationError(
-                        f"Ya existe otro detalle con el producto {initial_product_id} para la orden {order.id}."
-                    )
+            # the child validates the whole list for each detail, so the result is kept for the next ones.
+            if not hasattr(self, "_order_errors"):
+                self._order_errors = {}
+            if order.pk not in self._order_errors:
+                product_ids = self.parent.product_ids.get(order.pk, [])  # prefetched by OrderDetailListSerializer.
+                self._order_errors[order.pk] = self._get_order_error(order, product_ids)
+            error = self._order_errors[order.pk]
         else:
-            product_id = self.initial_data.get("product_id")
-            if product_id in product_ids:
-                raise ValidationError(f"Ya existe otro detalle con el producto {product_id} para la orden {order.id}.")
+            error = self._get_order_error(order, [self.initial_data.get("product_id")])
+        if error:
+            raise ValidationError(error)
         return order
 
+    def _get_order_error(self, order, product_ids):
+        if len(set(product_ids)) != len(product_ids):  # if products are repeated.
+            return "No puede duplicar productos en la misma orden."
+        existing_product_ids = getattr(self.parent, "existing_product_ids", {}).get(order.pk)
+        if existing_product_ids is not None:  # prefetched by OrderDetailListSerializer.
+            product_id = next((product_id for product_id in product_ids if product_id in existing_product_ids), None)
+        else:
+            details = order.order_details.all()
+            if self.instance is not None:
+                details = details.exclude(pk=self.instance.pk)
+            product_id = details.filter(product_id__in=product_ids).values_list("product_id", flat=True).first()
+        if product_id is not None:
+            return f"Ya existe otro detalle con el producto {product_id} para la orden {order.id}."
+        return None
+
     def to_internal_value(self, data):
+        if not isinstance(data, dict):  # rejected by ModelSerializer, like the items of a list that aren't objects.
+            return super().to_internal_value(data)
         new_data = {}
         product_id = data.get("product_id")
         order_id = data.get("order_id")
@@ -58,33 +248,217 @@ class OrderDetailSerializer(ModelSerializer):
         return super().to_internal_value(new_data)
 
 
-class OrderSerializer(ModelSerializer):
+class OrderSerializer(SparseFieldsSerializerMixin, UpdateFieldsSerializerMixin, ModelSerializer):
     order_details = SerializerMethodField()
-    total_pesos = FloatField(source="get_total", required=False)
-    total_usd = FloatField(source="get_total_usd", required=False)  # para porbar esto mockear
+    total_pesos = FloatField(source="get_total", read_only=True)
+    total_usd = SerializerMethodField()  # para porbar esto mockear
+
+    expandable_fields = ("order_details", "total_usd")  # a query, and DolarSi's rate.
 
     class Meta:
         model = Order
-        fields = "__all__"
+        exclude = ("total", "items_count")  # served as total_pesos.
+
+    def get_total_usd(self, order):
+        """With the rate in effect at the order's date, or the live one of the context if a view already fetched it."""
+        live_buy_value = self.context.get("dolar_blue_buy_value")
+        return order.get_total_usd(buy_value=order.get_dolar_blue_buy_value(live_buy_value=live_buy_value))
 
     def get_order_details(self, order):
+        if hasattr(self, "saved_order_details"):  # answered in the shape they were sent.
+            return self.saved_order_details
+        return OrderDetailSerializer(order.order_details.all(), many=True).data
+
+    def create(self, validated_data):
+        order = Order(**validated_data)
+        self.save_order_details(order)
+        return order
+
+    def update(self, instance, validated_data):
+        """Replaces the order's details with the order_details sent, if any, see save_order_details."""
+        if "order_details" not in self.initial_data:
+            return super().update(instance, validated_data)
+        self.save_order_details(instance, validated_data)
+        return instance
+
+    def save_order_details(self, order, validated_data=None):
+        """
+        Makes the order_details sent the whole set of details of the order, and saves the order, created if
+        validated_data is None or updated with it. The current details are read once and diffed with the ones sent
+        into the details to insert, the quantities to update and the details to delete, which are written with
+        bulk_create, bulk_update and one DELETE. Everything is validated before writing, in one transaction that also
+        reserves or releases their stock and updates the order's totals and sales rollup, so the queries don't depend
+        on how many details there are.
+        """
+        created = validated_data is None
+        serializer = OrderDetailIngestSerializer(data=self.initial_data.get("order_details") or [], many=True)
+        if not serializer.is_valid():
+            raise ValidationError(serializer.errors)
+        order_details = serializer.validated_data
+        quantities = {order_detail["product_id"]: order_detail["quantity"] for order_detail in order_details}
         try:
-            order_details = self.initial_data.get("order_details")
-        except AttributeError:  # because self shouldn't have initial_data.
-            order_details = None
-        if not order_details:  # because is a GET.
-            return OrderDetailSerializer(order.order_details.all(), many=True).data
-        order_detail_data = []
+            with transaction.atomic():
+                current = {}
+                if not created:  # locked, so concurrent changes of the details wait for this diff.
+                    locked = order.order_details.select_for_update()
+                    current = {order_detail.product_id: order_detail for order_detail in locked}
+                products = Product.objects.only("id", "name", "price", "stock").in_bulk({*quantities, *current})
+                errors = self._get_order_details_errors(order_details, products, current)
+                if any(errors):
+                    raise ValidationError(errors)
+                self._write_order_details(order, quantities, current, products, validated_data)
+        except InsufficientStock as exception:  # another order reserved the stock after the validation.
+            raise insufficient_stock_error(exception)
+        except IntegrityError:  # another request created the order, or added one of the products, meanwhile.
+            raise ValidationError({"id": [f"La orden {order.pk} o alguno de sus detalles ya fue creado."]})
+        self.saved_order_details = [
+            {"order_id": order.pk, "product_id": product_id, "quantity": quantity}
+            for product_id, quantity in quantities.items()
+        ]
+
+    def _get_order_details_errors(self, order_details, products, current):
+        """The errors of each detail, like OrderDetailSerializer(many=True) reports them."""
+        repeated = len({order_detail["product_id"] for order_detail in order_details}) != len(order_details)
+        errors = []
         for order_detail in order_details:
-            id_dict = {
-                "order_id": order.id,
-                "product_id": order_detail.get("product_id"),
-                "quantity": order_detail.get("quantity"),
+            product = products.get(order_detail["product_id"])
+            if repeated:
+                errors.append({"order": ["No puede duplicar productos en la misma orden."]})
+                continue
+            if product is None:
+                errors.append({"product": [f'Invalid pk "{order_detail["product_id"]}" - object does not exist.']})
+                continue
+            quantity = order_detail["quantity"]
+            stock = product.stock
+            if product.pk in current:
+                stock += current[product.pk].quantity  # already reserved by the order.
+            if stock < quantity:
+                message = f"No se puede pedir {quantity} de {product.name}, pues solo quedan {stock}."
+                errors.append({api_settings.NON_FIELD_ERRORS_KEY: [message]})
+            else:
+                errors.append({})
+        return errors
+
+    def _write_order_details(self, order, quantities, current, products, validated_data):
+        changes = {}  # (quantity delta, details delta) of each product.
+        inserted = []
+        updated = []
+        for product_id, quantity in quantities.items():
+            order_detail = current.get(product_id)
+            if order_detail is None:
+                changes[product_id] = (quantity, 1)
+                inserted.append(OrderDetail(order=order, product_id=product_id, quantity=quantity))
+            elif order_detail.quantity != quantity:
+                changes[product_id] = (quantity - order_detail.quantity, 0)
+                order_detail.quantity = quantity
+                order_detail.updated = now()  # bulk_update doesn't set auto_now fields.
+                updated.append(order_detail)
+        deleted = [order_detail for product_id, order_detail in current.items() if product_id not in quantities]
+        for order_detail in deleted:
+            changes[order_detail.product_id] = (-order_detail.quantity, -1)
+        total = sum(products[product_id].price * quantity for product_id, (quantity, count) in changes.items())
+        items_count = sum(quantity for quantity, count in changes.values())
+        Product.objects.reserve_stock({product_id: quantity for product_id, (quantity, count) in changes.items()})
+        if validated_data is None:
+            order.total, order.items_count = total, items_count
+            order.save(force_insert=True)
+        else:
+            Order.objects.increment_totals({order.pk: (total, items_count)})
+        if deleted:  # without the post_delete of each detail, their changes are applied below.
+            deleted_ids = [order_detail.pk for order_detail in deleted]
+            OrderDetail.objects.filter(pk__in=deleted_ids)._raw_delete(order._state.db)
+        OrderDetail.objects.bulk_update(updated, ["quantity", "updated"])
+        OrderDetail.objects.bulk_create(inserted)
+        DailyProductSales.objects.apply_detail_changes(
+            [(order.pk, product_id, quantity, count) for product_id, (quantity, count) in changes.items()],
+            {order.pk: order.date},
+        )
+        if validated_data is None:
+            return
+        if changes:
+            order.refresh_from_db(fields=("total", "items_count", "updated"))
+        if validated_data:  # after the details, so a new date moves their sales at once, see move_order_sales.
+            super().update(order, validated_data)
+
+
+class OrderDetailIngestSerializer(Serializer):
+    product_id = CharField(max_length=20)
+    quantity = IntegerField(min_value=1)
+
+
+class OrderIngestSerializer(Serializer):
+    """Shape of each order of a bulk ingestion, validated without queries."""
+
+    id = CharField(max_length=20)
+    date = DateTimeField(required=False)
+    order_details = ListField(child=OrderDetailIngestSerializer(), required=False)
+
+    def validate_order_details(self, order_details):
+        product_ids = {order_detail["product_id"] for order_detail in order_details}
+        if len(product_ids) != len(order_details):  # if products are repeated.
+            raise ValidationError("No puede duplicar productos en la misma orden.")
+        return order_details
+
+
+class DailyProductSalesSerializer(ModelSerializer):
+    class Meta:
+        model = DailyProductSales
+        fields = ("day", "product", "revenue", "units", "orders_count")
+
+
+class SalesFiltersSerializer(Serializer):
+    """Query parameters of the sales analytics."""
+
+    date_from = DateField(required=False)
+    date_to = DateField(required=False)
+    product = CharField(max_length=20, required=False)
+    limit = IntegerField(min_value=1, max_value=100, default=10)  # of the top sellers.
+    order_by = ChoiceField(choices=("revenue", "units", "orders_count"), default="revenue")
+
+    def validate(self, data):
+        if "date_from" in data and "date_to" in data and data["date_from"] > data["date_to"]:
+            raise ValidationError({"date_to": ["Debe ser posterior a date_from."]})
+        return data
+
+
+ORDER_FIELDS = ("id", "created", "updated", "date", "total")
+ORDER_DETAIL_FIELDS = ("id", "created", "updated", "quantity", "order_id", "product_id")
+
+
+def represent_orders(rows, buy_value=None, fields=None):
+    """
+    OrderSerializer(many=True).data of .values(*ORDER_FIELDS) rows, rendered to the same JSON, without model nor
+    serializer instances. Their details are read with one more query. The rows' dolar_blue_buy_value (annotated by
+    with_dolar_blue_buy_value) converts the totals, or buy_value for the rows without it. Only the `fields` are
+    represented (all of them if None), so the details and buy values aren't needed if they aren't requested.
+    """
+    format_datetime = get_datetime_formatter()
+    with_details = fields is None or "order_details" in fields
+    with_total_usd = fields is None or "total_usd" in fields
+    order_details = {row["id"]: [] for row in rows}
+    details = OrderDetail.objects.filter(order_id__in=order_details).order_by("id").values(*ORDER_DETAIL_FIELDS)
+    for detail in details if with_details else ():
+        order_details[detail["order_id"]].append(
+            {
+                "id": detail["id"],
+                "created": format_datetime(detail["created"]),
+                "updated": format_datetime(detail["updated"]),
+                "quantity": detail["quantity"],
+                "order": detail["order_id"],
+                "product": detail["product_id"],
             }
-            order_detail_data.append(id_dict)
-        serializer = OrderDetailSerializer(data=order_detail_data, many=True)
-        if not serializer.is_valid():
-            order.delete()
-            raise ValidationError(serializer.errors)
-        serializer.save()
-        return serializer.initial_data
+        )
+    orders = []
+    for row in rows:
+        row_buy_value = row.get("dolar_blue_buy_value") or buy_value
+        order = {
+            "id": row["id"],
+            "order_details": order_details[row["id"]],
+            "total_pesos": row["total"],
+            "total_usd": round(row["total"] / row_buy_value, 2) if with_total_usd else None,
+            "created": format_datetime(row["created"]),
+            "updated": format_datetime(row["updated"]),
+            "date": format_datetime(row["date"]),
+        }
+        orders.append(order if fields is None else {name: value for name, value in order.items() if name in fields})
+    return orders
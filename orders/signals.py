@@ -0,0 +1,58 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from products.models import Product
+
+from orders.models import DailyProductSales, Order, OrderDetail, get_sales_day
+
+
+@receiver(post_save, sender=OrderDetail)
+def update_order_totals(sender, instance, created, raw=False, **kwargs):
+    """Moves the detail's old quantity out of its order's totals and sales rollup, and adds the new one."""
+    if raw:  # loaded from a fixture, run the repair_order_totals command.
+        return
+    loaded_values = getattr(instance, "_loaded_values", None)
+    if not created and not loaded_values:  # unknown old values, run the repair_order_totals command.
+        return
+    changes = [(instance.order_id, instance.product_id, instance.quantity, 1)]
+    if not created:
+        changes.append((loaded_values["order_id"], loaded_values["product_id"], -loaded_values["quantity"], -1))
+    Order.objects.apply_detail_changes([change[:3] for change in changes])
+    DailyProductSales.objects.apply_detail_changes(changes)
+    instance.set_loaded_values()
+
+
+@receiver(post_delete, sender=OrderDetail)
+def release_order_detail(sender, instance, **kwargs):
+    """
+    Releases the stock reserved by a deleted detail and subtracts it from the totals and sales rollup, also in
+    cascade deletes.
+    """
+    Product.objects.release_stock({instance.product_id: instance.quantity})
+    Order.objects.apply_detail_changes([(instance.order_id, instance.product_id, -instance.quantity)])
+    DailyProductSales.objects.apply_detail_changes([(instance.order_id, instance.product_id, -instance.quantity, -1)])
+
+
+@receiver(post_save, sender=Order)
+def move_order_sales(sender, instance, created, raw=False, **kwargs):
+    """Moves the sales of the order's details to its new day when its date changes."""
+    loaded_date = getattr(instance, "_loaded_date", None)
+    instance._loaded_date = instance.__dict__.get("date")
+    if created or raw or loaded_date is None or instance._loaded_date is None:
+        return
+    loaded_day, day = get_sales_day(loaded_date), get_sales_day(instance.date)
+    if loaded_day == day:
+        return
+    changes = []
+    for product_id, quantity in instance.order_details.values_list("product_id", "quantity"):
+        changes += [(loaded_day, product_id, -quantity, -1), (day, product_id, quantity, 1)]
+    DailyProductSales.objects.apply_changes(changes)
+
+
+@receiver(post_save, sender=Product)
+def reprice_order_totals(sender, instance, created, raw=False, **kwargs):
+    loaded_price = getattr(instance, "_loaded_price", None)
+    instance._loaded_price = instance.price
+    if created or raw or loaded_price is None or loaded_price == instance.price:
+        return
+    Order.objects.reprice_product(instance.pk, instance.price - loaded_price)
+    DailyProductSales.objects.reprice_product(instance.pk, instance.price - loaded_price)
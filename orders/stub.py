@@ -0,0 +1,75 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import random, uniform
+from time import sleep
+from urllib.parse import urlsplit
+
+from orders.requester import DOLAR_BLUE, MAIN_VALUES_ENDPOINT
+
+
+def format_quote(value):
+    """A quote in DolarSi's format, like "182,50"."""
+    return f"{value:.2f}".replace(".", ",")
+
+
+def get_main_values(blue_buy, blue_sell):
+    """DolarSi's main values, with the given dolar blue quote."""
+    quotes = [("Dolar Oficial", 98.53, 104.53), (DOLAR_BLUE, blue_buy, blue_sell), ("Dolar Bolsa", 173.1, 173.6)]
+    main_values = [
+        {"casa": {"nombre": name, "compra": format_quote(buy), "venta": format_quote(sell), "decimales": "2"}}
+        for name, buy, sell in quotes
+    ]
+    main_values.append({"casa": {"nombre": "Dolar Soja", "compra": "No Cotiza", "venta": "0", "decimales": "3"}})
+    return main_values
+
+
+class DolarSiStubHandler(BaseHTTPRequestHandler):
+    """Answers DolarSi's main values endpoint after the server's latency, or a 503 at its failure rate."""
+
+    def do_GET(self):
+        server = self.server
+        sleep(max(0, server.latency + uniform(-server.jitter, server.jitter)))
+        endpoint = urlsplit(MAIN_VALUES_ENDPOINT)
+        requested = urlsplit(self.path)
+        if (requested.path, requested.query) != (endpoint.path, endpoint.query):
+            return self._respond(404, {"error": "Not found"})
+        if random() < server.failure_rate:
+            return self._respond(503, {"error": "Service unavailable"})
+        self._respond(200, get_main_values(server.blue_buy, server.blue_sell))
+
+    def _respond(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_stub_server(
+    host="127.0.0.1",
+    port=8001,
+    latency=0.0,
+    jitter=0.0,
+    failure_rate=0.0,
+    blue_buy=182.0,
+    blue_sell=185.0,
+    verbose=False,
+):
+    """
+    A local stand-in for DolarSi (latency and jitter in seconds), point DOLAR_SI_URL to it. Call serve_forever,
+    port 0 picks a free one (see server_address).
+    """
+    server = ThreadingHTTPServer((host, port), DolarSiStubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    server.failure_rate = failure_rate
+    server.blue_buy = blue_buy
+    server.blue_sell = blue_sell
+    server.verbose = verbose
+    return server
@@ -1,13 +1,37 @@
+import json
+from datetime import datetime, timezone
+from io import StringIO
+from queue import Empty, SimpleQueue
+from random import shuffle
+from threading import Thread
+from unittest import skipUnless
 from unittest.mock import patch
+from uuid import uuid4
 
+import requests
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+from products.models import InsufficientStock, Product
 from rest_framework.exceptions import ErrorDetail
 from rest_framework.status import (HTTP_200_OK, HTTP_201_CREATED,
-                                   HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST,
+                                   HTTP_204_NO_CONTENT, HTTP_304_NOT_MODIFIED,
+                                   HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND,
                                    HTTP_405_METHOD_NOT_ALLOWED)
-
-from orders.models import Order, OrderDetail
+from rest_framework.test import APIClient
 from utils.tests import (BaseModelViewSetTestCase, OrderFactory,
-                         ProductFactory, dolar_si_mocked_data)
+                         ProductFactory, QueryBudgetTestCase,
+                         dolar_si_mocked_data)
+
+from orders.models import DailyProductSales, ExchangeRate, Order, OrderDetail
+from orders.requester import MAIN_VALUES_ENDPOINT, parse_main_values
+from orders.serializers import OrderDetailSerializer, OrderSerializer
+from orders.stub import make_stub_server
 
 
 class OrderBaseModelViewSetTestCase(BaseModelViewSetTestCase):
@@ -29,7 +53,11 @@ class OrderBaseModelViewSetTestCase(BaseModelViewSetTestCase):
 class OrderModelViewSetTest(OrderBaseModelViewSetTestCase):
     url_name = "orders"
 
-    def test_create_success(self):
+    @patch(
+        "orders.requester.DolarSiRequester.get_main_values",
+        return_value=dolar_si_mocked_data,
+    )
+    def test_create_success(self, *args):
         """Testing if a Order and OrderDetails are successfully created."""
         assert Order.objects.count() == 1
         assert OrderDetail.objects.count() == 1
@@ -73,6 +101,53 @@ class OrderModelViewSetTest(OrderBaseModelViewSetTestCase):
             code="invalid",
         )
 
+    def test_create_validated_before_writing(self):
+        """Testing if an Order with an invalid OrderDetail is rejected without writing anything."""
+        create_data = {
+            "id": "12345678901234567890",
+            "order_details": [
+                {"product_id": self.product_2.id, "quantity": 1},
+                {"product_id": self.product.id, "quantity": 7777},
+            ],
+        }
+        with CaptureQueriesContext(connection) as context:
+            response = self._post_create(data=create_data)
+        assert response.status_code == HTTP_400_BAD_REQUEST
+        assert response.data[0] == {} and "non_field_errors" in response.data[1]
+        assert not any(query["sql"].startswith(("INSERT", "UPDATE", "DELETE")) for query in context.captured_queries)
+        create_data["order_details"][1] = {"product_id": self.product_2.id, "quantity": 1}
+        response = self._post_create(data=create_data)
+        assert response.data == [{"order": ["No puede duplicar productos en la misma orden."]}] * 2
+        assert Order.objects.count() == 1
+
+    @patch(
+        "orders.requester.DolarSiRequester.get_main_values",
+        return_value=dolar_si_mocked_data,
+    )
+    def test_create_totals_and_sales(self, *args):
+        """Testing if a created Order reserves the stock, and has its totals and sales, like its details were saved."""
+        create_data = {
+            "id": "12345678901234567890",
+            "date": "2021-05-01",
+            "order_details": [
+                {"product_id": self.product.id, "quantity": 2},
+                {"product_id": self.product_2.id, "quantity": 3},
+            ],
+        }
+        response = self._post_create(data=create_data)
+        assert response.status_code == HTTP_201_CREATED
+        assert response.data["order_details"] == [
+            {"order_id": create_data["id"], "product_id": self.product.id, "quantity": 2},
+            {"order_id": create_data["id"], "product_id": self.product_2.id, "quantity": 3},
+        ]
+        order = Order.objects.with_totals().get(id=create_data["id"])
+        assert round(order.total, 2) == round(order.annotated_total, 2) == round(response.data["total_pesos"], 2)
+        assert order.items_count == 5
+        assert Product.objects.get(id=self.product_2.id).stock == 2497
+        sales = set(DailyProductSales.objects.values_list("day", "product_id", "units", "orders_count"))
+        DailyProductSales.objects.rebuild()
+        assert sales == set(DailyProductSales.objects.values_list("day", "product_id", "units", "orders_count"))
+
     @patch(
         "orders.requester.DolarSiRequester.get_main_values",
         return_value=dolar_si_mocked_data,
@@ -99,6 +174,85 @@ class OrderModelViewSetTest(OrderBaseModelViewSetTestCase):
                 for key in ["id", "created", "updated", "quantity", "order", "product"]:
                     assert order_detail[key] is not None
 
+    @patch(
+        "orders.requester.DolarSiRequester.get_main_values",
+        return_value=dolar_si_mocked_data,
+    )
+    def test_list_totals_queries(self, *args):
+        """Testing if the listed orders' totals don't make a query per order."""
+        with CaptureQueriesContext(connection) as context:
+            response = self._get_list()
+        queries_count = len(context.captured_queries)
+        for x in range(5):
+            OrderFactory.create_order(order_details=[{"product_id": self.product.id, "quantity": 10}])
+        with CaptureQueriesContext(connection) as context:
+            response = self._get_list()
+        assert response.status_code == HTTP_200_OK
+        assert len(context.captured_queries) == queries_count
+        for result in response.data["results"]:
+            assert result["total_pesos"] == Order.objects.get(id=result["id"]).get_total()
+
+    @patch(
+        "orders.requester.DolarSiRequester.get_main_values",
+        return_value=dolar_si_mocked_data,
+    )
+    def test_list_sparse_fields(self, get_main_values):
+        """Testing if ?fields= lists only those fields, without reading the details nor the dolar's rate."""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse("orders-list"), {"fields": "id,date"})
+        assert response.status_code == HTTP_200_OK
+        assert list(response.data["results"][0]) == ["id", "date"]
+        assert not any("order_details" in query["sql"] for query in context.captured_queries)
+        get_main_values.assert_not_called()
+        response = self.client.get(reverse("orders-list"), {"expand": "total_usd"})
+        assert list(response.data["results"][0]) == ["id", "total_pesos", "total_usd", "created", "updated", "date"]
+        response = self._get_list()
+        assert "order_details" in response.data["results"][0]
+
+    def test_retrieve_sparse_fields(self):
+        """Testing if ?fields= and ?expand= retrieve only those fields, and reject unknown ones."""
+        path = reverse("orders-detail", kwargs={"pk": self.order.id})
+        response = self.client.get(path, {"fields": "id,total_pesos", "expand": "order_details"})
+        assert response.status_code == HTTP_200_OK
+        assert list(response.data) == ["id", "order_details", "total_pesos"]
+        response = self.client.get(path, {"fields": "id,other", "expand": "date"})
+        assert response.status_code == HTTP_400_BAD_REQUEST
+        assert response.data == {"fields": ["Campos desconocidos: other."], "expand": ["Campos desconocidos: date."]}
+
+    def test_benchmark_list_serialization(self):
+        """Testing if the .values() read path of the lists renders the same JSON as the serializers."""
+        for x in range(3):
+            OrderFactory.create_order(order_details=[{"product_id": self.product_2.id, "quantity": 10}])
+        stdout = StringIO()
+        call_command("benchmark_list_serialization", "--buy-value=190.5", "--repeat=1", stdout=stdout)
+        assert "products: 2 rows" in stdout.getvalue()
+        assert "orders: 4 rows" in stdout.getvalue()
+
+    @patch("orders.requester.DolarSiRequester.get_main_values")
+    def test_benchmark_list_serialization_stored_rates(self, get_main_values):
+        """Testing if both read paths convert the totals with the stored rates, without fetching the live one."""
+        ExchangeRate.objects.create(name="Dolar Blue", buy=100, sell=110)
+        stdout = StringIO()
+        call_command("benchmark_list_serialization", "--repeat=1", stdout=stdout)
+        assert "orders: 1 rows" in stdout.getvalue()
+        get_main_values.assert_not_called()
+
+    @patch(
+        "orders.requester.DolarSiRequester.get_main_values",
+        return_value=dolar_si_mocked_data,
+    )
+    def test_list_cursor_success(self, *args):
+        """Testing if Orders are listed by date with the opt-in cursor pagination, also when dates are repeated."""
+        for x in range(16):
+            OrderFactory.create_order(date=self.order.date)
+        response = self.client.get(reverse("orders-list"), {"pagination": "cursor"}, format="json")
+        assert response.status_code == HTTP_200_OK
+        ids = [result["id"] for result in response.data["results"]]
+        response = self.client.get(response.data["next"], format="json")
+        ids += [result["id"] for result in response.data["results"]]
+        assert response.data["next"] is None
+        assert ids == list(Order.objects.order_by("-date", "-id").values_list("id", flat=True))
+
     @patch(
         "orders.requester.DolarSiRequester.get_main_values",
         return_value=dolar_si_mocked_data,
@@ -116,7 +270,24 @@ class OrderModelViewSetTest(OrderBaseModelViewSetTestCase):
             for key in ["id", "created", "updated", "quantity", "order", "product"]:
                 assert order_detail[key] is not None
 
-    def test_partial_update_success(self):
+    @patch(
+        "orders.requester.DolarSiRequester.get_main_values",
+        return_value=dolar_si_mocked_data,
+    )
+    def test_retrieve_not_modified(self, *args):
+        """Testing if a retrieve with the ETag of the last response gets a 304 until one of its details changes."""
+        path = reverse("orders-detail", kwargs={"pk": self.order.id})
+        etag = self.client.get(path)["ETag"]
+        assert self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code == HTTP_304_NOT_MODIFIED
+        OrderDetail.objects.filter(id=self.order_detail.id).update(updated=now())  # without changing the order.
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == HTTP_200_OK and response["ETag"] != etag
+
+    @patch(
+        "orders.requester.DolarSiRequester.get_main_values",
+        return_value=dolar_si_mocked_data,
+    )
+    def test_partial_update_success(self, *args):
         """Testing if a single Order and OrderDetails are partially updated successfully with PATCH method."""
         order = self.order
         old_date = order.date
@@ -132,6 +303,76 @@ class OrderModelViewSetTest(OrderBaseModelViewSetTestCase):
             != old_date.strftime("%Y-%m-%d")
         )
 
+    def test_partial_update_keeps_totals(self):
+        """Testing if a PATCH of the date doesn't write back the totals it loaded over details changed meanwhile."""
+        order = Order.objects.get(id=self.order.id)
+        Order.objects.increment_totals({order.id: (100.0, 1)})
+        serializer = OrderSerializer(order, data={"date": "2020-03-21"}, partial=True)
+        assert serializer.is_valid()
+        serializer.save()
+        order.refresh_from_db()
+        assert (order.date.day, order.items_count) == (21, 78)
+
+    @patch(
+        "orders.requester.DolarSiRequester.get_main_values",
+        return_value=dolar_si_mocked_data,
+    )
+    def test_partial_update_order_details(self, *args):
+        """Testing if PATCH with order_details inserts, updates and deletes the OrderDetails to match them."""
+        data = {
+            "order_details": [
+                {"product_id": self.product.id, "quantity": 10},
+                {"product_id": self.product_2.id, "quantity": 5},
+            ]
+        }
+        response = self._patch_partial_update(data=data, id_value=self.order.id)
+        assert response.status_code == HTTP_200_OK
+        assert response.data["order_details"] == [
+            {"order_id": self.order.id, "product_id": self.product.id, "quantity": 10},
+            {"order_id": self.order.id, "product_id": self.product_2.id, "quantity": 5},
+        ]
+        assert self.order.order_details.get(product=self.product).id == self.order_detail.id  # updated, not replaced.
+        self._assert_order_details({self.product.id: 10, self.product_2.id: 5})
+        data = {"date": "2021-01-01", "order_details": [{"product_id": self.product_2.id, "quantity": 2500}]}
+        response = self._patch_partial_update(data=data, id_value=self.order.id)
+        assert response.status_code == HTTP_200_OK
+        assert response.data["date"].startswith("2021-01-01")
+        self._assert_order_details({self.product_2.id: 2500})  # with its sales moved to the new date.
+        response = self._patch_partial_update(data={"order_details": []}, id_value=self.order.id)
+        assert response.status_code == HTTP_200_OK
+        self._assert_order_details({})
+
+    def test_partial_update_order_details_bad_quantity(self):
+        """Testing if PATCH with an invalid order_details changes nothing."""
+        data = {
+            "date": "2018-12-25",
+            "order_details": [{"product_id": self.product.id, "quantity": 1078}, {"product_id": self.product_2.id}],
+        }
+        response = self._patch_partial_update(data=data, id_value=self.order.id)
+        assert response.status_code == HTTP_400_BAD_REQUEST, response.data
+        assert response.data[1] == {"quantity": [ErrorDetail(string="This field is required.", code="required")]}
+        data["order_details"][1]["quantity"] = 1
+        response = self._patch_partial_update(data=data, id_value=self.order.id)
+        assert response.data[0]["non_field_errors"] == [
+            f"No se puede pedir 1078 de {self.product.name}, pues solo quedan 1077."  # with the order's 77.
+        ]
+        self.order.refresh_from_db()
+        assert self.order.date.strftime("%Y-%m-%d") == "2020-03-20"
+        self._assert_order_details({self.product.id: 77})
+
+    def _assert_order_details(self, quantities):
+        """Asserts the order's details, and that its totals, the stock and the sales rollup follow them."""
+        assert dict(self.order.order_details.values_list("product_id", "quantity")) == quantities
+        order = Order.objects.with_totals().get(id=self.order.id)
+        assert round(order.total, 2) == round(order.annotated_total, 2)
+        assert order.items_count == order.annotated_items_count
+        # the setUp's detail of product was saved without reserving its 77.
+        assert Product.objects.get(id=self.product.id).stock == 1077 - quantities.get(self.product.id, 0)
+        assert Product.objects.get(id=self.product_2.id).stock == 2500 - quantities.get(self.product_2.id, 0)
+        sales = set(DailyProductSales.objects.values_list("day", "product_id", "units", "orders_count"))
+        DailyProductSales.objects.rebuild()
+        assert sales == set(DailyProductSales.objects.values_list("day", "product_id", "units", "orders_count"))
+
     def test_update_not_allowed(self):
         """Testing if PUT method is not allowed."""
         response = self._put_update(data={}, id_value=self.order_detail.id)
@@ -187,6 +428,43 @@ class OrderDetailModelViewSetTest(OrderBaseModelViewSetTestCase):
             code="invalid",
         )
 
+    def test_partial_update_duplicated_product(self):
+        """Testing if changing a detail to a product already in its order is rejected by the unique constraint."""
+        order_detail = OrderFactory.create_order_detail(order=self.order, product_id=self.product_2.id, quantity=1)
+        response = self._patch_partial_update(data={"product_id": self.product.id}, id_value=order_detail.id)
+        assert response.status_code == HTTP_400_BAD_REQUEST
+        assert response.data["order"][0] == ErrorDetail(
+            string=f"Ya existe otro detalle con el producto {self.product.id} para la orden {self.order.id}.",
+            code="invalid",
+        )
+        order_detail.refresh_from_db()
+        self.product_2.refresh_from_db()
+        assert order_detail.product_id == self.product_2.id
+        assert self.product_2.stock == 2500  # the release of its stock was rolled back.
+
+    def test_update_same_product(self):
+        """Testing if a detail can be updated keeping its own order and product."""
+        put_data = {"order_id": self.order.id, "product_id": self.product.id, "quantity": 1}
+        response = self._put_update(data=put_data, id_value=self.order_detail.id)
+        assert response.status_code == HTTP_200_OK
+        assert response.data["quantity"] == 1
+
+    def test_validate_many_queries(self):
+        """Testing if validating many details costs the same queries no matter how many they are."""
+        for size in (2, 50):
+            products = [ProductFactory.create_product(stock=10) for _ in range(size)]
+            order = OrderFactory.create_order()
+            data = [{"order_id": order.id, "product_id": product.id, "quantity": 1} for product in products]
+            with self.assertNumQueries(3):
+                assert OrderDetailSerializer(data=data, many=True).is_valid()
+        data[-1]["product_id"] = self.product.id
+        OrderFactory.create_order_detail(order=order, product_id=self.product.id, quantity=1)
+        serializer = OrderDetailSerializer(data=data, many=True)
+        assert not serializer.is_valid()
+        assert serializer.errors[0]["order"][0] == (
+            f"Ya existe otro detalle con el producto {self.product.id} para la orden {order.id}."
+        )
+
     def test_list_not_allowed(self):
         """Testing if GET method (list) is not allowed."""
         response = self._get_list()
@@ -257,3 +535,783 @@ class OrderDetailModelViewSetTest(OrderBaseModelViewSetTestCase):
         response = self._delete_destroy(id_value=self.order_detail.id)
         assert response.status_code == HTTP_204_NO_CONTENT
         assert OrderDetail.objects.count() == 0
+
+    def test_stock_reservation(self):
+        """Testing if the stock is reserved on create and quantity increase, and released on decrease and delete."""
+        create_data = {"product_id": self.product_2.id, "order_id": self.order.id, "quantity": 100}
+        response = self._post_create(data=create_data)
+        assert response.status_code == HTTP_201_CREATED
+        self.product_2.refresh_from_db()
+        assert self.product_2.stock == 2400
+        order_detail_id = response.data["id"]
+        response = self._patch_partial_update(data={"quantity": 2500}, id_value=order_detail_id)
+        assert response.status_code == HTTP_200_OK
+        self.product_2.refresh_from_db()
+        assert self.product_2.stock == 0
+        response = self._patch_partial_update(data={"quantity": 40}, id_value=order_detail_id)
+        assert response.status_code == HTTP_200_OK
+        self.product_2.refresh_from_db()
+        assert self.product_2.stock == 2460
+        response = self._delete_destroy(id_value=order_detail_id)
+        assert response.status_code == HTTP_204_NO_CONTENT
+        self.product_2.refresh_from_db()
+        assert self.product_2.stock == 2500
+
+    def _assert_stocks(self, stock, stock_2):
+        self.product.refresh_from_db()
+        self.product_2.refresh_from_db()
+        assert (self.product.stock, self.product_2.stock) == (stock, stock_2)
+
+    def _assert_totals_and_rollup(self, *orders):
+        """Asserts the stored totals and sales rollup are the ones computed from the details."""
+        for order in Order.objects.with_totals().filter(id__in=[order.id for order in orders]):
+            assert round(order.total, 2) == round(order.annotated_total, 2)
+            assert order.items_count == order.annotated_items_count
+        rows = DailyProductSales.objects.order_by("day", "product_id")
+        rollup = list(rows.values_list("product_id", "units", "orders_count"))
+        DailyProductSales.objects.rebuild()
+        assert rollup == list(rows.values_list("product_id", "units", "orders_count"))
+
+    def test_bulk_create(self):
+        """Testing if a list of details, of several orders, is created reserving their stock."""
+        order_2 = OrderFactory.create_order()
+        create_data = [
+            {"order_id": self.order.id, "product_id": self.product_2.id, "quantity": 10},
+            {"order_id": order_2.id, "product_id": self.product.id, "quantity": 5},
+            {"order_id": order_2.id, "product_id": self.product_2.id, "quantity": 20},
+        ]
+        response = self._post_create(data=create_data)
+        assert response.status_code == HTTP_201_CREATED
+        assert [(data["order"], data["quantity"]) for data in response.data] == [
+            (self.order.id, 10),
+            (order_2.id, 5),
+            (order_2.id, 20),
+        ]
+        assert OrderDetail.objects.count() == 4
+        self._assert_stocks(995, 2470)
+        self._assert_totals_and_rollup(self.order, order_2)
+
+    def test_bulk_create_invalid(self):
+        """Testing if none of the details of a list is created if any is invalid, or their stock isn't enough."""
+        create_data = [
+            {"order_id": self.order.id, "product_id": self.product_2.id, "quantity": 10},
+            {"order_id": self.order.id, "product_id": self.product.id, "quantity": 1},
+        ]
+        response = self._post_create(data=create_data)
+        assert response.status_code == HTTP_400_BAD_REQUEST
+        assert response.data[1]["order"][0] == (
+            f"Ya existe otro detalle con el producto {self.product.id} para la orden {self.order.id}."
+        )
+        order_2 = OrderFactory.create_order()
+        create_data = [
+            {"order_id": self.order.id, "product_id": self.product_2.id, "quantity": 2000},
+            {"order_id": order_2.id, "product_id": self.product_2.id, "quantity": 2000},
+        ]
+        response = self._post_create(data=create_data)
+        assert response.status_code == HTTP_400_BAD_REQUEST
+        assert "pues solo quedan 2500" in response.data["non_field_errors"][0]
+        assert OrderDetail.objects.count() == 1
+        self._assert_stocks(1000, 2500)
+
+    def test_bulk_partial_update(self):
+        """Testing if a list of details is updated, reserving or releasing the difference of their stock."""
+        order_detail_2 = OrderFactory.create_order_detail(order=self.order, product_id=self.product_2.id, quantity=10)
+        order_2 = OrderFactory.create_order()
+        patch_data = [
+            {"id": self.order_detail.id, "quantity": 7},
+            {"id": order_detail_2.id, "order_id": order_2.id, "quantity": 30},
+        ]
+        response = self.client.patch(reverse("order-details-list"), patch_data, format="json")
+        assert response.status_code == HTTP_200_OK
+        assert [(data["id"], data["order"], data["quantity"]) for data in response.data] == [
+            (self.order_detail.id, self.order.id, 7),
+            (order_detail_2.id, order_2.id, 30),
+        ]
+        order_detail_2.refresh_from_db()
+        assert (order_detail_2.order_id, order_detail_2.quantity) == (order_2.id, 30)
+        self._assert_stocks(1070, 2480)  # their old quantities weren't reserved by the fixtures.
+        self._assert_totals_and_rollup(self.order, order_2)
+
+    def test_bulk_partial_update_invalid(self):
+        """Testing if none of the details of a list is updated if any is invalid."""
+        order_detail_2 = OrderFactory.create_order_detail(order=self.order, product_id=self.product_2.id, quantity=10)
+        patch_data = [{"id": self.order_detail.id, "quantity": 7}, {"id": 0, "quantity": 1}]
+        response = self.client.patch(reverse("order-details-list"), patch_data, format="json")
+        assert response.status_code == HTTP_400_BAD_REQUEST
+        assert response.data[1]["id"][0] == 'Invalid pk "0" - object does not exist.'
+        patch_data = [
+            {"id": self.order_detail.id, "quantity": 7},
+            {"id": order_detail_2.id, "order_id": self.order.id, "product_id": self.product.id},
+        ]
+        response = self.client.patch(reverse("order-details-list"), patch_data, format="json")
+        assert response.status_code == HTTP_400_BAD_REQUEST
+        assert response.data[1]["order"][0] == "No puede duplicar productos en la misma orden."
+        assert self.order.order_details.get(id=self.order_detail.id).quantity == 77
+        self._assert_stocks(1000, 2500)
+
+    def test_bulk_destroy(self):
+        """Testing if a list of details is deleted releasing their stock, or none if any doesn't exist."""
+        order_detail_2 = OrderFactory.create_order_detail(order=self.order, product_id=self.product_2.id, quantity=10)
+        path = reverse("order-details-list")
+        response = self.client.delete(path, [self.order_detail.id, 0], format="json")
+        assert response.status_code == HTTP_404_NOT_FOUND
+        assert response.data["detail"] == "No existen los detalles 0."
+        assert self.client.delete(path, {"id": 1}, format="json").status_code == HTTP_400_BAD_REQUEST
+        assert OrderDetail.objects.count() == 2
+        response = self.client.delete(path, [self.order_detail.id, order_detail_2.id], format="json")
+        assert response.status_code == HTTP_204_NO_CONTENT
+        assert OrderDetail.objects.count() == 0
+        self._assert_stocks(1077, 2510)
+        self._assert_totals_and_rollup(self.order)
+        assert DailyProductSales.objects.count() == 0
+
+
+class OrderTotalsTest(OrderBaseModelViewSetTestCase):
+    url_name = "order-details"
+
+    def _assert_totals(self, order):
+        order.refresh_from_db()
+        expected = Order.objects.with_totals().get(id=order.id)
+        assert round(order.total, 2) == round(expected.annotated_total, 2)
+        assert order.items_count == expected.annotated_items_count
+        return order
+
+    def test_totals_follow_details(self):
+        """Testing if the stored totals are updated when the details are created, updated and deleted."""
+        order = self._assert_totals(self.order)
+        assert order.items_count == 77
+        create_data = {"product_id": self.product_2.id, "order_id": order.id, "quantity": 10}
+        order_detail_id = self._post_create(data=create_data).data["id"]
+        assert self._assert_totals(order).items_count == 87
+        self._patch_partial_update(data={"quantity": 20}, id_value=order_detail_id)
+        assert self._assert_totals(order).items_count == 97
+        order_2 = OrderFactory.create_order()
+        put_data = {"order_id": order_2.id, "product_id": self.product_2.id, "quantity": 5}
+        self._put_update(data=put_data, id_value=order_detail_id)
+        assert self._assert_totals(order).items_count == 77
+        assert self._assert_totals(order_2).items_count == 5
+        self._delete_destroy(id_value=order_detail_id)
+        assert self._assert_totals(order_2).total == 0
+
+    def test_totals_follow_price(self):
+        """Testing if the stored totals are repriced when a product's price changes."""
+        self.client.patch(reverse("products-detail", kwargs={"pk": self.product.id}), {"price": 10}, format="json")
+        assert round(self._assert_totals(self.order).total, 2) == 770
+
+    def test_repair_command(self):
+        """Testing if the repair_order_totals command fixes the drifted totals."""
+        Order.objects.update(total=1, items_count=1)
+        call_command("repair_order_totals", "--dry-run", stdout=StringIO())
+        assert Order.objects.get(id=self.order.id).total == 1
+        stdout = StringIO()
+        call_command("repair_order_totals", "--batch-size", "1", stdout=stdout)
+        assert "repaired 1" in stdout.getvalue()
+        self._assert_totals(self.order)
+
+
+class OrderExportTest(OrderBaseModelViewSetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.order_2 = OrderFactory.create_order(
+            date="2021-01-01", order_details=[{"product_id": self.product_2.id, "quantity": 3}]
+        )
+
+    def _get_export(self, **params):
+        response = self.client.get(reverse("orders-export"), params)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_export_ndjson(self):
+        """Testing if the orders are streamed as NDJSON with their details and totals."""
+        response, content = self._get_export()
+        assert response.status_code == HTTP_200_OK
+        orders = [json.loads(line) for line in content.splitlines()]
+        assert [order["id"] for order in orders] == [self.order.id, self.order_2.id]  # by date.
+        assert orders[1]["total_pesos"] == self.order_2.total
+        assert orders[1]["order_details"] == [
+            {"id": self.order_2.order_details.get().id, "product": self.product_2.id, "quantity": 3}
+        ]
+
+    def test_export_csv_filtered(self):
+        """Testing if the orders are streamed as CSV, one row per detail, filtered by date."""
+        response, content = self._get_export(export_format="csv", date_from="2020-01-01", date_to="2020-12-31")
+        assert response["Content-Type"] == "text/csv"
+        rows = content.splitlines()
+        assert rows[0].startswith("id,date,created,updated,total_pesos,items_count")
+        assert len(rows) == 2
+        assert rows[1].startswith(f"{self.order.id},2020-03-20 00:00:00,")
+
+    def test_export_date_to_whole_day(self):
+        """Testing if a date_to without time includes the orders of that whole day."""
+        order_3 = OrderFactory.create_order(date="2021-01-01 18:30")
+        response, content = self._get_export(date_from="2021-01-01", date_to="2021-01-01")
+        assert [json.loads(line)["id"] for line in content.splitlines()] == [self.order_2.id, order_3.id]
+        response, content = self._get_export(date_to="2021-01-01 12:00")
+        assert [json.loads(line)["id"] for line in content.splitlines()] == [self.order.id, self.order_2.id]
+
+    def test_export_bad_filter(self):
+        """Testing if an invalid filter is a 400."""
+        response = self.client.get(reverse("orders-export"), {"updated_since": "yesterday"})
+        assert response.status_code == HTTP_400_BAD_REQUEST
+        assert "updated_since" in response.data
+
+    def test_export_command(self):
+        """Testing if the export_orders command writes the filtered orders."""
+        stdout = StringIO()
+        call_command("export_orders", "--updated-since", "2000-01-01", "--chunk-size", "1", stdout=stdout)
+        assert len(stdout.getvalue().splitlines()) == 2
+
+
+@skipUnless(connection.vendor == "postgresql", "Row level locks need PostgreSQL.")
+class StockReservationConcurrencyTest(TransactionTestCase):
+    writes = 300
+    writers = 120  # concurrent connections, as many as the server allows: 100 with its default max_connections.
+
+    def _get_writers(self):
+        """The writers up to the free connections, plus this thread's, which also writes."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT current_setting('max_connections')::int - COUNT(*) + 1 FROM pg_stat_activity "
+                "WHERE backend_type = 'client backend'"
+            )
+            return min(self.writers, cursor.fetchone()[0])
+
+    def _run_writes(self, write):
+        """Runs the writes on concurrent connections and returns the exception raised by each one, or None."""
+        results = [None] * self.writes
+        indexes = SimpleQueue()
+        for index in range(self.writes):
+            indexes.put(index)
+
+        def write_all():
+            while True:
+                try:
+                    index = indexes.get_nowait()
+                except Empty:
+                    return
+                try:
+                    write(index)
+                except Exception as exception:
+                    results[index] = exception
+
+        def writer():
+            try:
+                write_all()
+            finally:
+                connection.close()  # each thread opens its own connection, and keeps it for all its writes.
+
+        threads = [Thread(target=writer) for x in range(self._get_writers() - 1)]
+        for thread in threads:
+            thread.start()
+        write_all()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_hot_product(self):
+        """Testing if concurrent reservations of a single product never oversell it."""
+        product = ProductFactory.create_product(stock=150)
+        results = self._run_writes(lambda index: Product.objects.reserve_stock({product.id: 1}))
+        product.refresh_from_db()
+        assert product.stock == 0
+        assert results.count(None) == 150
+        assert all(isinstance(result, InsufficientStock) for result in results if result is not None)
+
+    def test_many_products_without_deadlocks(self):
+        """Testing if concurrent reservations of the same products, requested in any order, don't deadlock."""
+        products = [ProductFactory.create_product(stock=self.writes) for x in range(5)]
+
+        def reserve(index):
+            items = [(product.id, 1) for product in products]
+            shuffle(items)
+            with transaction.atomic():
+                Product.objects.reserve_stock(dict(items))
+
+        assert self._run_writes(reserve) == [None] * self.writes  # a deadlock would raise an OperationalError.
+        for product in products:
+            product.refresh_from_db()
+            assert product.stock == 0
+
+    def test_swaps_without_deadlocks(self):
+        """Testing if concurrent reservations that also release stock, like product swaps, don't deadlock."""
+        products = [ProductFactory.create_product(stock=self.writes) for x in range(2)]
+
+        def swap(index):
+            reserved, released = products if index % 2 else products[::-1]
+            with transaction.atomic():
+                Product.objects.reserve_stock({released.id: -1, reserved.id: 1})
+
+        assert self._run_writes(swap) == [None] * self.writes  # a deadlock would raise an OperationalError.
+        for product in products:
+            product.refresh_from_db()
+            assert product.stock == self.writes  # as many reserved as released.
+
+
+    def test_concurrent_detail_updates(self):
+        """Testing if concurrent PATCHes of the same detail keep its stock, order totals and sales consistent."""
+        product = ProductFactory.create_product(stock=1000)
+        order = OrderFactory.create_order(order_details=[{"product_id": product.id, "quantity": 1}])
+        order_detail = order.order_details.get()
+        product.refresh_from_db()
+        available = product.stock + order_detail.quantity
+        url = reverse("order-details-detail", kwargs={"pk": order_detail.pk})
+
+        def patch(index):
+            response = APIClient().patch(url, {"quantity": index % 3 + 1}, format="json")
+            assert response.status_code == HTTP_200_OK, response.data
+
+        assert self._run_writes(patch) == [None] * self.writes
+        order_detail.refresh_from_db()
+        product.refresh_from_db()
+        order.refresh_from_db()
+        assert product.stock + order_detail.quantity == available
+        assert order.items_count == order_detail.quantity
+        assert round(order.total, 2) == round(order_detail.quantity * product.price, 2)  # summed deltas.
+        assert DailyProductSales.objects.get(product=product).units == order_detail.quantity
+
+
+class OrderAsyncViewTest(OrderBaseModelViewSetTestCase):
+    url_name = "orders-async"
+
+    @patch(
+        "orders.requester.AsyncDolarSiRequester.get_main_values",
+        return_value=dolar_si_mocked_data,
+    )
+    def test_list_success(self, get_main_values):
+        """Testing if the async list returns the same orders than the sync one."""
+        OrderFactory.create_order(order_details=[{"product_id": self.product_2.id, "quantity": 10}])
+        response = self._get_list()
+        assert response.status_code == HTTP_200_OK
+        data = response.json()
+        assert data["count"] == 2
+        for result in data["results"]:
+            order = Order.objects.get(id=result["id"])
+            assert result["total_pesos"] == order.get_total()
+            assert result["total_usd"] == order.get_total_usd(buy_value=182)
+            assert len(result["order_details"]) == 1
+        assert get_main_values.call_count == 1
+
+    @patch(
+        "orders.requester.AsyncDolarSiRequester.get_main_values",
+        return_value=dolar_si_mocked_data,
+    )
+    def test_retrive_success(self, *args):
+        """Testing if the async retrieve returns a single Order and their OrderDetails."""
+        response = self._get_retrive(id_value=self.order.id)
+        assert response.status_code == HTTP_200_OK
+        data = response.json()
+        assert data["id"] == self.order.id
+        assert data["total_usd"] == self.order.get_total_usd(buy_value=182)
+        assert data["order_details"][0]["quantity"] == 77
+
+    @patch("orders.requester.AsyncDolarSiRequester.get_main_values")
+    def test_list_with_stored_rates(self, get_main_values):
+        """Testing if the async list converts the totals with the stored rates, without awaiting the live one."""
+        ExchangeRate.objects.create(name="Dolar Blue", buy=100, sell=110)
+        data = self._get_list().json()
+        assert data["results"][0]["total_usd"] == round(self.order.total / 100, 2)
+        get_main_values.assert_not_called()
+
+    def test_retrive_not_found(self):
+        """Testing if the async retrieve of a missing Order is a 404."""
+        response = self._get_retrive(id_value="missing")
+        assert response.status_code == 404
+
+
+class ExchangeRateTest(OrderBaseModelViewSetTestCase):
+    url_name = "orders"
+
+    @patch(
+        "orders.requester.DolarSiRequester.get_main_values",
+        return_value=dolar_si_mocked_data,
+    )
+    def test_refresh_exchange_rates(self, *args):
+        """Testing if the command stores every quote, and only the changed ones on the next refreshes."""
+        stdout = StringIO()
+        call_command("refresh_exchange_rates", stdout=stdout)
+        call_command("refresh_exchange_rates", stdout=stdout)
+        assert stdout.getvalue().splitlines() == [
+            "Fetched 3 quotes, stored 3 changed rates.",
+            "Fetched 3 quotes, stored 0 changed rates.",
+        ]
+        rates = {rate.name: (rate.buy, rate.sell) for rate in ExchangeRate.objects.all()}
+        assert rates == {"Dolar Oficial": (98.53, 104.53), "Dolar Blue": (182, 185), "Dolar Soja": (None, None)}
+
+    @patch("orders.requester.DolarSiRequester.get_main_values")
+    def test_total_usd_at_order_date(self, get_main_values):
+        """Testing if total_usd uses the rate in effect at the order's date, without fetching the live one."""
+        self.order.date = datetime(2020, 3, 20, tzinfo=timezone.utc)
+        self.order.save()
+        rates = [(datetime(2020, 1, 1), 100), (datetime(2021, 1, 1), 200), (datetime(2022, 1, 1), 400)]
+        for date, buy in rates:
+            ExchangeRate.objects.create(name="Dolar Blue", buy=buy, date=date.replace(tzinfo=timezone.utc))
+        old_order = OrderFactory.create_order(
+            date=datetime(2019, 1, 1, tzinfo=timezone.utc),
+            order_details=[{"product_id": self.product_2.id, "quantity": 1}],
+        )
+        response = self._get_list()
+        total_usd = {result["id"]: result["total_usd"] for result in response.data["results"]}
+        assert total_usd[self.order.id] == round(self.order.total / 100, 2)
+        assert total_usd[old_order.id] == round(old_order.total / 100, 2)  # older than the rates, the first one.
+        assert self._get_retrive(id_value=self.order.id).data["total_usd"] == total_usd[self.order.id]
+        get_main_values.assert_not_called()
+
+
+class OrderBulkIngestTest(OrderBaseModelViewSetTestCase):
+    def _post_bulk(self, data, strict=False):
+        url = reverse("orders-bulk-ingest") + ("?strict=true" if strict else "")
+        return self.client.post(url, data, format="json")
+
+    def _orders_data(self, count):
+        return [
+            {"id": f"bulk-{x}", "date": "2021-10-10", "order_details": [{"product_id": self.product.id, "quantity": 1}]}
+            for x in range(count)
+        ]
+
+    def test_bulk_success(self):
+        """Testing if many Orders and their OrderDetails are created with a constant number of queries."""
+        with CaptureQueriesContext(connection) as context:
+            response = self._post_bulk(self._orders_data(3))
+        queries_count = len(context.captured_queries)
+        assert response.status_code == HTTP_201_CREATED
+        assert response.data["created"] == 3
+        with CaptureQueriesContext(connection) as context:
+            response = self._post_bulk(self._orders_data(30)[3:])
+        assert response.data["created"] == 27
+        assert len(context.captured_queries) == queries_count
+        assert Order.objects.count() == 31
+        assert OrderDetail.objects.count() == 31
+
+    def test_bulk_partial_errors(self):
+        """Testing if invalid Orders are reported without aborting the valid ones."""
+        orders_data = self._orders_data(2) + [
+            {"id": self.order.id, "order_details": []},
+            {"id": "bulk-repeated", "order_details": [{"product_id": self.product.id, "quantity": 1}] * 2},
+            {"id": "bulk-no-product", "order_details": [{"product_id": "missing", "quantity": 1}]},
+            {"id": "bulk-no-stock", "order_details": [{"product_id": self.product_2.id, "quantity": 2501}]},
+        ]
+        response = self._post_bulk(orders_data)
+        assert response.status_code == HTTP_201_CREATED
+        assert response.data["created_ids"] == ["bulk-0", "bulk-1"]
+        assert [error["index"] for error in response.data["errors"]] == [2, 3, 4, 5]
+        assert response.data["errors"][3]["errors"]["order_details"] == [
+            f"No se puede pedir 2501 de {self.product_2.name}, pues solo quedan 2500."
+        ]
+        assert Order.objects.count() == 3
+
+    def test_bulk_strict(self):
+        """Testing if no Order is created in strict mode when any of them is invalid."""
+        orders_data = self._orders_data(2) + [{"id": "bulk-bad", "order_details": [{"product_id": "missing"}]}]
+        response = self._post_bulk(orders_data, strict=True)
+        assert response.status_code == HTTP_400_BAD_REQUEST
+        assert response.data["errors"][0]["index"] == 2
+        assert Order.objects.count() == 1
+
+    def test_bulk_ndjson(self):
+        """Testing if Orders are created from a NDJSON stream."""
+        body = "\n".join(json.dumps(order_data) for order_data in self._orders_data(2))
+        response = self.client.post(reverse("orders-bulk-ingest"), body, content_type="application/x-ndjson")
+        assert response.status_code == HTTP_201_CREATED
+        assert response.data["created"] == 2
+
+
+class SalesAnalyticsTest(OrderBaseModelViewSetTestCase):
+    url_name = "order-details"
+
+    def _get_rollup(self):
+        rows = DailyProductSales.objects.values_list("day", "product_id", "revenue", "units", "orders_count")
+        return {
+            (str(day), product_id): (round(revenue, 2), units, orders_count)
+            for day, product_id, revenue, units, orders_count in rows
+        }
+
+    def _assert_rollup(self):
+        """Asserts the incremental rollup is the one rebuilt from the details, and returns it."""
+        rollup = self._get_rollup()
+        DailyProductSales.objects.rebuild()
+        assert rollup == self._get_rollup()
+        return rollup
+
+    @patch(
+        "orders.requester.DolarSiRequester.get_main_values",
+        return_value=dolar_si_mocked_data,
+    )
+    def test_rollup_follows_changes(self, *args):
+        """Testing if the rollup is updated when the details, the orders' dates and the prices change."""
+        price = self.product.price
+        assert self._assert_rollup() == {("2020-03-20", self.product.id): (round(price * 77, 2), 77, 1)}
+        order_2 = OrderFactory.create_order(date="2020-03-20")
+        create_data = {"product_id": self.product.id, "order_id": order_2.id, "quantity": 10}
+        order_detail_id = self._post_create(data=create_data).data["id"]
+        self._patch_partial_update(data={"quantity": 20}, id_value=order_detail_id)
+        assert self._assert_rollup()[("2020-03-20", self.product.id)] == (round(price * 97, 2), 97, 2)
+        self.client.patch(reverse("orders-detail", kwargs={"pk": order_2.id}), {"date": "2020-03-21"}, format="json")
+        self.client.patch(reverse("products-detail", kwargs={"pk": self.product.id}), {"price": 10}, format="json")
+        assert self._assert_rollup() == {
+            ("2020-03-20", self.product.id): (770, 77, 1),
+            ("2020-03-21", self.product.id): (200, 20, 1),
+        }
+        self._delete_destroy(id_value=order_detail_id)
+        self.client.delete(reverse("orders-detail", kwargs={"pk": self.order.id}))
+        assert self._assert_rollup() == {}
+
+    def test_rollup_bulk_ingest(self):
+        """Testing if the orders created in bulk are rolled up."""
+        orders_data = [
+            {"id": f"bulk-{x}", "date": "2021-10-10", "order_details": [{"product_id": self.product.id, "quantity": 2}]}
+            for x in range(3)
+        ]
+        self.client.post(reverse("orders-bulk-ingest"), orders_data, format="json")
+        assert self._assert_rollup()[("2021-10-10", self.product.id)] == (round(self.product.price * 6, 2), 6, 3)
+
+    def test_catch_up_command(self):
+        """Testing if the command rebuilds the days changed without the signals."""
+        rollup = self._get_rollup()
+        OrderDetail.objects.update(quantity=10)  # bumps updated, without signals.
+        stdout = StringIO()
+        call_command("rollup_daily_sales", "--since", "2000-01-01", stdout=stdout)
+        assert stdout.getvalue() == "Rebuilt 1 days updated since 2000-01-01T00:00:00+00:00.\n"
+        assert self._get_rollup() == {("2020-03-20", self.product.id): (round(self.product.price * 10, 2), 10, 1)}
+        DailyProductSales.objects.all().delete()
+        OrderDetail.objects.update(quantity=77)
+        call_command("rollup_daily_sales", stdout=stdout)  # nothing rolled up, rebuilds every day.
+        assert self._get_rollup() == rollup
+
+    def test_sales_and_top_sellers(self):
+        """Testing if the sales and top sellers are read from the rollup, filtered by date."""
+        OrderFactory.create_order(date="2020-03-21", order_details=[{"product_id": self.product_2.id, "quantity": 1}])
+        OrderFactory.create_order(date="2020-04-01", order_details=[{"product_id": self.product_2.id, "quantity": 500}])
+        response = self.client.get(reverse("sales-list"), {"date_from": "2020-03-01", "date_to": "2020-03-31"})
+        assert response.status_code == HTTP_200_OK
+        assert [(row["day"], row["product"], row["units"]) for row in response.data["results"]] == [
+            ("2020-03-20", self.product.id, 77),
+            ("2020-03-21", self.product_2.id, 1),
+        ]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse("sales-top-sellers"), {"order_by": "units", "limit": 1})
+        assert len(context.captured_queries) == 1
+        assert response.data == [
+            {
+                "product": self.product_2.id,
+                "name": self.product_2.name,
+                "revenue": DailyProductSales.objects.filter(product=self.product_2).top_sellers()[0]["revenue"],
+                "units": 501,
+                "orders_count": 2,
+            }
+        ]
+        response = self.client.get(reverse("sales-list"), {"date_from": "2020-04-01", "date_to": "2020-03-01"})
+        assert response.status_code == HTTP_400_BAD_REQUEST
+        assert "date_to" in response.data
+
+
+class OrderQueryBudgetTest(QueryBudgetTestCase):
+    def _create_products(self, count):
+        products = [Product(id=uuid4().hex[:20], name="Budget", price=100, stock=1000) for x in range(count)]
+        return Product.objects.bulk_create(products)
+
+    def _create_orders(self, count, details=1):
+        """Orders with `details` details each, written in bulk, and then their totals and sales."""
+        products = self._create_products(details)
+        orders = Order.objects.bulk_create([Order(id=uuid4().hex[:20], date=now()) for x in range(count)])
+        OrderDetail.objects.bulk_create(
+            [OrderDetail(order=order, product=product, quantity=1) for order in orders for product in products]
+        )
+        Order.objects.filter(pk__in=[order.pk for order in orders]).recompute_totals()
+        DailyProductSales.objects.rebuild()
+        return orders
+
+    def _create_order(self, details):
+        return self._create_orders(1, details)[0]
+
+    def _get_order_detail(self, details):
+        return self._create_order(details).order_details.first()
+
+    def _get_order_details(self, details):
+        return list(self._create_order(details).order_details.all())
+
+    def test_list(self):
+        """Testing if listing orders costs the same queries and DolarSi calls with 1, 15 or 100 of them."""
+        self.assert_budget(self._create_orders, lambda orders: self.client.get(reverse("orders-list")), 8, 1)
+        params = {"pagination": "cursor"}
+        self.assert_budget(self._create_orders, lambda orders: self.client.get(reverse("orders-list"), params), 6, 1)
+
+    def test_list_stored_rates(self):
+        """Testing if listing orders doesn't call DolarSi when there are stored rates."""
+        ExchangeRate.objects.create(name="Dolar Blue", buy=100, sell=110, date="2000-01-01")
+        self.assert_budget(self._create_orders, lambda orders: self.client.get(reverse("orders-list")), 8)
+
+    def test_retrieve(self):
+        """Testing if retrieving an order costs the same queries with 1, 15 or 100 details."""
+        send_request = lambda order: self.client.get(reverse("orders-detail", kwargs={"pk": order.id}))
+        self.assert_budget(self._create_order, send_request, 6, 1)
+
+    def test_create(self):
+        """Testing if creating an order with 1, 15 or 100 details costs the same queries."""
+
+        def send_request(products):
+            order_details = [{"product_id": product.id, "quantity": 1} for product in products]
+            data = {"id": uuid4().hex[:20], "order_details": order_details}
+            return self.client.post(reverse("orders-list"), data, format="json")
+
+        self.assert_budget(self._create_products, send_request, 12, 1)
+
+    def test_partial_update(self):
+        """Testing if moving an order to another day costs the same queries with 1, 15 or 100 details."""
+        path = lambda order: reverse("orders-detail", kwargs={"pk": order.id})
+        send_request = lambda order: self.client.patch(path(order), {"date": "2018-12-25"}, format="json")
+        self.assert_budget(self._create_order, send_request, 8, 1)
+
+    def test_partial_update_order_details(self):
+        """Testing if syncing the details of an order with 1, 15 or 100 of them costs the same queries."""
+
+        def setup(size):
+            order = self._create_order(size + 1)
+            product_ids = [order_detail.product_id for order_detail in order.order_details.all()]
+            return order, product_ids[:-1], self._create_products(size)  # to update, and insert; the last is deleted.
+
+        def send_request(value):
+            order, updated_product_ids, inserted_products = value
+            order_details = [{"product_id": product_id, "quantity": 2} for product_id in updated_product_ids]
+            order_details += [{"product_id": product.id, "quantity": 1} for product in inserted_products]
+            path = reverse("orders-detail", kwargs={"pk": order.id})
+            return self.client.patch(path, {"order_details": order_details}, format="json")
+
+        self.assert_budget(setup, send_request, 16, 1)
+
+    def test_destroy(self):
+        """Testing if deleting an order with 1, 15 or 100 details costs the same queries."""
+        send_request = lambda order: self.client.delete(reverse("orders-detail", kwargs={"pk": order.id}))
+        self.assert_budget(self._create_order, send_request, 16)
+
+    def test_bulk_ingest(self):
+        """Testing if ingesting 1, 15 or 100 orders, of as many products, costs the same queries."""
+
+        def send_request(products):
+            order_details = [{"product_id": product.id, "quantity": 1} for product in products]
+            data = [{"id": uuid4().hex[:20], "order_details": [order_detail]} for order_detail in order_details]
+            return self.client.post(reverse("orders-bulk-ingest"), data, format="json")
+
+        self.assert_budget(self._create_products, send_request, 10)
+
+    def test_export(self):
+        """Testing if exporting 1, 15 or 100 orders costs the same queries."""
+        self.assert_budget(self._create_orders, lambda orders: self.client.get(reverse("orders-export")), 2)
+
+    def test_order_detail_create(self):
+        """Testing if adding a detail to an order with 1, 15 or 100 details costs the same queries."""
+
+        setup = lambda size: (self._create_order(size), self._create_products(1)[0])
+
+        def send_request(value):
+            order, product = value
+            data = {"order_id": order.id, "product_id": product.id, "quantity": 1}
+            return self.client.post(reverse("order-details-list"), data, format="json")
+
+        self.assert_budget(setup, send_request, 13)
+
+    def test_order_detail_update(self):
+        """Testing if updating a detail of an order with 1, 15 or 100 details costs the same queries."""
+        path = lambda order_detail: reverse("order-details-detail", kwargs={"pk": order_detail.id})
+        send_request = lambda order_detail: self.client.patch(path(order_detail), {"quantity": 2}, format="json")
+        self.assert_budget(self._get_order_detail, send_request, 14)
+        send_request = lambda order_detail: self.client.put(
+            path(order_detail),
+            {"order_id": order_detail.order_id, "product_id": order_detail.product_id, "quantity": 3},
+            format="json",
+        )
+        self.assert_budget(self._get_order_detail, send_request, 17)
+
+    def test_order_detail_destroy(self):
+        """Testing if deleting a detail of an order with 1, 15 or 100 details costs the same queries."""
+        path = lambda order_detail: reverse("order-details-detail", kwargs={"pk": order_detail.id})
+        self.assert_budget(self._get_order_detail, lambda order_detail: self.client.delete(path(order_detail)), 12)
+
+    def test_order_detail_bulk_create(self):
+        """Testing if adding 1, 15 or 100 details to an order at once costs the same queries."""
+
+        def send_request(value):
+            order, products = value
+            data = [{"order_id": order.id, "product_id": product.id, "quantity": 1} for product in products]
+            return self.client.post(reverse("order-details-list"), data, format="json")
+
+        self.assert_budget(lambda size: (self._create_order(1), self._create_products(size)), send_request, 11)
+
+    def test_order_detail_bulk_update(self):
+        """Testing if updating 1, 15 or 100 details at once costs the same queries."""
+
+        def send_request(order_details):
+            data = [{"id": order_detail.id, "quantity": 2} for order_detail in order_details]
+            return self.client.patch(reverse("order-details-list"), data, format="json")
+
+        self.assert_budget(self._get_order_details, send_request, 11)
+
+    def test_order_detail_bulk_destroy(self):
+        """Testing if deleting 1, 15 or 100 details at once costs the same queries."""
+
+        def send_request(order_details):
+            data = [order_detail.id for order_detail in order_details]
+            return self.client.delete(reverse("order-details-list"), data, format="json")
+
+        self.assert_budget(self._get_order_details, send_request, 12)
+
+    def test_sales(self):
+        """Testing if the sales analytics of 1, 15 or 100 products cost the same queries."""
+        setup = lambda size: self._create_orders(1, details=size)
+        self.assert_budget(setup, lambda order: self.client.get(reverse("sales-list")), 2)
+        self.assert_budget(setup, lambda order: self.client.get(reverse("sales-top-sellers")), 1)
+
+
+class BenchmarkToolsTest(TestCase):
+    def test_generate_data(self):
+        """Testing if the generated orders follow the details distribution, with their totals and sales rollup."""
+        stdout = StringIO()
+        call_command("generate_data", products=5, orders=20, details="1:1,3:1", seed=1, batch_size=7, stdout=stdout)
+        assert stdout.getvalue().startswith("Generated 5 products, 20 orders and ")
+        assert Product.objects.count() == 5 and Order.objects.count() == 20
+        for order in Order.objects.with_totals():
+            assert order.order_details.count() in (1, 3)
+            assert round(order.total, 2) == round(order.annotated_total, 2)
+        assert DailyProductSales.objects.aggregate(units=Sum("units"))["units"] == sum(
+            OrderDetail.objects.values_list("quantity", flat=True)
+        )
+        with self.assertRaisesMessage(CommandError, "use another --prefix"):
+            call_command("generate_data", products=1, orders=1, stdout=stdout)
+
+    def test_dolarsi_stub(self):
+        """Testing if the stub serves DolarSi's main values, and fails at its failure rate."""
+        server = make_stub_server(port=0, blue_buy=190.5)
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            url = f"http://{server.server_address[0]}:{server.server_address[1]}{MAIN_VALUES_ENDPOINT}"
+            assert ("Dolar Blue", 190.5, 185.0) in parse_main_values(requests.get(url).json())
+            server.failure_rate = 1
+            assert requests.get(url).status_code == 503
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class BenchmarkApiTest(LiveServerTestCase):
+    def test_benchmark_api(self):
+        """Testing if the benchmark reports the latency and queries of each scenario."""
+        call_command("generate_data", products=5, orders=5, seed=1, stdout=StringIO())
+        Product.objects.update(stock=1000)
+        ExchangeRate.objects.create(name="Dolar Blue", buy=100, sell=110)  # total_usd without DolarSi.
+        stdout = StringIO()
+        # each live server thread has its own PostgreSQL connection, sqlite's in-memory database is a shared one.
+        concurrency = 4 if connection.vendor == "postgresql" else 1
+        call_command(
+            "benchmark_api", base_url=self.live_server_url, requests=8, concurrency=concurrency, stdout=stdout
+        )
+        report = json.loads(stdout.getvalue())
+        assert set(report["scenarios"]) == {
+            "products-list",
+            "products-retrieve",
+            "orders-list",
+            "orders-retrieve",
+            "orders-create",
+            "order-details-patch",
+        }
+        for scenario in report["scenarios"].values():
+            assert scenario["errors"] == 0
+            assert scenario["latency_ms"]["p50"] <= scenario["latency_ms"]["p99"]
+            assert scenario["queries_per_request"]["max"] > 0
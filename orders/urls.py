@@ -1,15 +1,20 @@
 # -*- coding: utf-8 -*-
 from django.conf.urls import include
 from django.urls import path
-from rest_framework.routers import SimpleRouter
+from utils.routers import BulkRouter
 
-from orders.views import OrderDetailModelViewSet, OrderModelViewSet
+from orders.views import (OrderDetailModelViewSet, OrderModelViewSet,
+                          SalesAnalyticsViewSet, order_list_async,
+                          order_retrieve_async)
 
-router = SimpleRouter()
+router = BulkRouter()  # PATCH and DELETE of lists of order details.
 router.register("orders", OrderModelViewSet, "orders")
 router.register("order-details", OrderDetailModelViewSet, "order-details")
+router.register("analytics/sales", SalesAnalyticsViewSet, "sales")
 
 
 urlpatterns = [
     path("", include(router.urls)),
+    path("async/orders/", order_list_async, name="orders-async-list"),
+    path("async/orders/<str:pk>/", order_retrieve_async, name="orders-async-detail"),
 ]
@@ -1,12 +1,41 @@
-from rest_framework.viewsets import ModelViewSet
+from asyncio import gather
 
-from orders.models import Order, OrderDetail
-from orders.serializers import OrderDetailSerializer, OrderSerializer
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.mixins import ListModelMixin
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.status import (HTTP_201_CREATED, HTTP_204_NO_CONTENT,
+                                   HTTP_400_BAD_REQUEST)
+from rest_framework.viewsets import GenericViewSet, ModelViewSet
+from utils.pagination import PageNumberOrKeysetPagination
+from utils.parsers import NDJSONParser
+from utils.views import ConditionalGetMixin, SparseFieldsMixin, ValuesListMixin
 
+from orders.bulk import OrderBulkIngestor
+from orders.export import EXPORT_FORMATS, iter_export, parse_export_filters
+from orders.models import DailyProductSales, ExchangeRate, Order, OrderDetail
+from orders.requester import (DOLAR_BLUE, AsyncDolarSiRequester,
+                              DolarSiRequester)
+from orders.serializers import (ORDER_FIELDS, DailyProductSalesSerializer,
+                                OrderDetailSerializer, OrderSerializer,
+                                SalesFiltersSerializer, is_id,
+                                represent_orders)
 
-class OrderModelViewSet(ModelViewSet):
-    queryset = Order.objects.all().prefetch_related("order_details")
+
+class OrderModelViewSet(ConditionalGetMixin, SparseFieldsMixin, ValuesListMixin, ModelViewSet):
+    queryset = Order.objects.all().prefetch_related(Prefetch("order_details", OrderDetail.objects.order_by("id")))
     serializer_class = OrderSerializer
+    pagination_class = PageNumberOrKeysetPagination
+    keyset_ordering = ("-date", "-id")  # indexed by orders_date_id_idx.
+    list_values_fields = ORDER_FIELDS
     http_method_names = (
         "get",
         "post",
@@ -14,8 +43,73 @@ class OrderModelViewSet(ModelViewSet):
         "delete",
     )  # put isn't allowed because id cant be completely updated
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if not self.is_field_requested("order_details"):
+            queryset = queryset.prefetch_related(None)
+        if self.is_field_requested("total_usd"):
+            queryset = queryset.with_dolar_blue_buy_value()
+        return queryset
+
+    def get_list_values_fields(self):
+        if self.is_field_requested("total_usd"):
+            return (*ORDER_FIELDS, "dolar_blue_buy_value")
+        return ORDER_FIELDS
+
+    def get_conditional_probes(self, queryset):
+        """The details of the orders, whose changes don't always change the order's updated, and the rates."""
+        probes = []
+        if self.is_field_requested("order_details"):
+            probes.append(OrderDetail.objects.filter(order__in=queryset))
+        if self.is_field_requested("total_usd"):
+            probes.append(ExchangeRate.objects.filter(name=DOLAR_BLUE))
+        return probes
+
+    def get_etag_extra(self):
+        if self.is_field_requested("total_usd") and not ExchangeRate.objects.filter(name=DOLAR_BLUE).exists():
+            return [DolarSiRequester().get_dolar_blue_buy_value()]  # the live one, converts every total.
+        return []
+
+    def represent_rows(self, rows):
+        live_buy_value = None
+        if self.is_field_requested("total_usd") and any(row["dolar_blue_buy_value"] is None for row in rows):
+            live_buy_value = DolarSiRequester().get_dolar_blue_buy_value()  # there aren't stored rates.
+        return represent_orders(rows, live_buy_value, self.get_requested_fields())
+
+    def perform_destroy(self, instance):
+        """Deletes its details at once first, so the cascade doesn't send a post_delete for each one."""
+        with transaction.atomic():
+            instance.order_details.release_and_delete()
+            instance.delete()
+
+    @action(detail=False, methods=["post"], url_path="bulk", parser_classes=[JSONParser, NDJSONParser])
+    def bulk_ingest(self, request):
+        """Creates a list (or NDJSON stream) of orders, use ?strict=true to create none if any is invalid."""
+        strict = request.query_params.get("strict", "").lower() in ("1", "true")
+        result = OrderBulkIngestor(request.data, strict=strict).run()
+        if result["errors"] and not result["created"]:
+            return Response(result, status=HTTP_400_BAD_REQUEST)
+        return Response(result, status=HTTP_201_CREATED)
+
+    @action(detail=False, methods=["get"], url_path="export")
+    def export(self, request):
+        """
+        Streams every order with its details and totals as NDJSON, or as CSV with ?export_format=csv. Filtered by
+        ?date_from=, ?date_to= and ?updated_since=.
+        """
+        export_format = request.query_params.get("export_format", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            return Response({"export_format": [f"Debe ser uno de {', '.join(EXPORT_FORMATS)}."]}, HTTP_400_BAD_REQUEST)
+        filters = parse_export_filters(request.query_params)
+        content_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+        response = StreamingHttpResponse(iter_export(export_format, filters), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="orders.{export_format}"'
+        return response
+
 
 class OrderDetailModelViewSet(ModelViewSet):
+    """Also creates (POST), updates (PATCH) and deletes (DELETE) lists of details, see OrderDetailListSerializer."""
+
     queryset = OrderDetail.objects.all()
     serializer_class = OrderDetailSerializer
     http_method_names = (
@@ -24,3 +118,131 @@ class OrderDetailModelViewSet(ModelViewSet):
         "patch",
         "delete",
     )  # only to create, update or delete
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ("update", "partial_update", "destroy"):  # in the transaction of update or destroy.
+            queryset = queryset.select_for_update(of=("self",))
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        if isinstance(kwargs.get("data"), list):
+            kwargs["many"] = True
+        return super().get_serializer(*args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
+        """Locks the detail first, so concurrent updates move the quantity each other saved, not the one they read."""
+        with transaction.atomic():
+            return super().update(request, *args, **kwargs)
+
+    def destroy(self, request, *args, **kwargs):
+        """Locks the detail first, so concurrent deletes of it release its stock once, the others are a 404."""
+        with transaction.atomic():
+            return super().destroy(request, *args, **kwargs)
+
+    def bulk_partial_update(self, request, *args, **kwargs):
+        """Updates a list of details, each with its id and the fields to change. All of them or none."""
+        items = request.data if isinstance(request.data, list) else []
+        ids = [item.get("id") for item in items if isinstance(item, dict) and is_id(item.get("id"))]
+        with transaction.atomic():  # the details are locked, their old values are subtracted.
+            order_details = self.get_queryset().filter(pk__in=ids).select_related("order", "product")
+            order_details = list(order_details.select_for_update(of=("self",)))
+            serializer = self.get_serializer(order_details, data=request.data, many=True, partial=True)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        return Response(serializer.data)
+
+    def bulk_destroy(self, request, *args, **kwargs):
+        """Deletes the details of a list of ids. All of them or none, if any doesn't exist."""
+        ids = request.data
+        if not isinstance(ids, list) or not all(is_id(pk) for pk in ids):
+            raise ValidationError("Se esperaba una lista de ids de detalles.")
+        with transaction.atomic():
+            missing_ids = set(ids) - set(self.get_queryset().filter(pk__in=ids).release_and_delete())
+            if missing_ids:
+                raise NotFound(f"No existen los detalles {', '.join(str(pk) for pk in sorted(missing_ids))}.")
+        return Response(status=HTTP_204_NO_CONTENT)
+
+
+class SalesAnalyticsViewSet(ListModelMixin, GenericViewSet):
+    """
+    Revenue, units and orders per product per day, and the top sellers of a range, read from the daily sales rollup
+    instead of aggregating the details. Filtered by ?date_from=, ?date_to= and ?product=.
+    """
+
+    queryset = DailyProductSales.objects.order_by("day", "product_id")  # by daily_product_sales_day_product_uniq.
+    serializer_class = DailyProductSalesSerializer
+
+    def get_filters(self):
+        if not hasattr(self, "_filters"):
+            serializer = SalesFiltersSerializer(data=self.request.query_params)
+            serializer.is_valid(raise_exception=True)
+            self._filters = serializer.validated_data
+        return self._filters
+
+    def filter_queryset(self, queryset):
+        filters = self.get_filters()
+        lookups = {"date_from": "day__gte", "date_to": "day__lte", "product": "product_id"}
+        return queryset.filter(**{lookup: filters[name] for name, lookup in lookups.items() if name in filters})
+
+    @action(detail=False, methods=["get"], url_path="top-sellers")
+    def top_sellers(self, request):
+        """The ?limit= products with the most revenue, or ?order_by=units or orders_count."""
+        filters = self.get_filters()
+        rows = self.filter_queryset(self.get_queryset()).top_sellers(filters["limit"], filters["order_by"])
+        return Response(
+            [
+                {
+                    "product": row["product_id"],
+                    "name": row["product__name"],
+                    "revenue": row["revenue"],
+                    "units": row["units"],
+                    "orders_count": row["orders_count"],
+                }
+                for row in rows
+            ]
+        )
+
+
+# Async read paths, served under ASGI: the orders are fetched while the live dolar blue's buy value is awaited, which
+# is only done when there aren't stored rates.
+
+
+def _get_orders_page(request):
+    drf_request = Request(request)
+    paginator = OrderModelViewSet.pagination_class()
+    queryset = OrderModelViewSet.queryset.with_dolar_blue_buy_value()
+    orders = paginator.paginate_queryset(queryset, drf_request, view=OrderModelViewSet)
+    return paginator, list(orders)
+
+
+def _get_order(pk):
+    order = get_object_or_404(OrderModelViewSet.queryset.with_dolar_blue_buy_value(), pk=pk)
+    list(order.order_details.all())  # evaluates the prefetch inside the sync thread.
+    return order
+
+
+def _serialize(orders, buy_value, many=False):
+    return OrderSerializer(orders, many=many, context={"dolar_blue_buy_value": buy_value}).data
+
+
+def _json_response(data):
+    return HttpResponse(JSONRenderer().render(data), content_type="application/json")
+
+
+async def _get_live_buy_value():
+    """None if there are stored rates, the first one is in effect at the dates older than it."""
+    if await sync_to_async(ExchangeRate.objects.filter(name=DOLAR_BLUE, buy__isnull=False).exists)():
+        return None
+    return await AsyncDolarSiRequester().get_dolar_blue_buy_value()
+
+
+async def order_list_async(request):
+    (paginator, orders), buy_value = await gather(sync_to_async(_get_orders_page)(request), _get_live_buy_value())
+    data = await sync_to_async(_serialize)(orders, buy_value, many=True)
+    return _json_response(paginator.get_paginated_response(data).data)
+
+
+async def order_retrieve_async(request, pk):
+    order, buy_value = await gather(sync_to_async(_get_order)(pk), _get_live_buy_value())
+    return _json_response(await sync_to_async(_serialize)(order, buy_value))
@@ -0,0 +1,19 @@
+from django.conf import settings
+from utils.cache import VersionedCache
+
+LIST_SCOPE = "list"
+DETAILS_SCOPE = "details"
+
+# responses of ProductModelViewSet. Lists are under the list scope, and each retrieve under the details scope and
+# its product's pk.
+product_response_cache = VersionedCache(
+    namespace="products", ttl=settings.PRODUCT_CACHE_TTL, cache_alias=settings.PRODUCT_CACHE_ALIAS
+)
+
+
+def invalidate_products(product_ids=None):
+    """Invalidates the cached lists and the details of the product ids, or of every product if they aren't given."""
+    if product_ids is None:
+        product_response_cache.bump(LIST_SCOPE, DETAILS_SCOPE)
+    else:
+        product_response_cache.bump(LIST_SCOPE, *product_ids)
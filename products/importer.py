@@ -0,0 +1,148 @@
+import csv
+import json
+from io import StringIO
+from time import monotonic
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import CharField, empty
+
+from products.cache import invalidate_products
+from products.serializers import ProductSerializer
+
+IMPORT_FORMATS = ("csv", "ndjson")
+COLUMNS = ("id", "name", "price", "stock")
+
+
+def get_row_fields():
+    """ProductSerializer's fields of the columns, with a required id without its UniqueValidator: rows are upserted."""
+    fields = ProductSerializer().fields
+    return {"id": CharField(max_length=fields["id"].max_length), **{name: fields[name] for name in COLUMNS[1:]}}
+
+
+def validate_row(row, fields=None):
+    """
+    Validates and converts a product row with ProductSerializer's field rules, without its per row queries.
+    Pass the `fields` of get_row_fields to validate many rows. Returns (values, errors), one of them None.
+    """
+    if not isinstance(row, dict):
+        return None, {"non_field_errors": ["Invalid data. Expected a dictionary."]}
+    fields = fields or get_row_fields()
+    errors = {}
+    values = {}
+    for name, field in fields.items():
+        try:
+            values[name] = field.run_validation(row.get(name, empty))
+        except ValidationError as error:
+            errors[name] = error.detail
+    if errors:
+        return None, errors
+    return values, None
+
+
+def iter_rows(stream, import_format):
+    """Yields (line number, row) of a text stream of CSV with a header, or NDJSON."""
+    if import_format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if line.strip():
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, None
+
+
+class ProductImporter:
+    """
+    Loads product rows into a temporary staging table with PostgreSQL's COPY, a batch at a time, then upserts them
+    into products with INSERT ... ON CONFLICT (id) in the same transaction. The last row of a repeated id wins, and
+    the orders' totals and sales rollup are repriced for the products whose price changed.
+    """
+
+    BATCH_SIZE = 50000  # rows copied at a time.
+    MAX_REPORTED_REJECTIONS = 1000
+
+    def __init__(self, stream, import_format="csv"):
+        self.stream = stream
+        self.import_format = import_format
+        self.rejected = []
+        self.rejected_count = 0
+        self.total_count = 0
+        self.fields = get_row_fields()
+
+    def run(self):
+        if connection.vendor != "postgresql":
+            raise ImproperlyConfigured("The products import uses COPY, it needs PostgreSQL.")
+        started = monotonic()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE products_import (line integer, id varchar(20), name varchar(50), "
+                "price double precision, stock integer) ON COMMIT DROP"
+            )
+            buffer = StringIO()
+            writer = csv.writer(buffer)
+            batch_count = 0
+            for line_number, row in iter_rows(self.stream, self.import_format):
+                self.total_count += 1
+                values, errors = validate_row(row, self.fields)
+                if errors:
+                    self._reject(line_number, errors)
+                    continue
+                writer.writerow([line_number] + [values[name] for name in COLUMNS])
+                batch_count += 1
+                if batch_count == self.BATCH_SIZE:
+                    self._copy(cursor, buffer)
+                    batch_count = 0
+            self._copy(cursor, buffer)
+            imported_count = self._upsert(cursor)
+            invalidate_products()
+        seconds = monotonic() - started
+        return {
+            "imported": imported_count,
+            "rejected_count": self.rejected_count,
+            "rejected": self.rejected,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.total_count / seconds) if seconds else self.total_count,
+        }
+
+    def _reject(self, line_number, errors):
+        self.rejected_count += 1
+        if len(self.rejected) < self.MAX_REPORTED_REJECTIONS:
+            self.rejected.append({"line": line_number, "errors": errors})
+
+    def _copy(self, cursor, buffer):
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY products_import (line, {', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        buffer.seek(0)
+        buffer.truncate()
+
+    def _upsert(self, cursor):
+        cursor.execute(
+            "CREATE TEMPORARY TABLE products_import_last ON COMMIT DROP AS "
+            "SELECT DISTINCT ON (id) id, name, price, stock FROM products_import ORDER BY id, line DESC"
+        )
+        # keeps the stored order totals and sales rollup following the current prices, like the price change signal.
+        cursor.execute(
+            "UPDATE orders SET total = orders.total + repriced.delta, updated = now() FROM ("
+            "SELECT order_details.order_id, SUM(order_details.quantity * (staged.price - products.price)) AS delta "
+            "FROM order_details JOIN products ON products.id = order_details.product_id "
+            "JOIN products_import_last AS staged ON staged.id = products.id "
+            "WHERE staged.price <> products.price GROUP BY order_details.order_id"
+            ") AS repriced WHERE orders.id = repriced.order_id"
+        )
+        cursor.execute(
+            "UPDATE daily_product_sales SET revenue = daily_product_sales.units * staged.price, updated = now() "
+            "FROM products_import_last AS staged JOIN products ON products.id = staged.id "
+            "WHERE daily_product_sales.product_id = staged.id AND staged.price <> products.price"
+        )
+        cursor.execute(
+            "INSERT INTO products (id, name, price, stock, created, updated) "
+            "SELECT id, name, price, stock, now(), now() FROM products_import_last "
+            "ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, price = EXCLUDED.price, stock = EXCLUDED.stock, "
+            "updated = EXCLUDED.updated"
+        )
+        return cursor.rowcount
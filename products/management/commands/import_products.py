@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import IMPORT_FORMATS, ProductImporter
+
+
+class Command(BaseCommand):
+    help = "Upserts products from a CSV (with header) or NDJSON file using PostgreSQL's COPY."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=IMPORT_FORMATS, dest="import_format")
+
+    def handle(self, *args, **options):
+        import_format = options["import_format"] or options["path"].rsplit(".", 1)[-1].lower()
+        if import_format not in IMPORT_FORMATS:
+            raise CommandError(f"Unknown format {import_format}, use --format with one of {', '.join(IMPORT_FORMATS)}.")
+        with open(options["path"], newline="", encoding="utf-8") as stream:
+            result = ProductImporter(stream, import_format).run()
+        for rejected in result["rejected"]:
+            self.stderr.write(f"Line {rejected['line']} rejected: {rejected['errors']}")
+        self.stdout.write(
+            f"Imported {result['imported']} products, rejected {result['rejected_count']} rows, "
+            f"in {result['seconds']} seconds ({result['rows_per_second']} rows per second)."
+        )
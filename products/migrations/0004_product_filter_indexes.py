@@ -0,0 +1,48 @@
+# Generated by Django 3.2.8 on 2026-10-18 09:17
+
+from django.db import migrations, models
+
+# the icontains and istartswith lookups compare UPPER(name::text) on PostgreSQL.
+NAME_INDEXES = {
+    'products_name_trgm_idx': 'USING gin (UPPER(name::text) gin_trgm_ops)',  # ?search=, LIKE '%...%'.
+    'products_name_prefix_idx': '(UPPER(name::text) text_pattern_ops)',  # ?name_prefix=, LIKE '...%'.
+}
+
+
+def create_name_indexes(apps, schema_editor):
+    """The trigram index needs the pg_trgm extension of PostgreSQL's contrib, it's skipped on servers without it."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        has_trigrams = cursor.fetchone() is not None
+    if has_trigrams:
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, definition in NAME_INDEXES.items():
+        if has_trigrams or 'gin_trgm_ops' not in definition:
+            schema_editor.execute(f'CREATE INDEX {name} ON products {definition}')
+
+
+def drop_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name in NAME_INDEXES:
+            schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_alter_product_updated'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_name_indexes, drop_name_indexes),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='products_price_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('stock', 0)), fields=['id'], name='products_out_of_stock_idx'),
+        ),
+    ]
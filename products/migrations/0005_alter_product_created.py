@@ -0,0 +1,26 @@
+# Generated by Django 3.2.8 on 2026-10-18 10:05
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_created(apps, schema_editor):
+    """Products without created take their updated, the closest known date, before the column becomes NOT NULL."""
+    Product = apps.get_model('products', 'Product')
+    Product.objects.filter(created__isnull=True).update(created=F('updated'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_created, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+    ]
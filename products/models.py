@@ -1,8 +1,49 @@
 from django.core.validators import MinValueValidator
-from django.db.models import (CASCADE, CharField, FloatField,
-                              PositiveIntegerField)
+from django.db import transaction
+from django.db.models import (CASCADE, Case, CharField, F, FloatField, Index,
+                              IntegerField, PositiveIntegerField, Q, QuerySet,
+                              Value, When)
+from django.utils.timezone import now
 from utils.models import TimeStampModel
 
+from products.cache import invalidate_products
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id, quantity):
+        self.product_id = product_id
+        self.quantity = quantity
+        super().__init__(f"Not enough stock of product {product_id} to reserve {quantity}.")
+
+
+class ProductQuerySet(QuerySet):
+    def reserve_stock(self, quantities):
+        """
+        Reserves the quantity of each product id, releasing it when the quantity is negative, with a single UPDATE.
+        All the products, reserved or released, are first locked with SELECT ... FOR UPDATE ordered by id, so
+        concurrent reservations lock them in the same order and can't deadlock, and the stock of the reserved ones is
+        checked while they are locked. Raises InsufficientStock before updating anything. The locks are held until the
+        caller's transaction ends.
+        """
+        quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+        if not quantities:
+            return
+        invalidate_products(quantities)  # the update below doesn't send post_save.
+        reserved = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+        whens = [When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()]
+        with transaction.atomic(using=self.db, savepoint=False):
+            locked = self.select_for_update().filter(pk__in=quantities).order_by("pk")
+            stocks = dict(locked.values_list("pk", "stock"))
+            for product_id in sorted(reserved):
+                if stocks.get(product_id, 0) < reserved[product_id]:
+                    raise InsufficientStock(product_id, reserved[product_id])
+            self.filter(pk__in=quantities).update(
+                stock=F("stock") - Case(*whens, default=Value(0), output_field=IntegerField()), updated=now()
+            )
+
+    def release_stock(self, quantities):
+        self.reserve_stock({product_id: -quantity for product_id, quantity in quantities.items()})
+
 
 class Product(TimeStampModel):
     id = CharField(max_length=20, primary_key=True)
@@ -10,8 +51,23 @@ class Product(TimeStampModel):
     price = FloatField(validators=[MinValueValidator(0)])  # clavar Decimal
     stock = PositiveIntegerField()
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         db_table = "products"
+        # the name filters use the UPPER(name) trigram and prefix indexes created by migration 0004, PostgreSQL only.
+        indexes = [
+            Index(fields=["created", "id"], name="products_created_id_idx"),  # keyset pagination.
+            Index(fields=["price", "id"], name="products_price_id_idx"),  # price range and ordering.
+            Index(fields=["id"], condition=Q(stock=0), name="products_out_of_stock_idx"),  # ?in_stock=false.
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Keeps the loaded price, to reprice the orders that contain the product when it changes."""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_price = instance.__dict__.get("price")
+        return instance
 
     def __str__(self):
         return f"id={self.id}, name={self.name}, price={self.price}, stock={self.stock}"
@@ -1,10 +1,57 @@
-from rest_framework.serializers import ModelSerializer
+from django.db import models
+from rest_framework.serializers import (BooleanField, CharField, ChoiceField,
+                                        FloatField, ModelSerializer,
+                                        Serializer, ValidationError)
+from utils.fields import FiniteFloatField, get_datetime_formatter
+from utils.serializers import UpdateFieldsSerializerMixin
 
 from products.models import Product
 
+PRODUCT_FIELDS = ("id", "created", "updated", "name", "price", "stock")  # in ProductSerializer's order.
+
+
+class ProductSerializer(UpdateFieldsSerializerMixin, ModelSerializer):
+    serializer_field_mapping = {**ModelSerializer.serializer_field_mapping, models.FloatField: FiniteFloatField}
 
-class ProductSerializer(ModelSerializer):
     class Meta:
         model = Product
         fields = "__all__"
-        extra_kwargs = {"id": {"required": False}}
+        extra_kwargs = {
+            "id": {"required": False},
+            "stock": {"min_value": 0, "max_value": 2147483647},  # PostgreSQL's integer range, on every backend.
+        }
+
+
+class ProductFiltersSerializer(Serializer):
+    """Query parameters of the product list, validate them as a dict: BooleanField reads a missing one as False."""
+
+    search = CharField(max_length=50, required=False)  # in the name.
+    name_prefix = CharField(max_length=50, required=False)
+    min_price = FloatField(min_value=0, required=False)
+    max_price = FloatField(min_value=0, required=False)
+    in_stock = BooleanField(required=False)
+    ordering = ChoiceField(choices=("price", "-price", "updated", "-updated"), required=False)
+
+    def validate(self, data):
+        if "min_price" in data and "max_price" in data and data["min_price"] > data["max_price"]:
+            raise ValidationError({"max_price": ["Debe ser mayor o igual a min_price."]})
+        return data
+
+
+def represent_products(rows):
+    """
+    ProductSerializer(many=True).data of .values(*PRODUCT_FIELDS) rows, rendered to the same JSON, without model nor
+    serializer instances.
+    """
+    format_datetime = get_datetime_formatter()
+    return [
+        {
+            "id": row["id"],
+            "created": format_datetime(row["created"]),
+            "updated": format_datetime(row["updated"]),
+            "name": row["name"],
+            "price": row["price"],
+            "stock": row["stock"],
+        }
+        for row in rows
+    ]
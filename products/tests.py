@@ -1,9 +1,32 @@
+import json
+from base64 import urlsafe_b64encode
+from io import StringIO
+from tempfile import NamedTemporaryFile
+from unittest import skipUnless
+from unittest.mock import patch
+from uuid import uuid4
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+from orders.models import DailyProductSales, Order, OrderDetail
 from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
 from rest_framework.status import (HTTP_200_OK, HTTP_201_CREATED,
-                                   HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST)
+                                   HTTP_204_NO_CONTENT, HTTP_304_NOT_MODIFIED,
+                                   HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND)
+from utils.pagination import KeysetPagination
+from utils.tests import (BaseModelViewSetTestCase, OrderFactory,
+                         ProductFactory, QueryBudgetTestCase)
 
+from products.cache import product_response_cache
+from products.importer import validate_row
 from products.models import Product
-from utils.tests import BaseModelViewSetTestCase, ProductFactory
+from products.serializers import (PRODUCT_FIELDS, ProductSerializer,
+                                  represent_products)
 
 
 class ProductModelViewSetTestCase(BaseModelViewSetTestCase):
@@ -83,6 +106,43 @@ class ProductModelViewSetTestCase(BaseModelViewSetTestCase):
             for key in ["id", "created", "updated", "name", "price", "stock"]:
                 assert result[key] is not None
 
+    def test_represent_products(self):
+        """Testing if the .values() read path of the list renders the same JSON as ProductSerializer."""
+        ProductFactory.create_product(created=None)
+        products = Product.objects.order_by("id")
+        renderer = JSONRenderer()
+        assert renderer.render(represent_products(products.values(*PRODUCT_FIELDS))) == renderer.render(
+            ProductSerializer(products, many=True).data
+        )
+
+    def test_list_cursor_success(self):
+        """Testing if all Products are listed once with the opt-in cursor pagination, forwards and backwards."""
+        for x in range(20):
+            ProductFactory.create_product()
+        response = self.client.get(reverse("products-list"), {"pagination": "cursor"}, format="json")
+        assert response.status_code == HTTP_200_OK
+        assert "count" not in response.data
+        assert response.data["previous"] is None
+        first_page_ids = [result["id"] for result in response.data["results"]]
+        assert len(first_page_ids) == 15
+        response = self.client.get(response.data["next"], format="json")
+        assert response.data["next"] is None
+        second_page_ids = [result["id"] for result in response.data["results"]]
+        assert len(second_page_ids) == 6
+        expected_ids = list(Product.objects.order_by("-created", "-id").values_list("id", flat=True))
+        assert first_page_ids + second_page_ids == expected_ids
+        response = self.client.get(response.data["previous"], format="json")
+        assert [result["id"] for result in response.data["results"]] == first_page_ids
+        assert response.data["previous"] is None
+
+    def test_list_bad_cursor(self):
+        """Testing if an invalid cursor is a 404."""
+        response = self.client.get(reverse("products-list"), {"cursor": "invalid"}, format="json")
+        assert response.status_code == HTTP_404_NOT_FOUND
+        cursor = urlsafe_b64encode(json.dumps({"v": [None, "id"], "r": False}).encode()).decode()
+        response = self.client.get(reverse("products-list"), {"cursor": cursor}, format="json")
+        assert response.status_code == HTTP_404_NOT_FOUND
+
     def test_retrive_success(self):
         """Testing if a single Product is successfully detailed."""
         product = self.product
@@ -94,6 +154,69 @@ class ProductModelViewSetTestCase(BaseModelViewSetTestCase):
         assert data["price"] == product.price
         assert data["stock"] == product.stock
 
+    def test_retrieve_not_modified(self):
+        """Testing if a retrieve with the ETag of the last response gets a 304 until the Product changes."""
+        response = self._get_retrive(id_value=self.product.id)
+        assert response.status_code == HTTP_200_OK
+        path = reverse("products-detail", kwargs={"pk": self.product.id})
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=response["ETag"])
+        assert response.status_code == HTTP_304_NOT_MODIFIED
+        etag = response["ETag"]
+        self._patch_partial_update(data={"stock": 1}, id_value=self.product.id)
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == HTTP_200_OK and response["ETag"] != etag
+
+    def test_list_not_modified(self):
+        """Testing if a list with the ETag of the last response gets a 304 until a Product is created or deleted."""
+        path = reverse("products-list")
+        response = self.client.get(path)
+        etag = response["ETag"]
+        assert "Last-Modified" not in response  # a deleted Product wouldn't move it.
+        with self.assertNumQueries(2):
+            assert self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code == HTTP_304_NOT_MODIFIED
+        assert self.client.get(path, {"page": 1}, HTTP_IF_NONE_MATCH=etag).status_code == HTTP_200_OK
+        product = ProductFactory.create_product()
+        etag = self.client.get(path, HTTP_IF_NONE_MATCH=etag)["ETag"]
+        product.delete()
+        assert self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code == HTTP_200_OK
+
+    def test_list_cursor_not_modified(self):
+        """Testing if a cursor page gets a 304 from its own rows, without counting them, until one is deleted."""
+        for x in range(3):
+            ProductFactory.create_product()
+        path = reverse("products-list")
+        params = {"pagination": "cursor", "ordering": "price"}
+        etag = self.client.get(path, params)["ETag"]
+        with CaptureQueriesContext(connection) as context:
+            assert self.client.get(path, params, HTTP_IF_NONE_MATCH=etag).status_code == HTTP_304_NOT_MODIFIED
+        assert len(context.captured_queries) == 1
+        assert "COUNT" not in context.captured_queries[0]["sql"]
+        Product.objects.order_by("price").first().delete()
+        assert self.client.get(path, params, HTTP_IF_NONE_MATCH=etag).status_code == HTTP_200_OK
+
+    def test_retrieve_cached(self):
+        """Testing if a retrieve is served from the cache until the Product changes, also by a stock reservation."""
+        product_response_cache.reset_stats()
+        self._get_retrive(id_value=self.product.id)
+        with self.assertNumQueries(1):  # the conditional GET probe.
+            assert self._get_retrive(id_value=self.product.id).data["stock"] == 100
+        Product.objects.reserve_stock({self.product.id: 40})
+        assert self._get_retrive(id_value=self.product.id).data["stock"] == 60
+        self._patch_partial_update(data={"name": "Other"}, id_value=self.product.id)
+        assert self._get_retrive(id_value=self.product.id).data["name"] == "Other"
+        response = self.client.get(reverse("products-cache-stats"))
+        assert response.data == {"hits": 1, "misses": 3, "hit_ratio": 0.25}
+
+    def test_list_cached(self):
+        """Testing if a list is served from the cache until a Product is created or deleted."""
+        assert self._get_list().data["count"] == 1
+        with self.assertNumQueries(2):  # the count and page of the ETag.
+            assert self._get_list().data["count"] == 1
+        ProductFactory.create_product()
+        assert self._get_list().data["count"] == 2
+        Product.objects.last().delete()
+        assert self._get_list().data["count"] == 1
+
     def test_partial_update_success(self):
         """Testing if a single Product is partially updated successfully with PATCH method."""
         product = self.product
@@ -107,6 +230,16 @@ class ProductModelViewSetTestCase(BaseModelViewSetTestCase):
             response.data["stock"] == patch_data["stock"] == product.stock != old_stock
         )
 
+    def test_partial_update_keeps_reserved_stock(self):
+        """Testing if a PATCH of the price doesn't write back the stock it loaded over a reservation made meanwhile."""
+        product = Product.objects.get(id=self.product.id)
+        Product.objects.reserve_stock({product.id: 1})
+        serializer = ProductSerializer(product, data={"price": 10}, partial=True)
+        assert serializer.is_valid()
+        serializer.save()
+        product.refresh_from_db()
+        assert (product.price, product.stock) == (10, 99)
+
     def test_update_success(self):
         """Testing if a single Product is successfully updated with PUT method."""
         product = self.product
@@ -137,3 +270,220 @@ class ProductModelViewSetTestCase(BaseModelViewSetTestCase):
         response = self._delete_destroy(id_value=self.product.id)
         assert response.status_code == HTTP_204_NO_CONTENT
         assert Product.objects.count() == 0
+
+
+class ProductFilterTest(BaseModelViewSetTestCase):
+    url_name = "products"
+
+    def setUp(self):
+        super().setUp()
+        self.products = [
+            ProductFactory.create_product(id="1", name="Mate de calabaza", price=1500, stock=10),
+            ProductFactory.create_product(id="2", name="Yerba mate", price=800, stock=0),
+            ProductFactory.create_product(id="3", name="Termo", price=5000, stock=3),
+            ProductFactory.create_product(id="4", name="Bombilla", price=300, stock=50),
+        ]
+
+    def _get_ids(self, **params):
+        response = self.client.get(reverse("products-list"), params)
+        assert response.status_code == HTTP_200_OK
+        return [product["id"] for product in response.data["results"]]
+
+    def test_filters(self):
+        """Testing if the Products are filtered by name, price and stock."""
+        assert sorted(self._get_ids(search="MATE")) == ["1", "2"]
+        assert self._get_ids(name_prefix="mate") == ["1"]
+        assert self._get_ids(min_price=500, max_price=1500, ordering="price") == ["2", "1"]
+        assert self._get_ids(in_stock="false") == ["2"]
+        assert self._get_ids(in_stock="true", ordering="-price") == ["3", "1", "4"]
+
+    def test_ordering_cursor(self):
+        """Testing if the cursor pages follow the requested ordering."""
+        with patch.object(KeysetPagination, "page_size", 2):
+            response = self.client.get(reverse("products-list"), {"ordering": "-price", "pagination": "cursor"})
+            assert [product["id"] for product in response.data["results"]] == ["3", "1"]
+            response = self.client.get(response.data["next"])
+        assert [product["id"] for product in response.data["results"]] == ["2", "4"]
+
+    def test_bad_filters(self):
+        """Testing if invalid filters are a 400."""
+        response = self.client.get(reverse("products-list"), {"min_price": 10, "max_price": 5, "ordering": "name"})
+        assert response.status_code == HTTP_400_BAD_REQUEST
+        assert set(response.data) == {"ordering"}
+        response = self.client.get(reverse("products-list"), {"min_price": 10, "max_price": 5})
+        assert set(response.data) == {"max_price"}
+
+
+@skipUnless(connection.vendor == "postgresql", "The indexes are PostgreSQL's.")
+class ProductFilterIndexTest(BaseModelViewSetTestCase):
+    def _assert_indexed(self, params, index_name):
+        """
+        Asserts the product queries of the list that filter or order use the index, with sequential scans disabled.
+        """
+        with CaptureQueriesContext(connection) as context:
+            assert self.client.get(reverse("products-list"), params).status_code == HTTP_200_OK
+        queries = [
+            query["sql"]
+            for query in context.captured_queries
+            if 'FROM "products"' in query["sql"] and ("WHERE" in query["sql"] or "ORDER BY" in query["sql"])
+        ]
+        assert queries
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")  # the test table is tiny.
+            for sql in queries:
+                cursor.execute(f"EXPLAIN {sql}")
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                assert index_name in plan and "Seq Scan" not in plan, plan
+
+    def test_name_prefix_indexed(self):
+        self._assert_indexed({"name_prefix": "mat"}, "products_name_prefix_idx")
+
+    def test_search_indexed(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = 'products_name_trgm_idx'")
+            if cursor.fetchone() is None:
+                self.skipTest("The server hasn't the pg_trgm extension.")
+        self._assert_indexed({"search": "mate"}, "products_name_trgm_idx")
+
+    def test_price_indexed(self):
+        self._assert_indexed({"min_price": 100, "max_price": 200, "ordering": "price"}, "products_price_id_idx")
+
+    def test_out_of_stock_indexed(self):
+        self._assert_indexed({"in_stock": "false"}, "products_out_of_stock_idx")
+
+    def test_updated_ordering_indexed(self):
+        self._assert_indexed({"ordering": "-updated", "pagination": "cursor"}, "products_updated")
+
+
+class ProductImportTest(BaseModelViewSetTestCase):
+    url_name = "products"
+    csv_content = (
+        "id,name,price,stock\n"
+        "54321543215432154321,Updated,10.5,3\n"
+        "new-1,New,20,5\n"
+        "new-1,New again,21,6\n"
+        "123456789012345678901,Too long,-1,1\n"
+        "new-2,Too much stock,1,2147483648\n"
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.product = ProductFactory.create_product(id="54321543215432154321", price=777, stock=100)
+        self.order = OrderFactory.create_order(order_details=[{"product_id": self.product.id, "quantity": 2}])
+
+    def test_validate_row(self):
+        """Testing if the import validates the rows with ProductSerializer's rules."""
+        values, errors = validate_row({"id": "1", "name": "Name", "price": "7.5", "stock": "2"})
+        assert values == {"id": "1", "name": "Name", "price": 7.5, "stock": 2} and errors is None
+        values, errors = validate_row({"id": "123456789012345678901", "name": False, "price": -66, "stock": -33})
+        assert values is None
+        assert errors["id"] == ["Ensure this field has no more than 20 characters."]
+        assert errors["name"] == ["Not a valid string."]
+        assert errors["price"] == errors["stock"] == ["Ensure this value is greater than or equal to 0."]
+
+    def test_validate_row_numbers(self):
+        """Testing if the import applies ProductSerializer's rules to the price and stock, the API included."""
+        row = {"id": "1", "name": "Name"}
+        for price in ("nan", "inf", "-inf", "1e400", float("nan")):
+            values, errors = validate_row({**row, "price": price, "stock": 1})
+            assert errors == {"price": ["A valid number is required."]}
+            response = self._post_create(data={**row, "price": str(price), "stock": 1})
+            assert response.status_code == HTTP_400_BAD_REQUEST
+        values, errors = validate_row({**row, "price": 1, "stock": 2 ** 31})
+        assert errors == {"stock": ["Ensure this value is less than or equal to 2147483647."]}
+        for stock in ("1.5", "x"):
+            values, errors = validate_row({**row, "price": 1, "stock": stock})
+            assert errors == {"stock": ["A valid integer is required."]}
+        values, errors = validate_row({**row, "price": 1, "stock": "10.0"})
+        assert values["stock"] == 10 and errors is None  # as IntegerField accepts it.
+
+    @skipUnless(connection.vendor == "postgresql", "COPY needs PostgreSQL.")
+    def test_import_csv_success(self):
+        """Testing if an uploaded CSV upserts the valid products and reports the rejected rows."""
+        uploaded_file = SimpleUploadedFile("products.csv", self.csv_content.encode())
+        response = self.client.post(reverse("products-import-products"), {"file": uploaded_file})
+        assert response.status_code == HTTP_200_OK
+        assert response.data["imported"] == 2
+        assert response.data["rejected_count"] == 2
+        assert [rejected["line"] for rejected in response.data["rejected"]] == [5, 6]  # the int4 overflow too.
+        self.product.refresh_from_db()
+        assert (self.product.name, self.product.price, self.product.stock) == ("Updated", 10.5, 3)
+        assert Product.objects.get(id="new-1").name == "New again"  # the last row of a repeated id wins.
+        self.order.refresh_from_db()
+        assert self.order.total == 21  # repriced to the imported price.
+
+    @skipUnless(connection.vendor == "postgresql", "COPY needs PostgreSQL.")
+    def test_import_command_ndjson(self):
+        """Testing if the import_products command upserts the products of a NDJSON file."""
+        with NamedTemporaryFile("w", suffix=".ndjson") as ndjson_file:
+            ndjson_file.write('{"id": "new-2", "name": "New", "price": 1, "stock": 1}\n\nnot json\n')
+            ndjson_file.flush()
+            stdout = StringIO()
+            call_command("import_products", ndjson_file.name, stdout=stdout, stderr=StringIO())
+        assert "Imported 1 products, rejected 1 rows" in stdout.getvalue()
+        assert Product.objects.filter(id="new-2").exists()
+
+
+class ProductQueryBudgetTest(QueryBudgetTestCase):
+    def _create_products(self, count):
+        products = [Product(id=uuid4().hex[:20], name="Budget", price=100, stock=1000) for x in range(count)]
+        return Product.objects.bulk_create(products)
+
+    def _create_ordered_product(self, orders):
+        """A product in `orders` orders, with their totals and sales."""
+        product = self._create_products(1)[0]
+        orders = Order.objects.bulk_create([Order(id=uuid4().hex[:20], date=now()) for x in range(orders)])
+        OrderDetail.objects.bulk_create([OrderDetail(order=order, product=product, quantity=1) for order in orders])
+        Order.objects.filter(pk__in=[order.pk for order in orders]).recompute_totals()
+        DailyProductSales.objects.rebuild()
+        return product
+
+    def test_list(self):
+        """Testing if listing, filtering and ordering products costs the same queries with 1, 15 or 100 of them."""
+        filters = {"search": "budget", "min_price": 10, "in_stock": "true", "ordering": "-price"}
+        for params, queries in (({}, 4), (filters, 4), ({"pagination": "cursor"}, 2)):
+            send_request = lambda products: self.client.get(reverse("products-list"), params)
+            self.assert_budget(self._create_products, send_request, queries)
+
+    def test_retrieve(self):
+        """Testing if retrieving a product in 1, 15 or 100 orders costs the same queries."""
+        send_request = lambda product: self.client.get(reverse("products-detail", kwargs={"pk": product.id}))
+        self.assert_budget(self._create_ordered_product, send_request, 2)
+
+    def test_create(self):
+        """Testing if creating a product costs the same queries with 1, 15 or 100 others."""
+        data = lambda: {"id": uuid4().hex[:20], "name": "Budget", "price": 10, "stock": 1}
+        send_request = lambda products: self.client.post(reverse("products-list"), data(), format="json")
+        self.assert_budget(self._create_products, send_request, 2)
+
+    def test_update(self):
+        """Testing if repricing a product in 1, 15 or 100 orders costs the same queries."""
+        path = lambda product: reverse("products-detail", kwargs={"pk": product.id})
+        send_request = lambda product: self.client.patch(path(product), {"price": 200}, format="json")
+        self.assert_budget(self._create_ordered_product, send_request, 4)
+        data = {"name": "Updated", "price": 300, "stock": 5}
+        send_request = lambda product: self.client.put(path(product), {"id": product.id, **data}, format="json")
+        self.assert_budget(self._create_ordered_product, send_request, 5)
+
+    def test_destroy(self):
+        """Testing if deleting a product in 1, 15 or 100 orders costs the same queries."""
+        send_request = lambda product: self.client.delete(reverse("products-detail", kwargs={"pk": product.id}))
+        self.assert_budget(self._create_ordered_product, send_request, 16)
+
+    def test_cache_stats(self):
+        """Testing if the cache stats don't make queries."""
+        send_request = lambda products: self.client.get(reverse("products-cache-stats"))
+        self.assert_budget(self._create_products, send_request, 0)
+
+    @skipUnless(connection.vendor == "postgresql", "COPY needs PostgreSQL.")
+    def test_import(self):
+        """Testing if importing 1, 15 or 100 products costs the same queries."""
+
+        def setup(size):
+            with connection.cursor() as cursor:  # dropped on commit, and the test's transaction isn't committed.
+                cursor.execute("DROP TABLE IF EXISTS products_import, products_import_last")
+            rows = "".join(f"{uuid4().hex[:20]},Budget,10,1\n" for x in range(size))
+            return SimpleUploadedFile("products.csv", f"id,name,price,stock\n{rows}".encode())
+
+        path = reverse("products-import-products")
+        self.assert_budget(setup, lambda uploaded_file: self.client.post(path, {"file": uploaded_file}), 8)
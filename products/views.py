@@ -1,9 +1,93 @@
+from io import TextIOWrapper
+
+from django.db import transaction
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+from rest_framework.status import HTTP_400_BAD_REQUEST
 from rest_framework.viewsets import ModelViewSet
+from utils.pagination import PageNumberOrKeysetPagination
+from utils.views import (CachedResponseMixin, ConditionalGetMixin,
+                         ValuesListMixin)
 
+from products.cache import DETAILS_SCOPE, LIST_SCOPE, product_response_cache
+from products.importer import IMPORT_FORMATS, ProductImporter
 from products.models import Product
-from products.serializers import ProductSerializer
+from products.serializers import (PRODUCT_FIELDS, ProductFiltersSerializer,
+                                  ProductSerializer, represent_products)
+
 
+class ProductModelViewSet(ConditionalGetMixin, CachedResponseMixin, ValuesListMixin, ModelViewSet):
+    """
+    Products, filtered by ?search= (in the name), ?name_prefix=, ?min_price=, ?max_price= and ?in_stock=, and
+    ordered by ?ordering=price, -price, updated or -updated. Each filter and ordering has its index, see Product.
+    """
 
-class ProductModelViewSet(ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = PageNumberOrKeysetPagination
+    filter_lookups = {
+        "search": "name__icontains",
+        "name_prefix": "name__istartswith",
+        "min_price": "price__gte",
+        "max_price": "price__lte",
+    }
+    orderings = {  # indexed by products_price_id_idx and the updated index.
+        "price": ("price", "id"),
+        "-price": ("-price", "-id"),
+        "updated": ("updated", "id"),
+        "-updated": ("-updated", "-id"),
+    }
+    response_cache = product_response_cache  # invalidated by products.cache.invalidate_products.
+    list_cache_scopes = (LIST_SCOPE,)
+    detail_cache_scopes = (DETAILS_SCOPE,)
+    list_values_fields = PRODUCT_FIELDS
+
+    @property
+    def keyset_ordering(self):
+        ordering = self.get_filters().get("ordering")
+        return self.orderings[ordering] if ordering else ("-created", "-id")  # indexed by products_created_id_idx.
+
+    def get_filters(self):
+        if not hasattr(self, "_filters"):
+            serializer = ProductFiltersSerializer(data=self.request.query_params.dict())
+            serializer.is_valid(raise_exception=True)
+            self._filters = serializer.validated_data
+        return self._filters
+
+    def filter_queryset(self, queryset):
+        filters = self.get_filters()
+        queryset = queryset.filter(
+            **{lookup: filters[name] for name, lookup in self.filter_lookups.items() if name in filters}
+        )
+        if "in_stock" in filters:
+            queryset = queryset.filter(stock__gt=0) if filters["in_stock"] else queryset.filter(stock=0)
+        if "ordering" in filters:
+            queryset = queryset.order_by(*self.orderings[filters["ordering"]])
+        return queryset
+
+    def represent_rows(self, rows):
+        return represent_products(rows)
+
+    def perform_destroy(self, instance):
+        """Deletes its order details at once first, so the cascade doesn't send a post_delete for each one."""
+        with transaction.atomic():
+            instance.order_details.release_and_delete()
+            instance.delete()
+
+    @action(detail=False, methods=["get"], url_path="cache-stats")
+    def cache_stats(self, request):
+        """Hits and misses of the product responses cache."""
+        return Response(self.response_cache.get_stats())
+
+    @action(detail=False, methods=["post"], url_path="import", parser_classes=[MultiPartParser])
+    def import_products(self, request):
+        """Upserts the products of an uploaded CSV (with header) or NDJSON `file`, by id."""
+        uploaded_file = request.data.get("file")
+        if uploaded_file is None:
+            return Response({"file": ["This field is required."]}, status=HTTP_400_BAD_REQUEST)
+        import_format = request.data.get("format") or uploaded_file.name.rsplit(".", 1)[-1].lower()
+        if import_format not in IMPORT_FORMATS:
+            return Response({"format": [f"Debe ser uno de {', '.join(IMPORT_FORMATS)}."]}, status=HTTP_400_BAD_REQUEST)
+        stream = TextIOWrapper(uploaded_file.file, encoding="utf-8", newline="")
+        return Response(ProductImporter(stream, import_format).run())
@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+from utils.timing import install_query_timer
 
 
 class UtilsConfig(AppConfig):
     name = 'utils'
+
+    def ready(self):
+        connection_created.connect(install_query_timer)  # counts the queries of each request, see utils.middleware.
@@ -0,0 +1,23 @@
+from utils.requester import AsyncBaseRequester
+
+
+class LifespanMiddleware:
+    """
+    Answers the ASGI lifespan messages, which Django 3.2's handler rejects, and closes the pooled httpx clients of the
+    async requesters at shutdown. The other scopes are passed to the wrapped application.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "lifespan":
+            return await self.application(scope, receive, send)
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await AsyncBaseRequester.aclose_all()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
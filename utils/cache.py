@@ -0,0 +1,227 @@
+from asyncio import get_running_loop, shield
+from asyncio import sleep as async_sleep
+from hashlib import md5
+from threading import Lock, Thread
+from time import sleep, time, time_ns
+from weakref import WeakKeyDictionary
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db import transaction
+
+
+class SharedCachedValue:
+    """
+    A value computed by `loader` and shared by every thread and worker through Django's cache framework.
+    Fresh values are served for `ttl` seconds, then stale values are served for `stale_ttl` more seconds
+    while a single background refresh runs. Concurrent misses are merged into one `loader` call.
+    Async code uses `aget`, which awaits `async_loader`, merges the misses of each event loop and takes the same
+    cross-worker lock.
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, key, loader, ttl, stale_ttl=0, cache_alias="default", lock_timeout=30, async_loader=None):
+        self.key = key
+        self.lock_key = f"{key}:lock"
+        self.loader = loader
+        self.async_loader = async_loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.cache_alias = cache_alias
+        self.lock_timeout = lock_timeout
+        self._local_lock = Lock()  # merges the misses of this process.
+        self._refresh_thread = None
+        self._async_refreshes = WeakKeyDictionary()  # the running refresh task of each event loop.
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get(self):
+        entry = self.cache.get(self.key)
+        if entry is None:
+            return self._load()
+        if entry["expires_at"] <= time():
+            self._refresh_in_background()
+        return entry["value"]
+
+    def refresh(self):
+        """Calls the loader and stores its value, no matter if the cached one is still fresh."""
+        value = self.loader()
+        entry = {"value": value, "expires_at": time() + self.ttl}
+        self.cache.set(self.key, entry, timeout=self.ttl + self.stale_ttl)
+        return value
+
+    async def aget(self):
+        entry = await sync_to_async(self.cache.get)(self.key)
+        if entry is None:
+            return await shield(self._async_refresh_task())
+        if entry["expires_at"] <= time():
+            self._async_refresh_task(entry)  # in background.
+        return entry["value"]
+
+    async def arefresh(self):
+        value = await self.async_loader()
+        entry = {"value": value, "expires_at": time() + self.ttl}
+        await sync_to_async(self.cache.set)(self.key, entry, timeout=self.ttl + self.stale_ttl)
+        return value
+
+    def invalidate(self):
+        self.cache.delete(self.key)
+
+    def _load(self):
+        with self._local_lock:
+            entry = self.cache.get(self.key)  # another thread could have loaded it meanwhile.
+            if entry is not None:
+                return entry["value"]
+            if self.cache.add(self.lock_key, True, timeout=self.lock_timeout):  # cross-worker lock.
+                try:
+                    return self.refresh()
+                finally:
+                    self.cache.delete(self.lock_key)
+            entry = self._wait_for_other_worker()
+            if entry is not None:
+                return entry["value"]
+            return self.refresh()  # the other worker died or is too slow.
+
+    def _wait_for_other_worker(self):
+        deadline = time() + self.lock_timeout
+        while time() < deadline:
+            sleep(self.POLL_INTERVAL)
+            entry = self.cache.get(self.key)
+            if entry is not None:
+                return entry
+            if self.cache.get(self.lock_key) is None:
+                break
+        return self.cache.get(self.key)
+
+    def _refresh_in_background(self):
+        with self._local_lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            if not self.cache.add(self.lock_key, True, timeout=self.lock_timeout):
+                return  # another worker is refreshing it.
+            self._refresh_thread = Thread(target=self._background_refresh, daemon=True)
+            self._refresh_thread.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:  # keep serving the stale value, next get will retry.
+            pass
+        finally:
+            self.cache.delete(self.lock_key)
+
+    def _async_refresh_task(self, stale_entry=None):
+        loop = get_running_loop()
+        task = self._async_refreshes.get(loop)
+        if task is None or task.done():
+            task = self._async_refreshes[loop] = loop.create_task(self._async_load(stale_entry))
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())  # retrieved, not logged.
+        return task
+
+    async def _async_load(self, stale_entry):
+        """The same cross-worker lock as `_load` and `_refresh_in_background`, with a stale entry the latter."""
+        if await sync_to_async(self.cache.add)(self.lock_key, True, timeout=self.lock_timeout):
+            try:
+                return await self.arefresh()
+            finally:
+                await sync_to_async(self.cache.delete)(self.lock_key)
+        if stale_entry is not None:
+            return stale_entry["value"]  # another worker is refreshing it.
+        entry = await self._await_other_worker()
+        if entry is not None:
+            return entry["value"]
+        return await self.arefresh()  # the other worker died or is too slow.
+
+    async def _await_other_worker(self):
+        deadline = time() + self.lock_timeout
+        while time() < deadline:
+            await async_sleep(self.POLL_INTERVAL)
+            entry = await sync_to_async(self.cache.get)(self.key)
+            if entry is not None:
+                return entry
+            if await sync_to_async(self.cache.get)(self.lock_key) is None:
+                break
+        return await sync_to_async(self.cache.get)(self.key)
+
+
+class VersionedCache:
+    """
+    Values cached under the versions of some scopes, stored in Django's cache. Bumping a scope's version invalidates
+    all its keys with a single write, from any worker, and they expire by their timeout. Versions start from the
+    current time, so a lost version can't bring back old values. Hits and misses are counted in the cache, to size it.
+    """
+
+    def __init__(self, namespace, ttl, cache_alias="default"):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_or_set(self, scopes, key, loader):
+        """
+        Returns the value of the key under the current versions of the scopes, or the value returned by `loader`.
+        It is cached under the versions read before loading it, so a bump while it loads isn't lost. None isn't cached.
+        """
+        versioned_key = self._get_key(scopes, key)
+        value = self.cache.get(versioned_key)
+        if value is not None:
+            self._count("hits")
+            return value
+        self._count("misses")
+        value = loader()
+        if value is not None:
+            self.cache.set(versioned_key, value, timeout=self.ttl)
+        return value
+
+    def bump(self, *scopes):
+        """
+        Invalidates the scopes now, and again when the current transaction commits, to drop what concurrent requests
+        cached from the data before the commit.
+        """
+        self._bump(scopes)
+        transaction.on_commit(lambda: self._bump(scopes))
+
+    def get_stats(self):
+        counts = self.cache.get_many([self._stats_key("hits"), self._stats_key("misses")])
+        hits = counts.get(self._stats_key("hits"), 0)
+        misses = counts.get(self._stats_key("misses"), 0)
+        hit_ratio = round(hits / (hits + misses), 4) if hits + misses else None
+        return {"hits": hits, "misses": misses, "hit_ratio": hit_ratio}
+
+    def reset_stats(self):
+        self.cache.delete_many([self._stats_key("hits"), self._stats_key("misses")])
+
+    def _get_key(self, scopes, key):
+        version_keys = [self._version_key(scope) for scope in scopes]
+        versions = self.cache.get_many(version_keys)
+        for version_key in version_keys:
+            if version_key not in versions:
+                self.cache.add(version_key, time_ns(), timeout=None)
+                versions[version_key] = self.cache.get(version_key)
+        versions = ":".join(str(versions[version_key]) for version_key in version_keys)
+        return f"{self.namespace}:{versions}:{md5(key.encode()).hexdigest()}"
+
+    def _bump(self, scopes):
+        for scope in scopes:
+            try:
+                self.cache.incr(self._version_key(scope))
+            except ValueError:  # not cached yet, or evicted.
+                self.cache.set(self._version_key(scope), time_ns(), timeout=None)
+
+    def _count(self, name):
+        try:
+            self.cache.incr(self._stats_key(name))
+        except ValueError:
+            self.cache.add(self._stats_key(name), 1, timeout=None)
+
+    def _version_key(self, scope):
+        return f"{self.namespace}:version:{md5(str(scope).encode()).hexdigest()}"  # valid for memcached.
+
+    def _stats_key(self, name):
+        return f"{self.namespace}:stats:{name}"
@@ -0,0 +1,50 @@
+from math import isfinite
+
+from rest_framework.fields import ISO_8601, DateTimeField, FloatField
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.settings import api_settings
+
+
+class PrefetchedPrimaryKeyRelatedField(PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField that first looks the instance up in the `prefetched_instances` ({model: {pk: instance}})
+    of the root serializer, so a list serializer can resolve the relations of all its items with one query per model.
+    The primary keys that weren't prefetched are queried as usual, which also keeps the usual errors.
+    """
+
+    def to_internal_value(self, data):
+        prefetched_instances = getattr(self.root, "prefetched_instances", {}).get(self.get_queryset().model, {})
+        if isinstance(data, (str, int)) and not isinstance(data, bool) and data in prefetched_instances:
+            return prefetched_instances[data]
+        return super().to_internal_value(data)
+
+
+class FiniteFloatField(FloatField):
+    """FloatField that rejects nan and infinity, which float() parses (also from too big numbers, like 1e400)."""
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        if not isfinite(value):
+            self.fail("invalid")
+        return value
+
+
+def get_datetime_formatter():
+    """
+    Returns DateTimeField().to_representation for many values, with the current timezone and REST_FRAMEWORK's
+    DATETIME_FORMAT read once instead of per value. Call it again for each request, its timezone can change.
+    """
+    field = DateTimeField()
+    output_format = api_settings.DATETIME_FORMAT
+    field_timezone = field.default_timezone()
+    if output_format is None or output_format.lower() == ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def format_datetime(value):
+        if not value:
+            return None
+        if value.tzinfo is None:  # made aware by DateTimeField.
+            return field.to_representation(value)
+        return value.astimezone(field_timezone).strftime(output_format)
+
+    return format_datetime
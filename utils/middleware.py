@@ -0,0 +1,73 @@
+import json
+import logging
+from asyncio import coroutines, iscoroutinefunction
+
+from django.conf import settings
+
+from utils.timing import start_timings, stop_timings
+
+logger = logging.getLogger(__name__)
+
+
+class ServerTimingMiddleware:
+    """
+    Counts and times the SQL queries (see utils.timing.install_query_timer) and the outbound requester calls of each
+    request, and reports them in a Server-Timing header and a JSON log line. Requests over REQUEST_QUERY_BUDGET
+    queries or REQUEST_LATENCY_BUDGET_MS milliseconds are logged as warnings. The body of streaming responses,
+    consumed after the middleware returns, isn't measured. Sync and async, so under ASGI the async views don't take a
+    thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            self._is_coroutine = coroutines._is_coroutine  # marks it async, as Django's MiddlewareMixin does.
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timings, token = start_timings()
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_timings(token)
+        return self.report(request, response, timings)
+
+    async def __acall__(self, request):
+        timings, token = start_timings()  # copied to the threads of sync_to_async, which count their queries.
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_timings(token)
+        return self.report(request, response, timings)
+
+    def report(self, request, response, timings):
+        seconds = timings.get_seconds()
+        response["Server-Timing"] = ", ".join(
+            [
+                f'db;desc="{timings.db_queries} queries";dur={timings.db_seconds * 1000:.1f}',
+                f'http;desc="{timings.http_calls} calls";dur={timings.http_seconds * 1000:.1f}',
+                f"total;dur={seconds * 1000:.1f}",
+            ]
+        )
+        over_budget = []
+        if timings.db_queries > settings.REQUEST_QUERY_BUDGET:
+            over_budget.append("queries")
+        if seconds * 1000 > settings.REQUEST_LATENCY_BUDGET_MS:
+            over_budget.append("latency")
+        line = {
+            "method": request.method,
+            "path": request.get_full_path(),
+            "status": response.status_code,
+            "duration_ms": round(seconds * 1000, 1),
+            "db_queries": timings.db_queries,
+            "db_ms": round(timings.db_seconds * 1000, 1),
+            "http_calls": timings.http_calls,
+            "http_ms": round(timings.http_seconds * 1000, 1),
+            "over_budget": over_budget,
+        }
+        logger.log(logging.WARNING if over_budget else logging.INFO, json.dumps(line))
+        return response
@@ -3,9 +3,9 @@ from django.db.models import DateTimeField, Model
 
 class TimeStampModel(Model):
     # created datetime
-    created = DateTimeField(auto_now_add=True, null=True)
+    created = DateTimeField(auto_now_add=True)
     # updated datetime, that actualize each time the model is updated.
-    updated = DateTimeField(auto_now=True)
+    updated = DateTimeField(auto_now=True, db_index=True)  # indexed for the "updated since" filters and syncs.
 
     class Meta:
         abstract = True  # This model will then not be used to create any database table.
@@ -0,0 +1,124 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that filters on the values of the last row seen, so it doesn't count the rows and every page
+    costs the same index range scan, no matter how deep it is. It orders by the view's `keyset_ordering` (indexed
+    fields, the last one unique) and the opaque cursor keeps the ordering values of a page boundary.
+    """
+
+    ordering = ("-id",)
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = getattr(view, "keyset_ordering", self.ordering)
+        self.model = queryset.model
+        values, reverse = self.decode_cursor(request)
+        ordering = self._reversed_ordering() if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._get_keyset_filter(ordering, values))
+        rows = list(queryset[: self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+        self.next_values = self._get_values(rows[-1]) if rows and has_next else None
+        self.previous_values = self._get_values(rows[0]) if rows and has_previous else None
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "previous": self.get_previous_link(), "results": data})
+
+    def get_next_link(self):
+        if self.next_values is None:
+            return None
+        return self.encode_cursor(self.next_values, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_values is None:
+            return None
+        return self.encode_cursor(self.previous_values, reverse=True)
+
+    def encode_cursor(self, values, reverse):
+        # isoformat keeps the microseconds, that DjangoJSONEncoder would truncate.
+        values = [value.isoformat() if hasattr(value, "isoformat") else value for value in values]
+        cursor = json.dumps({"v": values, "r": reverse})
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, urlsafe_b64encode(cursor.encode()).decode())
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+            fields = [self.model._meta.get_field(name.lstrip("-")) for name in self.ordering]
+            values = [field.to_python(value) for field, value in zip(fields, cursor["v"])]
+            if len(values) != len(fields) or None in values:  # the ordering fields aren't nullable.
+                raise ValueError
+            return values, bool(cursor["r"])
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def _reversed_ordering(self):
+        return tuple(name[1:] if name.startswith("-") else f"-{name}" for name in self.ordering)
+
+    def _get_values(self, row):
+        if isinstance(row, dict):  # of a .values() queryset.
+            return [row[name.lstrip("-")] for name in self.ordering]
+        return [getattr(row, name.lstrip("-")) for name in self.ordering]
+
+    def _get_keyset_filter(self, ordering, values):
+        """
+        Rows after `values` in `ordering`, as (a < x) OR (a = x AND b < y)..., AND-ed with a range on the first field
+        so the index on the ordering fields is range scanned.
+        """
+        names = [name.lstrip("-") for name in ordering]
+        lookups = ["lt" if name.startswith("-") else "gt" for name in ordering]
+        keyset_filter = Q()
+        for index, (name, lookup) in enumerate(zip(names, lookups)):
+            condition = Q(**{f"{name}__{lookup}": values[index]})
+            for previous_name, previous_value in zip(names[:index], values[:index]):
+                condition &= Q(**{previous_name: previous_value})
+            keyset_filter |= condition
+        return Q(**{f"{names[0]}__{lookups[0]}e": values[0]}) & keyset_filter
+
+
+class PageNumberOrKeysetPagination(PageNumberPagination):
+    """
+    PageNumberPagination by default, so the existing clients keep working. Requests with `?pagination=cursor` (or
+    a `cursor`) use KeysetPagination instead.
+    """
+
+    keyset_pagination_class = KeysetPagination
+    pagination_query_param = "pagination"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_pagination = None
+        query_params = request.query_params
+        cursor_query_param = self.keyset_pagination_class.cursor_query_param
+        if query_params.get(self.pagination_query_param) == "cursor" or cursor_query_param in query_params:
+            self.keyset_pagination = self.keyset_pagination_class()
+            return self.keyset_pagination.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset_pagination is not None:
+            return self.keyset_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -1,20 +1,270 @@
-from abc import ABC, abstractmethod
+from abc import ABC
+from asyncio import get_running_loop
+from asyncio import sleep as async_sleep
+from random import uniform
+from threading import Lock
+from time import monotonic, perf_counter, sleep
+from weakref import WeakKeyDictionary
 
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+
+from utils.timing import record_http_call
+
+
+class CircuitBreakerOpen(requests.exceptions.RequestException):
+    """Raised instead of calling an upstream that keeps failing."""
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures of an upstream. After `failure_threshold` of them the circuit opens and calls
+    fail fast for `recovery_timeout` seconds, then a single trial call is let through (half open) to close it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold, recovery_timeout):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.opened_count = 0
+        self._lock = Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                return True  # the trial call.
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened_count += 1
+                self.state = self.OPEN
+                self.opened_at = monotonic()
+
+    def get_stats(self):
+        return {"state": self.state, "failures": self.failures, "opened_count": self.opened_count}
 
 
 class BaseRequester(ABC):
-    TIMEOUT = 120
     BASE_URL = ""
+    CONNECT_TIMEOUT = 3.05
+    READ_TIMEOUT = 10
+    POOL_CONNECTIONS = 4  # number of hosts whose connections are kept.
+    POOL_MAXSIZE = 10  # connections kept alive per host.
+    MAX_RETRIES = 2
+    BACKOFF_FACTOR = 0.3  # the sleep before the retry n is a random value between 0 and BACKOFF_FACTOR * 2 ** n.
+    RETRY_METHODS = ("get", "put", "delete")  # idempotent methods.
+    RETRY_STATUSES = (502, 503, 504)
+    BREAKER_FAILURE_THRESHOLD = 5
+    BREAKER_RECOVERY_TIMEOUT = 30
+    FALLBACK_TO_LAST_GOOD = False  # return the last good response data while the upstream is failing.
+
+    registry = []
+
+    def __init_subclass__(cls, **kwargs):
+        """Each subclass gets its own session, circuit breaker and stats."""
+        super().__init_subclass__(**kwargs)
+        cls._session = None
+        cls._session_lock = Lock()
+        cls._breaker = CircuitBreaker(cls.BREAKER_FAILURE_THRESHOLD, cls.BREAKER_RECOVERY_TIMEOUT)
+        cls._last_good_data = {}
+        cls._counters = {"requests": 0, "retries": 0, "failures": 0, "short_circuited": 0, "fallbacks": 0}
+        cls._counters_lock = Lock()  # the instances of every thread share them.
+        if cls.BASE_URL:  # bases like AsyncBaseRequester aren't monitored.
+            BaseRequester.registry.append(cls)
+
+    @classmethod
+    def _get_session(cls):
+        with cls._session_lock:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=cls.POOL_CONNECTIONS, pool_maxsize=cls.POOL_MAXSIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                cls._session = session
+            return cls._session
+
+    @classmethod
+    def get_stats(cls):
+        """Circuit breaker state, call counters and connection pool stats, for monitoring."""
+        pools = []
+        if cls._session is not None:
+            for adapter in set(cls._session.adapters.values()):
+                pool_manager = adapter.poolmanager
+                for key in pool_manager.pools.keys():
+                    pool = pool_manager.pools[key]
+                    pools.append(
+                        {
+                            "host": pool.host,
+                            "connections_created": pool.num_connections,
+                            "requests": pool.num_requests,
+                            "idle_connections": pool.pool.qsize() if pool.pool else 0,
+                            "max_size": cls.POOL_MAXSIZE,
+                        }
+                    )
+        with cls._counters_lock:
+            counters = dict(cls._counters)
+        return {"breaker": cls._breaker.get_stats(), **counters, "pools": pools}
+
+    @classmethod
+    def get_all_stats(cls):
+        return {requester.__name__: requester.get_stats() for requester in cls.registry}
+
+    @classmethod
+    def _count(cls, name):
+        with cls._counters_lock:
+            cls._counters[name] += 1
 
     def _get_response_data(self, method, endpoint, params={}):
+        values, fallback_key = self._get_request_values(method, endpoint, params)
+        if not self._breaker.allow_request():
+            return self._short_circuit(fallback_key)
+        try:
+            data = self._request_with_retries(method, values)
+        except requests.exceptions.HTTPError as error:
+            return self._handle_failure(fallback_key, error, error.response.status_code)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as error:
+            return self._handle_failure(fallback_key, error)
+        return self._handle_success(fallback_key, data)
+
+    def _get_request_values(self, method, endpoint, params):
         url = f"{self.BASE_URL}{endpoint}"
-        values = {"url": url, "timeout": self.TIMEOUT}
+        values = {"method": method, "url": url, "timeout": (self.CONNECT_TIMEOUT, self.READ_TIMEOUT)}
         if method == "get":
             values.update({"params": params})
         elif method in ("post", "put", "patch"):
             values.update({"json": params})
-        requests_method = getattr(requests, method)
-        response = requests_method(**values)
-        response.raise_for_status()  # raise HTTPError if response.status_code != 200
-        return response.json()
+        return values, (method, url, repr(params))
+
+    def _request_with_retries(self, method, values):
+        session = self._get_session()
+        retries = self.MAX_RETRIES if method in self.RETRY_METHODS else 0
+        for attempt in range(retries + 1):
+            self._count("requests")
+            started = perf_counter()
+            try:
+                response = session.request(**values)
+                if response.status_code not in self.RETRY_STATUSES or attempt == retries:
+                    response.raise_for_status()  # raise HTTPError if response.status_code >= 400
+                    return response.json()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == retries:
+                    raise
+            finally:
+                record_http_call(perf_counter() - started)
+            self._count("retries")
+            sleep(uniform(0, self.BACKOFF_FACTOR * 2 ** attempt))
+
+    def _short_circuit(self, fallback_key):
+        self._count("short_circuited")
+        return self._fallback(fallback_key, CircuitBreakerOpen(f"Circuit breaker open for {self.BASE_URL}."))
+
+    def _handle_success(self, fallback_key, data):
+        self._breaker.record_success()
+        if self.FALLBACK_TO_LAST_GOOD:
+            self._last_good_data[fallback_key] = data
+        return data
+
+    def _handle_failure(self, fallback_key, error, status_code=None):
+        if status_code is not None and status_code < 500:  # the upstream is healthy, the request isn't.
+            self._breaker.record_success()
+            raise error
+        self._count("failures")
+        self._breaker.record_failure()
+        return self._fallback(fallback_key, error)
+
+    def _fallback(self, fallback_key, error):
+        if self.FALLBACK_TO_LAST_GOOD and fallback_key in self._last_good_data:
+            self._count("fallbacks")
+            return self._last_good_data[fallback_key]
+        raise error
+
+
+class AsyncBaseRequester(BaseRequester):
+    """
+    Awaitable BaseRequester, subclassed the same way but with async methods. It shares the retry,
+    circuit breaker and fallback settings, and keeps a pooled httpx client per event loop.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._clients = WeakKeyDictionary()
+
+    @classmethod
+    def _get_client(cls):
+        loop = get_running_loop()
+        client = cls._clients.get(loop)
+        if client is None:
+            limits = httpx.Limits(max_connections=cls.POOL_MAXSIZE, max_keepalive_connections=cls.POOL_MAXSIZE)
+            timeout = httpx.Timeout(cls.READ_TIMEOUT, connect=cls.CONNECT_TIMEOUT)
+            client = cls._clients[loop] = httpx.AsyncClient(limits=limits, timeout=timeout)
+        return client
+
+    @classmethod
+    async def aclose(cls):
+        """Closes the client of the running event loop, the others belong to loops that can't await it anymore."""
+        client = cls._clients.pop(get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    @classmethod
+    async def aclose_all(cls):
+        """Closes the clients of every async requester, at the ASGI lifespan shutdown."""
+        for requester in cls.registry:
+            if issubclass(requester, AsyncBaseRequester):
+                await requester.aclose()
+
+    @classmethod
+    def get_stats(cls):
+        return {**super().get_stats(), "event_loop_clients": len(cls._clients)}
+
+    async def _get_response_data(self, method, endpoint, params={}):
+        values, fallback_key = self._get_request_values(method, endpoint, params)
+        values["timeout"] = httpx.Timeout(self.READ_TIMEOUT, connect=self.CONNECT_TIMEOUT)
+        if not self._breaker.allow_request():
+            return self._short_circuit(fallback_key)
+        try:
+            data = await self._request_with_retries(method, values)
+        except httpx.HTTPStatusError as error:
+            return self._handle_failure(fallback_key, error, error.response.status_code)
+        except httpx.TransportError as error:
+            return self._handle_failure(fallback_key, error)
+        return self._handle_success(fallback_key, data)
+
+    async def _request_with_retries(self, method, values):
+        client = self._get_client()
+        retries = self.MAX_RETRIES if method in self.RETRY_METHODS else 0
+        for attempt in range(retries + 1):
+            self._count("requests")
+            started = perf_counter()
+            try:
+                response = await client.request(**values)
+                if response.status_code not in self.RETRY_STATUSES or attempt == retries:
+                    response.raise_for_status()  # raise HTTPStatusError if response.status_code >= 400
+                    return response.json()
+            except httpx.TransportError:
+                if attempt == retries:
+                    raise
+            finally:
+                record_http_call(perf_counter() - started)
+            self._count("retries")
+            await async_sleep(uniform(0, self.BACKOFF_FACTOR * 2 ** attempt))
@@ -0,0 +1,15 @@
+from rest_framework.routers import SimpleRouter
+
+
+class BulkRouter(SimpleRouter):
+    """
+    SimpleRouter that also routes PATCH and DELETE of the list url to the bulk_partial_update and bulk_destroy actions
+    of the viewsets that have them.
+    """
+
+    routes = [
+        route._replace(mapping={**route.mapping, "patch": "bulk_partial_update", "delete": "bulk_destroy"})
+        if route.name == "{basename}-list"
+        else route
+        for route in SimpleRouter.routes
+    ]
@@ -0,0 +1,32 @@
+class SparseFieldsSerializerMixin:
+    """
+    Keeps only the fields named in the context's `fields` (every field if it isn't there), so the others aren't
+    computed. `expandable_fields` are the expensive ones, see utils.views.SparseFieldsMixin.
+    """
+
+    expandable_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get("fields")
+        if fields is not None:
+            for name in list(self.fields):
+                if name not in fields:
+                    self.fields.pop(name)
+
+
+class UpdateFieldsSerializerMixin:
+    """
+    ModelSerializer.update that saves only the validated fields (and the auto_now ones) with update_fields, so the
+    other columns aren't written back as they were loaded, over the changes made meanwhile with UPDATE ... F(), like
+    the reserved stock or the orders' totals. The primary key isn't updated.
+    """
+
+    def update(self, instance, validated_data):
+        pk_name = instance._meta.pk.name
+        fields = [name for name in validated_data if name != pk_name]
+        for name in fields:
+            setattr(instance, name, validated_data[name])
+        fields += [field.name for field in instance._meta.concrete_fields if getattr(field, "auto_now", False)]
+        instance.save(update_fields=fields)
+        return instance
@@ -1,12 +1,33 @@
+import json
+from asyncio import iscoroutinefunction
 from random import randint, uniform
+from threading import Thread
+from time import sleep
+from unittest.mock import AsyncMock, Mock, patch
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils.timezone import now
 from mixer.backend.django import mixer
 from orders.models import Order, OrderDetail
+from orders.requester import AsyncDolarSiRequester
 from products.models import Product
+from requests import Session
+from requests.exceptions import ConnectionError
 from rest_framework.test import APIClient
+from rest_framework.viewsets import GenericViewSet
+
+from utils.asgi import LifespanMiddleware
+from utils.cache import SharedCachedValue, VersionedCache
+from utils.middleware import ServerTimingMiddleware
+from utils.requester import BaseRequester, CircuitBreaker, CircuitBreakerOpen
+from utils.timing import get_timings, start_timings, stop_timings
+from utils.views import ValuesListMixin
 
 
 class BaseModelViewSetTestCase(TestCase):
@@ -14,6 +35,7 @@ class BaseModelViewSetTestCase(TestCase):
 
     def setUp(self):
         self.client = APIClient()
+        cache.clear()  # to avoid sharing cached exchange rates between tests.
 
     def _post_create(self, data):
         return self.client.post(reverse(f"{self.url_name}-list"), data, format="json")
@@ -65,6 +87,7 @@ class OrderFactory:
             for order_detail in order_details:
                 order_detail.update({"order": order})
                 OrderFactory.create_order_detail(**order_detail)
+            order.refresh_from_db()  # to get the totals updated by the details.
         return order
 
     @staticmethod
@@ -79,6 +102,273 @@ class OrderFactory:
         return order_detail
 
 
+class QueryBudgetTestCase(BaseModelViewSetTestCase):
+    """
+    Pins the SQL queries and DolarSi calls of the viewset actions. Each action is measured at every size of `sizes`
+    (the rows listed, the details of the order, ...), so one whose queries grow with the size fails.
+    """
+
+    sizes = (1, 15, 100)
+
+    def assert_budget(self, setup, send_request, queries, dolar_si_calls=0):
+        """
+        Calls setup(size) and measures send_request(what setup returned) for each size. The request can't make more
+        than `queries` queries, nor make more at bigger sizes, nor call DolarSi more than dolar_si_calls times.
+        """
+        counts = {}
+        for size in self.sizes:
+            value = setup(size)
+            cache.clear()  # measures the requests without cached responses nor rates.
+            with patch(
+                "orders.requester.DolarSiRequester.get_main_values", return_value=dolar_si_mocked_data
+            ) as get_main_values, CaptureQueriesContext(connection) as context:
+                response = send_request(value)
+                if response.streaming:
+                    b"".join(response.streaming_content)
+            assert response.status_code < 400, (size, getattr(response, "data", None))
+            sqls = "\n".join(query["sql"] for query in context.captured_queries)
+            counts[size] = len(context.captured_queries)
+            assert counts[size] <= queries, f"{counts[size]} queries with size {size}, over {queries}:\n{sqls}"
+            assert get_main_values.call_count <= dolar_si_calls, f"{get_main_values.call_count} calls with size {size}"
+        assert len(set(counts.values())) == 1, f"The queries grow with the size: {counts}"
+
+
+class SharedCachedValueTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def _loader(self):
+        self.calls += 1
+        sleep(0.1)
+        return self.calls
+
+    def test_fresh_value_is_loaded_once(self):
+        """Testing if a fresh value is served from cache without calling the loader again."""
+        cached_value = SharedCachedValue("test:fresh", self._loader, ttl=60)
+        assert cached_value.get() == cached_value.get() == 1
+        assert self.calls == 1
+
+    def test_concurrent_misses_are_merged(self):
+        """Testing if concurrent misses make a single loader call."""
+        cached_value = SharedCachedValue("test:merged", self._loader, ttl=60)
+        results = []
+        threads = [Thread(target=lambda: results.append(cached_value.get())) for x in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [1] * 10
+        assert self.calls == 1
+
+    def test_stale_value_is_served_while_refreshing(self):
+        """Testing if a stale value is served while it is refreshed in background."""
+        cached_value = SharedCachedValue("test:stale", self._loader, ttl=0, stale_ttl=60)
+        assert cached_value.get() == 1
+        assert cached_value.get() == 1  # stale, the refresh is running.
+        cached_value._refresh_thread.join()
+        assert self.calls == 2
+        assert cache.get("test:stale")["value"] == 2
+
+    async def test_async_misses_wait_for_other_worker(self):
+        """Testing if aget waits for the worker holding the lock instead of calling its loader too."""
+        cached_value = SharedCachedValue("test:async", self._loader, ttl=60, async_loader=AsyncMock(return_value=2))
+        cache.add(cached_value.lock_key, True)
+
+        def other_worker():
+            sleep(0.1)
+            cached_value.refresh()
+            cache.delete(cached_value.lock_key)
+
+        thread = Thread(target=other_worker)
+        thread.start()
+        assert await cached_value.aget() == 1
+        thread.join()
+        cache.add(cached_value.lock_key, True)
+        cache.set("test:async", {"value": 1, "expires_at": 0})
+        assert await cached_value.aget() == 1  # stale, another worker is refreshing it.
+        await cached_value._async_refresh_task()
+        cached_value.async_loader.assert_not_awaited()
+
+
+class VersionedCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.versioned_cache = VersionedCache("test", ttl=60)
+        self.calls = 0
+
+    def _loader(self):
+        self.calls += 1
+        return self.calls
+
+    def test_bump_invalidates_only_its_scopes(self):
+        """Testing if bumping a scope invalidates the keys cached under it, and not the others."""
+        assert self.versioned_cache.get_or_set(["a"], "key", self._loader) == 1
+        assert self.versioned_cache.get_or_set(["a"], "key", self._loader) == 1
+        assert self.versioned_cache.get_or_set(["b", "c"], "key", self._loader) == 2
+        self.versioned_cache.bump("c")
+        assert self.versioned_cache.get_or_set(["a"], "key", self._loader) == 1
+        assert self.versioned_cache.get_or_set(["b", "c"], "key", self._loader) == 3
+        assert self.versioned_cache.get_stats() == {"hits": 2, "misses": 3, "hit_ratio": 0.4}
+
+    def test_bump_while_loading(self):
+        """Testing if a value loaded while its scope is bumped isn't served after the bump."""
+
+        def loader():
+            self.versioned_cache.bump("a")
+            return "old"
+
+        assert self.versioned_cache.get_or_set(["a"], "key", loader) == "old"
+        assert self.versioned_cache.get_or_set(["a"], "key", self._loader) == 1
+
+
+class FakeRequester(BaseRequester):
+    BASE_URL = "http://upstream.test"
+    BACKOFF_FACTOR = 0
+    BREAKER_FAILURE_THRESHOLD = 2
+    FALLBACK_TO_LAST_GOOD = True
+
+    def get_values(self):
+        return self._get_response_data(method="get", endpoint="/values")
+
+
+BaseRequester.registry.remove(FakeRequester)  # isn't monitored, nor seen by the other tests.
+
+
+def mock_response(status_code=200, data=None):
+    response = Mock(status_code=status_code)
+    response.json.return_value = data
+    response.raise_for_status.return_value = None
+    return response
+
+
+class BaseRequesterTest(TestCase):
+    def setUp(self):
+        FakeRequester._breaker = CircuitBreaker(FakeRequester.BREAKER_FAILURE_THRESHOLD, 30)
+        FakeRequester._last_good_data = {}
+        FakeRequester._counters = dict.fromkeys(FakeRequester._counters, 0)
+
+    def test_retries_until_success(self):
+        """Testing if failed idempotent requests are retried."""
+        side_effect = [ConnectionError(), mock_response(503), mock_response(data={"value": 1})]
+        with patch.object(Session, "request", side_effect=side_effect) as request:
+            assert FakeRequester().get_values() == {"value": 1}
+        assert request.call_count == 3
+        assert FakeRequester._breaker.state == CircuitBreaker.CLOSED
+
+    def test_breaker_opens_and_falls_back(self):
+        """Testing if the breaker opens after consecutive failures and the last good value is returned."""
+        with patch.object(Session, "request", return_value=mock_response(data={"value": 1})):
+            assert FakeRequester().get_values() == {"value": 1}
+        with patch.object(Session, "request", side_effect=ConnectionError()) as request:
+            for x in range(FakeRequester.BREAKER_FAILURE_THRESHOLD):
+                assert FakeRequester().get_values() == {"value": 1}
+            assert FakeRequester._breaker.state == CircuitBreaker.OPEN
+            request.reset_mock()
+            assert FakeRequester().get_values() == {"value": 1}
+            assert request.call_count == 0  # fails fast.
+        assert FakeRequester.get_stats()["breaker"]["state"] == CircuitBreaker.OPEN
+
+    def test_concurrent_calls_are_counted(self):
+        """Testing if the counters don't lose the calls of concurrent threads."""
+
+        def get_values():
+            for x in range(50):
+                try:
+                    FakeRequester().get_values()
+                except (ConnectionError, CircuitBreakerOpen):
+                    pass
+
+        with patch.object(Session, "request", side_effect=ConnectionError()):
+            threads = [Thread(target=get_values) for x in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        stats = FakeRequester.get_stats()
+        assert stats["failures"] + stats["short_circuited"] == 500
+        assert stats["requests"] == stats["failures"] * (FakeRequester.MAX_RETRIES + 1)
+
+    async def test_lifespan_shutdown_closes_clients(self):
+        """Testing if the ASGI lifespan shutdown closes the httpx clients of the async requesters."""
+        client = AsyncDolarSiRequester._get_client()
+        messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+        send = AsyncMock()
+        await LifespanMiddleware(AsyncMock())({"type": "lifespan"}, AsyncMock(side_effect=messages), send)
+        assert [call.args[0]["type"] for call in send.await_args_list] == [
+            "lifespan.startup.complete",
+            "lifespan.shutdown.complete",
+        ]
+        assert client.is_closed
+        assert AsyncDolarSiRequester.get_stats()["event_loop_clients"] == 0
+
+    def test_breaker_open_without_fallback(self):
+        """Testing if an open breaker raises when there isn't a last good value."""
+        FakeRequester._breaker.record_failure()
+        FakeRequester._breaker.record_failure()
+        with patch.object(Session, "request") as request:
+            self.assertRaises(CircuitBreakerOpen, FakeRequester().get_values)
+        assert request.call_count == 0
+
+
+class ValuesListMixinTest(TestCase):
+    def test_requires_fields_and_represent_rows(self):
+        """Testing if a view without list_values_fields or represent_rows fails when its class is created."""
+        with self.assertRaises(ImproperlyConfigured):
+            type("View", (ValuesListMixin, GenericViewSet), {"list_values_fields": ("id",)})
+        with self.assertRaises(ImproperlyConfigured):
+            type("View", (ValuesListMixin, GenericViewSet), {"represent_rows": lambda self, rows: rows})
+
+
+class ServerTimingMiddlewareTest(TestCase):
+    def _get_log_line(self, logs):
+        assert len(logs.records) == 1
+        return json.loads(logs.records[0].getMessage())
+
+    def test_queries_are_reported(self):
+        """Testing if the queries of a request are counted in the Server-Timing header and the log line."""
+        ProductFactory.create_product()
+        with self.assertLogs("utils.middleware", "INFO") as logs, CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse("products-list"), {"page": 1})
+        queries_count = len(context.captured_queries)
+        assert f'db;desc="{queries_count} queries"' in response["Server-Timing"]
+        assert 'http;desc="0 calls"' in response["Server-Timing"]
+        line = self._get_log_line(logs)
+        assert logs.records[0].levelname == "INFO"
+        assert (line["path"], line["status"], line["db_queries"]) == ("/product/?page=1", 200, queries_count)
+        assert line["over_budget"] == []
+
+    @override_settings(REQUEST_QUERY_BUDGET=0, REQUEST_LATENCY_BUDGET_MS=0)
+    def test_over_budget_is_warned(self):
+        """Testing if the requests over the budgets are logged as warnings."""
+        with self.assertLogs("utils.middleware", "INFO") as logs:
+            self.client.get(reverse("products-list"))
+        assert logs.records[0].levelname == "WARNING"
+        assert self._get_log_line(logs)["over_budget"] == ["queries", "latency"]
+
+    async def test_async_requests(self):
+        """Testing if the middleware keeps ASGI requests async, and counts the queries of their sync_to_async calls."""
+        middleware = ServerTimingMiddleware(AsyncMock(return_value=HttpResponse()))
+        assert iscoroutinefunction(middleware)
+        assert "Server-Timing" in await middleware(RequestFactory().get("/"))
+        with patch("orders.requester.AsyncDolarSiRequester.get_main_values", return_value=dolar_si_mocked_data):
+            response = await self.async_client.get(reverse("orders-async-list"))
+        assert response.status_code == 200
+        assert 'db;desc="0 queries"' not in response["Server-Timing"]
+
+    def test_requester_calls_are_counted(self):
+        """Testing if each call of a requester, retries included, is counted in the current request's timings."""
+        timings, token = start_timings()
+        try:
+            side_effect = [mock_response(503), mock_response(data={"value": 1})]
+            with patch.object(Session, "request", side_effect=side_effect):
+                FakeRequester().get_values()
+        finally:
+            stop_timings(token)
+        assert timings.http_calls == 2
+        assert get_timings() is None
+
+
 dolar_si_mocked_data = [
     {
         "casa": {
@@ -0,0 +1,63 @@
+from contextvars import ContextVar
+from time import perf_counter
+
+_current_timings = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """SQL queries and outbound HTTP calls of a request, with their seconds. See utils.middleware."""
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.http_calls = 0
+        self.http_seconds = 0.0
+
+    def get_seconds(self):
+        return perf_counter() - self.started
+
+
+def start_timings():
+    """Starts the timings of the current context, returns them and the token to reset it."""
+    timings = RequestTimings()
+    return timings, _current_timings.set(timings)
+
+
+def stop_timings(token):
+    _current_timings.reset(token)
+
+
+def get_timings():
+    """The timings of the current request, None outside of one. Copied contexts (sync_to_async) share them."""
+    return _current_timings.get()
+
+
+def time_query(execute, sql, params, many, context):
+    """connection.execute_wrapper that counts and times the queries of the current request."""
+    timings = _current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_queries += 1
+        timings.db_seconds += perf_counter() - started
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """
+    connection_created receiver that adds time_query to the execute wrappers of every connection, so the queries of
+    any thread are counted, like those of the sync_to_async threads of async views.
+    """
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+def record_http_call(seconds):
+    """Counts an outbound HTTP call of the current request, made by a requester."""
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.http_calls += 1
+        timings.http_seconds += seconds
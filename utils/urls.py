@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+from django.urls import path
+
+from utils.views import RequesterStatsAPIView
+
+urlpatterns = [
+    path("requesters/", RequesterStatsAPIView.as_view(), name="requesters-stats"),
+]
@@ -0,0 +1,194 @@
+import json
+from hashlib import md5
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from utils.requester import BaseRequester
+
+
+class RequesterStatsAPIView(APIView):
+    """Circuit breaker state and connection pool stats of every requester, for monitoring."""
+
+    def get(self, request):
+        return Response(BaseRequester.get_all_stats())
+
+
+class ConditionalGetMixin:
+    """
+    ETag for the list and retrieve actions of a ModelViewSet of TimeStampModels, and Last-Modified for retrieve. The
+    ETag comes from the (pk, updated) of the rows served, read with the view's filters and pagination but only those
+    columns, the page's count and links, and MAX(updated) and COUNT(*) probes of the other querysets the payload of
+    those rows depends on. So a request with matching If-None-Match gets a 304 without loading nor serializing rows,
+    and cursor pages don't count the rows. Lists don't send Last-Modified, a deleted row wouldn't move it.
+    """
+
+    def get_conditional_probes(self, queryset):
+        """Querysets of TimeStampModels whose MAX(updated) or count change whenever the payload of `queryset` does."""
+        return []
+
+    def get_etag_extra(self):
+        """Other values the payload depends on, that aren't stored in the probed rows."""
+        return []
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        fields = {"pk", "updated", *(name.lstrip("-") for name in getattr(self, "keyset_ordering", ()))}
+        rows = queryset.values(*fields)
+        page_data = {}
+        if self.pagination_class is not None:
+            paginator = self.pagination_class()
+            rows = paginator.paginate_queryset(rows, request, view=self)
+            page_data = paginator.get_paginated_response([]).data  # its count or links.
+        validators = self.get_validators(request, rows, page_data, queryset.model)
+        return self.conditional_response(request, *validators, False, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        validators = self.get_validators(request, queryset.values("pk", "updated"), {}, queryset.model)
+        return self.conditional_response(request, *validators, True, super().retrieve, *args, **kwargs)
+
+    def conditional_response(self, request, etag, last_modified, send_last_modified, get_response, *args, **kwargs):
+        if etag is None:  # nothing to validate, like a retrieve that will be a 404.
+            return get_response(request, *args, **kwargs)
+        if not send_last_modified:
+            last_modified = None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = get_response(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response["ETag"] = etag
+            if last_modified is not None:
+                response["Last-Modified"] = http_date(last_modified)
+        return response
+
+    def get_validators(self, request, rows, page_data, model):
+        """
+        Returns the (ETag, Last-Modified timestamp) of the response that serves the rows, or (None, None) if there are
+        no rows.
+        """
+        rows = [(row["pk"], row["updated"]) for row in rows]
+        if not rows:
+            return None, None
+        last_modified = max(int(updated.timestamp()) for pk, updated in rows)
+        parts = [request.get_full_path(), request.accepted_media_type, *self.get_etag_extra(), page_data, rows]
+        served = model._default_manager.filter(pk__in=[pk for pk, updated in rows])
+        for probe in self.get_conditional_probes(served):
+            aggregates = probe.order_by().aggregate(last_modified=Max("updated"), count=Count("pk"))
+            parts.append(aggregates["count"])
+            if aggregates["last_modified"] is not None:
+                parts.append(aggregates["last_modified"].isoformat())
+                last_modified = max(last_modified, int(aggregates["last_modified"].timestamp()))
+        etag = md5(json.dumps(parts, default=str).encode()).hexdigest()
+        return quote_etag(etag), last_modified
+
+
+class CachedResponseMixin:
+    """
+    Caches the data of the list and retrieve responses of a ModelViewSet in `response_cache`, a VersionedCache, by
+    path and query parameters. Lists are cached under `list_cache_scopes` and each retrieve under
+    `detail_cache_scopes` and its pk, so the writers invalidate them by bumping those scopes.
+    """
+
+    response_cache = None
+    list_cache_scopes = ("list",)
+    detail_cache_scopes = ("details",)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, self.list_cache_scopes, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self.cached_response(request, (*self.detail_cache_scopes, pk), super().retrieve, *args, **kwargs)
+
+    def cached_response(self, request, scopes, get_response, *args, **kwargs):
+        response = None
+
+        def load():
+            nonlocal response
+            response = get_response(request, *args, **kwargs)
+            return response.data if response.status_code == 200 else None
+
+        key = f"{request.get_full_path()}:{request.accepted_media_type}"
+        data = self.response_cache.get_or_set(scopes, key, load)
+        return response if response is not None else Response(data)
+
+
+class ValuesListMixin:
+    """
+    Lists .values(*list_values_fields) rows represented by `represent_rows(rows)`, skipping the model and serializer
+    instances that dominate the cost of long pages. Both are required, checked when the view class is created.
+    represent_rows must return the same data as the serializer_class, so the rendered JSON is byte-identical.
+    """
+
+    list_values_fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not cls.list_values_fields or not callable(getattr(cls, "represent_rows", None)):
+            raise ImproperlyConfigured(f"{cls.__name__} must set list_values_fields and define represent_rows(rows).")
+
+    def get_list_values_fields(self):
+        return self.list_values_fields
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        queryset = queryset.values(*self.get_list_values_fields())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.represent_rows(page))
+        return Response(self.represent_rows(queryset))
+
+
+class SparseFieldsMixin:
+    """
+    Sparse fieldsets for the list and retrieve responses: ?fields=a,b keeps only those fields, and ?expand=c adds
+    expandable fields of the serializer (expensive ones, like nested lists or values from other services), which
+    are left out when any of both parameters is given and they aren't requested. Without them every field is
+    serialized. Views check is_field_requested to skip the queries and prefetches of the left out fields.
+    """
+
+    sparse_fields_actions = ("list", "retrieve")
+
+    def get_requested_fields(self):
+        """The names of the fields to serialize, or None for all of them."""
+        if not hasattr(self, "_requested_fields"):
+            self._requested_fields = self._parse_requested_fields()
+        return self._requested_fields
+
+    def is_field_requested(self, name):
+        fields = self.get_requested_fields()
+        return fields is None or name in fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        fields = self.get_requested_fields()
+        if fields is not None:
+            context["fields"] = fields
+        return context
+
+    def _parse_requested_fields(self):
+        query_params = self.request.query_params
+        if self.action not in self.sparse_fields_actions or not ({"fields", "expand"} & set(query_params)):
+            return None
+        serializer_class = self.get_serializer_class()
+        all_fields = set(serializer_class().fields)
+        expandable_fields = set(getattr(serializer_class, "expandable_fields", ()))
+        errors = {}
+        requested = {}
+        for param in ("fields", "expand"):
+            names = {name.strip() for name in query_params.get(param, "").split(",") if name.strip()}
+            valid = all_fields if param == "fields" else expandable_fields
+            if names - valid:
+                errors[param] = [f"Campos desconocidos: {', '.join(sorted(names - valid))}."]
+            requested[param] = names
+        if errors:
+            raise ValidationError(errors)
+        fields = requested["fields"] if "fields" in query_params else all_fields - expandable_fields
+        return fields | requested["expand"]